@@ -1,40 +1,79 @@
 from flask import Flask, jsonify, request
-from scripts.songs import songs_bp
-from scripts.recommender import initialize_recommender, run_batch_evals
+from scripts import service
+from scripts.songs import songs_bp, respond
+from scripts.recommender import initialize_recommender
+from scripts.evaluation import run_batch_evals, MAX_EVAL_SONGS, MAX_EVAL_K
+from scripts.ann import ENGINES
+from scripts.diversity import Reranking
 from flask_cors import CORS
 from ui import ui
-from database import load_tracks_data
+from scripts.catalog import get_catalog
+from scripts.ingest import start_updater
+from scripts.metrics import metrics_bp
+from scripts.startup import startup, STARTUP_MODE
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+# any origin may read; POST /songs/ingest is for the ingest client only
+CORS(app, resources={r"^/(?!songs/ingest$).*": {"origins": "*"}})
 
-# initialize the recommender once
-with app.app_context():
-    initialize_recommender()
+# staged startup (scripts/startup.py): the app answers right away and each
+# route opens once the stages it needs are built; /ready reports progress
+startup.add('catalog', service.load_catalog)
+startup.add('lookup', service.build_lookup, after=['catalog'])
+startup.add('search_index', service.build_search_index, after=['catalog'])
+startup.add('feature_store', service.build_feature_store, after=['catalog'])
+startup.add('recommender', initialize_recommender, after=['catalog'])
+# replay ingested tracks, then keep syncing / compacting in the background
+startup.add('ingest', start_updater, after=['lookup', 'search_index', 'feature_store', 'recommender'])
+startup.start(wait=STARTUP_MODE == 'blocking')
 
 app.register_blueprint(songs_bp)
 app.register_blueprint(ui)
+app.register_blueprint(metrics_bp)
 
 # API Endpoints
 
+# (the UI's redirect answers '/' in the browser; probes use /health)
 @app.route('/')
+@app.route('/health')
 def health():
+    # liveness: "starting" while stages build, 503 once one of them failed
+    failed = startup.failed()
     return jsonify({
-        "status": "ok",
+        "status": "failed" if failed else "ok" if startup.ready() else "starting",
+        "failed_stages": failed,
         "service": "song-recommender-api",
         "version": "0.1.0",
-        "endpoints": ["/songs/search", "/songs/recommend", "/songs/details/<track_id>", "/evaluate_model"]
-    })
+        "endpoints": ["/songs/search", "/songs/recommend", "/songs/details/<track_id>", "/songs/ingest",
+                      "/evaluate_model", "/metrics", "/health", "/ready"]
+    }), 503 if failed else 200
+
+@app.route('/ready')
+def ready():
+    """
+    Readiness: status and timings of every startup stage. 200 once all of
+    them are ready, or only the ones in ?stages=a,b (e.g. stages=search_index
+    for a search-only pool), else 503.
+    """
+    stages = [name for name in request.args.get('stages', default='', type=str).split(',') if name]
+    unknown = [name for name in stages if name not in startup.status]
+    if unknown:
+        return jsonify({"error": f"Unknown stages {unknown}"}), 400
+    info = startup.info()
+    return jsonify(info), 200 if startup.ready(*stages) else 503
 
 # this is a test route
 @app.route('/test_connection')
 def test_connection():
+    unavailable = startup.unavailable('catalog')
+    if unavailable:
+        return respond(*unavailable)
     try:
-        df = load_tracks_data()
+        catalog = get_catalog()
 
         # fetch the first 5 rows
-        if df is not None:
-            sample_data = df.head(5).to_dict('records')
+        if catalog is not None:
+            sample_data = catalog.df.head(5).to_dict('records')
             
             # return the data as a JSON response 
             return jsonify({
@@ -52,10 +91,41 @@ def evaluate_model():
 
     try: 
         # pick a number of songs to test
-        # default to 100 for practicality and speed
+        # default to 100 for practicality and speed (all=true tests every song)
+        # (scored on this thread, so at most MAX_EVAL_SONGS; bigger runs: python -m scripts.evaluation)
         n = request.args.get('n', default=100, type=int)
+        full = request.args.get('all', default='false', type=str).lower() == 'true'
+        # fixed seed = reproducible random sample
+        seed = request.args.get('seed', type=int)
+        k = request.args.get('k', default=5, type=int)
+        if not 1 <= n <= MAX_EVAL_SONGS:
+            return jsonify({"error": f"'n' must be between 1 and {MAX_EVAL_SONGS}"}), 400
+        if not 1 <= k <= MAX_EVAL_K:
+            return jsonify({"error": f"'k' must be between 1 and {MAX_EVAL_K}"}), 400
+
+        # optional approximate engine (ivf / lsh) and its recall/latency knob
+        engine = request.args.get('engine', default='exact', type=str)
+        nprobe = request.args.get('nprobe', type=int)
+        if engine not in ENGINES:
+            return jsonify({"error": f"'engine' must be one of {list(ENGINES)}"}), 400
+        unavailable = startup.unavailable('recommender')
+        if unavailable:
+            return respond(*unavailable)
+
+        # optional diversity-aware reranking (reports the metrics before and after)
+        try:
+            reranking = Reranking(diversity=request.args.get('diversity', default=0.0, type=float),
+                                  max_per_artist=request.args.get('max_per_artist', type=int),
+                                  max_per_album=request.args.get('max_per_album', type=int))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if full and len(get_catalog()) > MAX_EVAL_SONGS:
+            return jsonify({"error": f"'all' evaluates at most {MAX_EVAL_SONGS} songs over HTTP; "
+                                     "run python -m scripts.evaluation --all instead"}), 400
 
-        avg_metrics = run_batch_evals(n_songs=n)
+        avg_metrics = run_batch_evals(n_songs=n, engine=engine, nprobe=nprobe, seed=seed, k=k, full=full,
+                                      reranking=reranking)
         return jsonify(avg_metrics)
 
     except Exception as e:
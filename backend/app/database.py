@@ -1,15 +1,285 @@
 import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
 import pandas as pd
+from numpy.lib.format import open_memmap
+
+CSV_PATH = os.path.join(os.path.dirname(__file__), 'cleaned_tracks.csv')
+
+# binary columnar copy of the CSV: one .npy per numeric column, and for string
+# columns int32 codes plus a utf-8 dictionary. Loaded memory-mapped, so worker
+# processes share the same pages through the OS page cache.
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '.tracks_cache')
+CACHE_FORMAT_VERSION = 2
+
+# rows parsed per chunk while streaming the CSV into the cache
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 100000))
+
+# separator between the dictionary strings of a column
+_DICT_SEP = '\x00'
+
+
+def _file_digest(path):
+    """
+    sha1 of the file contents (read in 1 MB chunks)
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_is_fresh(manifest, csv_path, cache_dir):
+    """
+    Check the cache against the CSV. Size and mtime are compared first; the
+    content hash is only recomputed when they changed (e.g. after a touch).
+    """
+    if manifest is None or manifest.get('version') != CACHE_FORMAT_VERSION:
+        return False
+
+    stat = os.stat(csv_path)
+    if manifest['csv_size'] == stat.st_size and manifest['csv_mtime'] == stat.st_mtime:
+        return True
+    if manifest['csv_size'] != stat.st_size or _file_digest(csv_path) != manifest['csv_sha1']:
+        return False
+
+    # same content, newer mtime: remember it so the next check is cheap
+    manifest['csv_mtime'] = stat.st_mtime
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+    except OSError:
+        pass
+    return True
+
+
+def iter_csv_chunks(csv_path=CSV_PATH, usecols=None, chunk_rows=None, dtype=None):
+    """
+    Stream the CSV as DataFrames of at most chunk_rows rows (only usecols,
+    if given), so no more than one chunk is parsed into memory at a time.
+    """
+    yield from pd.read_csv(csv_path, usecols=usecols, chunksize=chunk_rows or CSV_CHUNK_ROWS, dtype=dtype)
+
+
+def _scan_columns(csv_path, chunk_rows=None):
+    """
+    First pass over the CSV: the row count and, per column, the type pandas
+    would infer for the whole file plus what is needed to downcast it
+    (integer range, whether float values survive float32).
+    """
+    n_rows = 0
+    columns = {}
+    for chunk in iter_csv_chunks(csv_path, chunk_rows=chunk_rows):
+        n_rows += len(chunk)
+        for name in chunk.columns:
+            col = chunk[name]
+            info = columns.setdefault(name, {"kinds": set(), "min": None, "max": None, "float32": True})
+            if pd.api.types.is_bool_dtype(col.dtype):
+                info["kinds"].add('bool')
+            elif pd.api.types.is_integer_dtype(col.dtype):
+                info["kinds"].add('int')
+                if len(col):
+                    low, high = int(col.min()), int(col.max())
+                    info["min"] = low if info["min"] is None else min(info["min"], low)
+                    info["max"] = high if info["max"] is None else max(info["max"], high)
+            elif pd.api.types.is_float_dtype(col.dtype):
+                info["kinds"].add('float')
+                values = col.to_numpy(dtype=np.float64)
+                if info["float32"] and not np.array_equal(values.astype(np.float32), values, equal_nan=True):
+                    info["float32"] = False
+            else:
+                info["kinds"].add('strings')
+
+    dtypes = {}
+    for name, info in columns.items():
+        kinds = info["kinds"]
+        if kinds == {'bool'}:
+            dtypes[name] = np.dtype(bool)
+        elif kinds == {'int'}:
+            dtypes[name] = _int_dtype(info["min"], info["max"])
+        elif kinds <= {'int', 'float'} and kinds:
+            # int chunks of a float column are exact in float32 if their range is
+            exact = info["float32"] and (info["min"] is None or max(-info["min"], info["max"]) <= 2 ** 24)
+            dtypes[name] = np.dtype(np.float32 if exact else np.float64)
+        else:
+            # text, or bools/numbers mixed with text or missing bools (object in pandas)
+            dtypes[name] = None
+    return n_rows, list(columns), dtypes
+
+
+def _int_dtype(low, high):
+    """
+    Smallest signed integer dtype holding every value in [low, high].
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if low is not None and info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def build_tracks_cache(csv_path=CSV_PATH, cache_dir=CACHE_DIR, chunk_rows=None):
+    """
+    Stream the CSV into the binary columnar cache, downcasting as it goes:
+    integers to the smallest type that holds their range, floats to float32
+    when that is exact, text to int32 codes plus a dictionary. Columns are
+    written chunk by chunk into preallocated memory-mapped .npy files, so
+    peak memory is one chunk plus the string dictionaries.
+
+    The cache is built in a temporary directory and swapped in, so readers
+    never see a half-written cache.
+    """
+    parent = os.path.dirname(cache_dir)
+    tmp_dir = tempfile.mkdtemp(prefix='.tracks_cache_', dir=parent)
+    try:
+        n_rows, names, dtypes = _scan_columns(csv_path, chunk_rows)
+
+        arrays, dictionaries = {}, {}
+        for i, name in enumerate(names):
+            if dtypes[name] is not None:
+                arrays[name] = open_memmap(os.path.join(tmp_dir, f"col{i}.npy"), mode='w+', dtype=dtypes[name],
+                                           shape=(n_rows,))
+            else:
+                arrays[name] = open_memmap(os.path.join(tmp_dir, f"col{i}.codes.npy"), mode='w+', dtype=np.int32,
+                                           shape=(n_rows,))
+                dictionaries[name] = {}
+
+        # second pass: text columns are read as str so digit-only chunks stay text
+        start = 0
+        text = {name: str for name in dictionaries}
+        for chunk in iter_csv_chunks(csv_path, chunk_rows=chunk_rows, dtype=text):
+            stop = start + len(chunk)
+            for name in names:
+                col = chunk[name]
+                if name in dictionaries:
+                    codes, uniques = pd.factorize(col)
+                    ids = dictionaries[name]
+                    # chunk codes -> codes over the whole file (-1 stays missing)
+                    mapping = np.array([ids.setdefault(value, len(ids)) for value in uniques] + [-1],
+                                       dtype=np.int32)
+                    arrays[name][start:stop] = mapping[codes]
+                else:
+                    arrays[name][start:stop] = col.to_numpy(dtype=dtypes[name])
+            start = stop
+
+        columns = []
+        for i, name in enumerate(names):
+            arrays[name].flush()
+            base = f"col{i}"
+            if name not in dictionaries:
+                columns.append({"name": name, "kind": "array", "file": f"{base}.npy"})
+                continue
+            values = list(dictionaries[name])
+            if any(_DICT_SEP in v for v in values):
+                raise ValueError(f"column '{name}' contains NUL characters")
+            blob = np.frombuffer(_DICT_SEP.join(values).encode('utf-8'), dtype=np.uint8)
+            np.save(os.path.join(tmp_dir, f"{base}.strings.npy"), blob)
+            columns.append({"name": name, "kind": "strings", "file": base, "size": len(values)})
+        del arrays
+
+        stat = os.stat(csv_path)
+        manifest = {
+            "version": CACHE_FORMAT_VERSION,
+            "csv_sha1": _file_digest(csv_path),
+            "csv_size": stat.st_size,
+            "csv_mtime": stat.st_mtime,
+            "rows": n_rows,
+            "columns": columns
+        }
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+        # swap the new cache in
+        old_dir = None
+        if os.path.exists(cache_dir):
+            old_dir = tempfile.mkdtemp(prefix='.tracks_cache_old_', dir=parent)
+            os.rename(cache_dir, os.path.join(old_dir, 'cache'))
+        os.rename(tmp_dir, cache_dir)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+        return manifest
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load_tracks_cache(cache_dir=CACHE_DIR, manifest=None):
+    """
+    Load the cached columns memory-mapped; string columns become categoricals.
+    """
+    manifest = manifest or _read_manifest(cache_dir)
+    data = {}
+    for column in manifest['columns']:
+        path = os.path.join(cache_dir, column['file'])
+        if column['kind'] == 'array':
+            data[column['name']] = np.load(path, mmap_mode='r')
+        else:
+            codes = np.load(f"{path}.codes.npy", mmap_mode='r')
+            blob = np.load(f"{path}.strings.npy").tobytes().decode('utf-8')
+            categories = blob.split(_DICT_SEP) if column['size'] else []
+            data[column['name']] = pd.Categorical.from_codes(codes, categories=categories, validate=False)
+
+    return pd.DataFrame(data, copy=False)
+
+
+def use_csv(csv_path):
+    """
+    Serve another tracks CSV: the binary cache (and with it the derived
+    caches, see shared_arrays.shared_dir) moves next to it, so tools run on a
+    different CSV never overwrite the app's caches.
+    """
+    global CSV_PATH, CACHE_DIR
+    CSV_PATH = os.path.abspath(csv_path)
+    CACHE_DIR = os.path.join(os.path.dirname(CSV_PATH), '.tracks_cache')
+
 
 # load data from CSV
-def load_tracks_data():
+def load_tracks_data(use_cache=True):
     """
     Load tracks data from the local CSV file
+    (through the binary cache, which is rebuilt whenever the CSV changes)
     """
     try:
-        csv_path = os.path.join(os.path.dirname(__file__), 'cleaned_tracks.csv')
+        csv_path = CSV_PATH
+        if use_cache:
+            try:
+                manifest = _read_manifest(CACHE_DIR)
+                if _cache_is_fresh(manifest, csv_path, CACHE_DIR):
+                    df = load_tracks_cache(CACHE_DIR, manifest)
+                    df.attrs['sha1'] = manifest['csv_sha1']
+                    print(f"Loaded {len(df)} records from cache")
+                    return df
+            except Exception as e:
+                print(f"Error loading cache, falling back to CSV: {e}")
+
+        if use_cache:
+            try:
+                # streamed, so the CSV never has to fit in memory as a DataFrame
+                manifest = build_tracks_cache(csv_path, CACHE_DIR)
+                df = load_tracks_cache(CACHE_DIR, manifest)
+                df.attrs['sha1'] = manifest['csv_sha1']
+                print(f"Loaded {len(df)} records from CSV")
+                return df
+            except Exception as e:
+                print(f"Could not write the tracks cache: {e}")
+
         df = pd.read_csv(csv_path)
         print(f"Loaded {len(df)} records from CSV")
+
+        # content hash of the source file, used to version derived caches
+        df.attrs['sha1'] = _file_digest(csv_path)
         return df
     except Exception as e:
         print(f"Error loading CSV: {e}")
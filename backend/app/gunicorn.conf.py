@@ -0,0 +1,27 @@
+"""
+gunicorn settings for the pre-forked production setup (from backend/app):
+
+    gunicorn -c gunicorn.conf.py
+
+preload_app imports wsgi.py once in the master: the catalog, lookup and
+search indexes are built there, and the feature matrices are memory-mapped
+from .derived_cache (built on first start, reused on restarts). Workers are
+forked afterwards and share all of it copy-on-write, so adding workers costs
+little extra memory and no startup time. The master builds everything before
+it listens (STARTUP_MODE=blocking, the startup threads don't survive a fork).
+
+PRELOAD_APP=false trades that for staged startup: every worker answers
+/ready as soon as it is forked and builds its own lookup and search indexes
+in the background (the memory-mapped catalog and feature matrices are still
+shared through the page cache).
+"""
+import os
+
+wsgi_app = 'wsgi:app'
+preload_app = os.environ.get('PRELOAD_APP', 'true').lower() == 'true'
+if preload_app:
+    os.environ.setdefault('STARTUP_MODE', 'blocking')
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
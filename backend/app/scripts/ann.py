@@ -0,0 +1,214 @@
+import copy
+import threading
+import numpy as np
+from .scoring import normalize_rows, top_k_indices
+from .metrics import span
+
+# approximate nearest neighbour backends
+#   exact - brute force over every row (the default)
+#   ivf   - k-means inverted file; nprobe = number of clusters scanned
+#   lsh   - random hyperplane LSH; nprobe = number of hash tables consulted
+ENGINES = ('exact', 'ivf', 'lsh')
+
+
+class IVFIndex:
+    """
+    Inverted file index over L2-normalized rows.
+    Rows are grouped by their nearest (spherical) k-means centroid; a query
+    only scores the rows in its nprobe closest clusters.
+    """
+
+    def __init__(self, features, n_lists=None, default_nprobe=8, random_state=42):
+        self.features = features
+        n = len(features)
+        self.n_lists = max(1, min(n, n_lists or int(np.sqrt(n))))
+        self.default_nprobe = default_nprobe
+
+        # imported here: sklearn is slow to import and only the ivf engine needs it
+        from sklearn.cluster import MiniBatchKMeans
+        kmeans = MiniBatchKMeans(n_clusters=self.n_lists, random_state=random_state,
+                                 batch_size=4096, n_init=3)
+        kmeans.fit(features)
+        self.centroids = normalize_rows(kmeans.cluster_centers_).astype(features.dtype)
+
+        self._set_lists(self._assign(features))
+
+    def _assign(self, X):
+        """
+        Nearest centroid of every row, by cosine so lists match how queries
+        pick clusters.
+        """
+        labels = np.empty(len(X), dtype=np.intp)
+        for start in range(0, len(X), 8192):
+            labels[start:start + 8192] = np.argmax(X[start:start + 8192] @ self.centroids.T, axis=1)
+        return labels
+
+    def _set_lists(self, labels):
+        self.order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=self.n_lists)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def updated(self, features, previous):
+        """
+        Index over features, where row i holds the vector of old row
+        previous[i] (-1 for new or changed rows). Kept rows stay in their
+        list; only the -1 rows are assigned, the centroids are not refit.
+        """
+        old_labels = np.empty(len(self.features), dtype=np.intp)
+        old_labels[self.order] = np.repeat(np.arange(self.n_lists), np.diff(self.offsets))
+
+        previous = np.asarray(previous, dtype=np.intp)
+        kept = previous >= 0
+        labels = np.empty(len(features), dtype=np.intp)
+        labels[kept] = old_labels[previous[kept]]
+        labels[~kept] = self._assign(features[~kept])
+
+        new = copy.copy(self)
+        new.features = features
+        new._set_lists(labels)
+        return new
+
+    def candidates(self, query, nprobe=None):
+        nprobe = min(nprobe or self.default_nprobe, self.n_lists)
+        lists = top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+
+
+class LSHIndex:
+    """
+    Random hyperplane LSH over L2-normalized rows.
+    Each table hashes a row to the sign pattern of n_bits random projections;
+    a query scores the rows that share its bucket in the first nprobe tables.
+    """
+
+    def __init__(self, features, n_tables=8, n_bits=None, default_nprobe=4, random_state=42):
+        self.features = features
+        n, d = features.shape
+        self.n_tables = n_tables
+        # aim for roughly 64 rows per bucket
+        self.n_bits = n_bits or max(1, min(24, int(np.log2(max(n, 2) / 64)) + 1))
+        self.default_nprobe = default_nprobe
+
+        rng = np.random.default_rng(random_state)
+        self.planes = rng.standard_normal((n_tables, d, self.n_bits)).astype(features.dtype)
+        self.weights = (1 << np.arange(self.n_bits)).astype(np.int64)
+
+        self.tables = [self._table(self._hash(features, t)) for t in range(n_tables)]
+
+    @staticmethod
+    def _table(codes):
+        order = np.argsort(codes, kind='stable')
+        return codes[order], order
+
+    def _hash(self, X, table):
+        return ((X @ self.planes[table]) > 0).astype(np.int64) @ self.weights
+
+    def updated(self, features, previous):
+        """
+        Index over features, where row i holds the vector of old row
+        previous[i] (-1 for new or changed rows). Only the -1 rows are hashed.
+        """
+        previous = np.asarray(previous, dtype=np.intp)
+        kept = previous >= 0
+        fresh = np.flatnonzero(~kept)
+
+        tables = []
+        for t, (sorted_codes, order) in enumerate(self.tables):
+            old_codes = np.empty_like(sorted_codes)
+            old_codes[order] = sorted_codes
+            codes = np.empty(len(features), dtype=sorted_codes.dtype)
+            codes[kept] = old_codes[previous[kept]]
+            codes[fresh] = self._hash(features[fresh], t)
+            tables.append(self._table(codes))
+
+        new = copy.copy(self)
+        new.features = features
+        new.tables = tables
+        return new
+
+    def candidates(self, query, nprobe=None):
+        nprobe = min(nprobe or self.default_nprobe, self.n_tables)
+        found = []
+        for t in range(nprobe):
+            sorted_codes, order = self.tables[t]
+            code = self._hash(query[None, :], t)[0]
+            lo, hi = np.searchsorted(sorted_codes, [code, code + 1])
+            found.append(order[lo:hi])
+        return np.unique(np.concatenate(found))
+
+
+def build_index(engine, features):
+    """
+    Build the ANN index for the given engine name.
+    """
+    if engine == 'ivf':
+        return IVFIndex(features)
+    if engine == 'lsh':
+        return LSHIndex(features)
+    raise ValueError(f"Unknown ANN engine '{engine}', expected one of {ENGINES}")
+
+
+class AnnSearcher:
+    """
+    Top-k search over a normalized feature matrix with a pluggable backend.
+    ANN indexes are built lazily on first use and reused afterwards.
+    """
+
+    def __init__(self, features):
+        self.features = features
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index(self, engine):
+        if engine not in self._indexes:
+            with self._lock:
+                if engine not in self._indexes:
+                    self._indexes[engine] = build_index(engine, self.features)
+        return self._indexes[engine]
+
+    def updated(self, features, previous):
+        """
+        Searcher over features, a new version of self.features where row i
+        holds the vector of old row previous[i] (-1 for new or changed rows).
+        Indexes built so far are carried over instead of rebuilt.
+        """
+        new = AnnSearcher(features)
+        with self._lock:
+            indexes = dict(self._indexes)
+        new._indexes = {engine: index.updated(features, previous) for engine, index in indexes.items()}
+        return new
+
+    def search(self, query, k, exclude=None, engine='exact', nprobe=None):
+        """
+        Return (rows, scores) of the k best rows for a normalized query vector.
+        exclude is a row (or list of rows) never returned.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown ANN engine '{engine}', expected one of {ENGINES}")
+
+        if engine == 'exact':
+            with span('ann.score'):
+                scores = self.features @ query
+            with span('ann.top_k'):
+                top = top_k_indices(scores, k, exclude=exclude)
+            return top, scores[top]
+
+        with span('ann.candidates'):
+            candidates = self.index(engine).candidates(query, nprobe)
+            if exclude is not None:
+                candidates = candidates[~np.isin(candidates, exclude)]
+        with span('ann.score'):
+            scores = self.features[candidates] @ query
+        with span('ann.top_k'):
+            top = top_k_indices(scores, k)
+        return candidates[top], scores[top]
+
+    def recall(self, query, k, exclude=None, engine='ivf', nprobe=None):
+        """
+        Share of the exact top-k that the ANN engine also returns for this query.
+        """
+        exact, _ = self.search(query, k, exclude=exclude, engine='exact')
+        approx, _ = self.search(query, k, exclude=exclude, engine=engine, nprobe=nprobe)
+        if len(exact) == 0:
+            return 1.0
+        return len(np.intersect1d(exact, approx)) / len(exact)
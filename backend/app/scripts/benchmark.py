@@ -0,0 +1,310 @@
+"""
+Latency benchmark for the recommender and search endpoints.
+
+Drives the Flask app in-process through its test client, one catalog size at
+a time, and reports p50/p95/p99 latency, QPS and peak RSS per endpoint.
+Sizes are scale factors of cleaned_tracks.csv: values below 1 take the first
+rows of the file, values above 1 append jittered synthetic copies of it.
+
+Run from backend/app:
+    python -m scripts.benchmark --scales 0.5,1,4 --output bench.json
+    python -m scripts.benchmark --baseline bench.json   # flag regressions
+
+Every size runs in its own process so catalogs and peak RSS don't mix.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# endpoint name -> URL builder for one sampled query
+ENDPOINTS = {
+    "get_ml_recommendations": lambda q: f"/songs/recommend?song={quote(q['title'])}",
+    "recommend_full": lambda q: f"/songs/recommend_full?track_id={quote(q['track_id'])}",
+    "search_songs": lambda q: f"/songs/search?q={quote(q['search'])}",
+    "get_song_details": lambda q: f"/songs/details/{quote(q['track_id'])}",
+}
+
+PERCENTILES = (50, 95, 99)
+
+# synthetic copies nudge the audio features by up to this fraction of their range
+FEATURE_JITTER = 0.02
+JITTER_COLS = ['danceability', 'energy', 'loudness', 'tempo', 'valence',
+               'speechiness', 'acousticness', 'instrumentalness', 'liveness']
+
+
+def make_scaled_csv(src_path, dest_path, scale, seed=0):
+    """
+    Write a copy of src_path resized by scale. Copies beyond the original get
+    new track_ids and slightly jittered features, so they are distinct tracks
+    to the recommender while keeping the real genre/artist/title mix.
+    """
+    df = pd.read_csv(src_path)
+    if scale <= 1:
+        df = df.head(max(1, int(round(len(df) * scale))))
+        df.to_csv(dest_path, index=False)
+        return len(df)
+
+    rng = np.random.default_rng(seed)
+    n_target = int(round(len(df) * scale))
+    parts = [df]
+    copy = 1
+    while sum(len(p) for p in parts) < n_target:
+        part = df.head(n_target - sum(len(p) for p in parts)).copy()
+        part['track_id'] = part['track_id'].astype(str) + f"-{copy}"
+        for col in JITTER_COLS:
+            if col in part.columns:
+                lo, hi = df[col].min(), df[col].max()
+                noise = rng.uniform(-FEATURE_JITTER, FEATURE_JITTER, len(part)) * (hi - lo)
+                part[col] = (part[col] + noise).clip(lo, hi)
+        parts.append(part)
+        copy += 1
+
+    out = pd.concat(parts, ignore_index=True)
+    out.to_csv(dest_path, index=False)
+    return len(out)
+
+
+def sample_queries(catalog, n, seed=0):
+    """
+    n query records (title, track_id, search text) drawn from songs the
+    recommender has loaded, so every request exercises the full path.
+    """
+    from . import recommender
+
+    rng = np.random.default_rng(seed)
+    rows = recommender.state.track_rows
+    picked = rows[rng.choice(len(rows), size=min(n, len(rows)), replace=False)]
+    names = catalog.df['track_name']
+
+    queries = []
+    for row in picked:
+        # search on the first one or two words of the title, like a user typing
+        words = str(names.iat[row]).split()
+        queries.append({
+            "title": catalog.title_of(row),
+            "track_id": catalog.track_ids[row],
+            "search": " ".join(words[:rng.integers(1, 3)]).lower(),
+        })
+    return queries
+
+
+def latency_summary(latencies_ms, elapsed_s, errors):
+    lat = np.asarray(latencies_ms)
+    summary = {f"p{p}_ms": round(float(np.percentile(lat, p)), 3) for p in PERCENTILES}
+    summary.update({
+        "mean_ms": round(float(lat.mean()), 3),
+        "max_ms": round(float(lat.max()), 3),
+        "qps": round(len(lat) / elapsed_s, 1) if elapsed_s > 0 else None,
+        "requests": int(len(lat)),
+        "errors": errors,
+    })
+    return summary
+
+
+def bench_endpoint(client, urls, warmup_urls=()):
+    """
+    Time each GET in urls, after sending warmup_urls untimed.
+    """
+    for url in warmup_urls:
+        client.get(url)
+
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for url in urls:
+        t0 = time.perf_counter()
+        response = client.get(url)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if response.status_code != 200:
+            errors += 1
+    return latency_summary(latencies, time.perf_counter() - start, errors)
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_size(csv_path, cache_dir, n_queries, warmup, seed):
+    """
+    Start the app on csv_path (in this process) and benchmark every endpoint.
+    """
+    import database
+    database.CSV_PATH = csv_path
+    database.CACHE_DIR = cache_dir
+
+    t0 = time.perf_counter()
+    from app import app
+    from .startup import startup
+    # until every startup stage is ready
+    startup.wait()
+    startup_s = time.perf_counter() - t0
+    rss_after_startup = peak_rss_mb()
+
+    from .catalog import get_catalog
+    catalog = get_catalog()
+    queries = sample_queries(catalog, n_queries + warmup, seed)
+    client = app.test_client()
+
+    endpoints = {}
+    for name, build_url in ENDPOINTS.items():
+        urls = [build_url(q) for q in queries]
+        # warm-up uses its own queries so the timed ones are still cold
+        endpoints[name] = bench_endpoint(client, urls[:n_queries], urls[n_queries:])
+
+    return {
+        "rows": len(catalog),
+        "startup_s": round(startup_s, 3),
+        "peak_rss_mb_startup": rss_after_startup,
+        "peak_rss_mb": peak_rss_mb(),
+        "endpoints": endpoints,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of p50/p95/p99 against a previous results file: any percentile
+    more than tolerance (fraction) slower at the same scale and endpoint.
+    """
+    regressions = []
+    previous = {size['scale']: size for size in baseline.get('sizes', [])}
+    for size in results['sizes']:
+        before = previous.get(size['scale'])
+        if before is None or 'endpoints' not in size or 'endpoints' not in before:
+            continue
+        for name, stats in size['endpoints'].items():
+            old = before['endpoints'].get(name)
+            if old is None:
+                continue
+            for p in PERCENTILES:
+                key = f"p{p}_ms"
+                if old[key] > 0 and stats[key] > old[key] * (1 + tolerance):
+                    regressions.append({
+                        "scale": size['scale'], "endpoint": name, "metric": key,
+                        "baseline": old[key], "current": stats[key],
+                        "change": round(stats[key] / old[key] - 1, 3)
+                    })
+    return regressions
+
+
+def print_table(results):
+    for size in results['sizes']:
+        if 'error' in size:
+            print(f"\nscale {size['scale']}: {size['error']}")
+            continue
+        print(f"\nscale {size['scale']} ({size['rows']} rows, startup {size['startup_s']}s, "
+              f"peak RSS {size['peak_rss_mb']} MB)")
+        print(f"  {'endpoint':<24}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'qps':>9}{'errors':>8}")
+        for name, s in size['endpoints'].items():
+            print(f"  {name:<24}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['qps']:>9}{s['errors']:>8}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', default='0.25,1,4',
+                        help="comma separated catalog sizes as multiples of the CSV (default 0.25,1,4)")
+    parser.add_argument('--queries', type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=20, help="untimed requests per endpoint")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', default=os.path.join(APP_DIR, 'cleaned_tracks.csv'))
+    parser.add_argument('--output', help="write the results JSON here")
+    parser.add_argument('--baseline', help="previous results JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown vs the baseline before it counts as a regression")
+    parser.add_argument('--verbose', action='store_true', help="show the app's startup output")
+    # internal: benchmark one prepared CSV and write its result to a file
+    parser.add_argument('--worker', nargs=3, metavar=('CSV', 'CACHE_DIR', 'RESULT'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.worker:
+        csv_path, cache_dir, result_path = args.worker
+        result = run_size(csv_path, cache_dir, args.queries, args.warmup, args.seed)
+        with open(result_path, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    scales = [float(s) for s in args.scales.split(',') if s.strip()]
+    results = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "queries": args.queries,
+        "warmup": args.warmup,
+        "seed": args.seed,
+        "sizes": [],
+    }
+
+    work_dir = tempfile.mkdtemp(prefix='song_bench_')
+    try:
+        for scale in scales:
+            csv_path = os.path.join(work_dir, f"tracks_{scale}.csv")
+            n_rows = make_scaled_csv(args.csv, csv_path, scale, seed=args.seed)
+            print(f"Benchmarking scale {scale} ({n_rows} rows)...")
+
+            result_path = os.path.join(work_dir, f"result_{scale}.json")
+            cmd = [sys.executable, '-m', 'scripts.benchmark', '--queries', str(args.queries),
+                   '--warmup', str(args.warmup), '--seed', str(args.seed),
+                   '--worker', csv_path, os.path.join(work_dir, f"cache_{scale}"), result_path]
+            proc = subprocess.run(cmd, cwd=APP_DIR, stdout=None if args.verbose else subprocess.DEVNULL)
+
+            if proc.returncode != 0 or not os.path.exists(result_path):
+                results['sizes'].append({"scale": scale, "rows": n_rows,
+                                         "error": f"worker exited with code {proc.returncode}"})
+                continue
+            with open(result_path) as f:
+                results['sizes'].append({"scale": scale, **json.load(f)})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(results)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results['regressions'] = regressions
+        for r in regressions:
+            print(f"REGRESSION scale {r['scale']} {r['endpoint']} {r['metric']}: "
+                  f"{r['baseline']} -> {r['current']} ms (+{r['change']:.0%})")
+        if regressions:
+            exit_code = 1
+        else:
+            print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
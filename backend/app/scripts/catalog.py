@@ -0,0 +1,275 @@
+import threading
+import numpy as np
+import pandas as pd
+from database import load_tracks_data
+from .lookup import TrackLookup
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _written_column(column, n_rows, positions, values):
+    """
+    Copy of column grown to n_rows with values written at positions (rows
+    past the end of column start out missing). Categoricals gain whatever
+    new categories the values need; existing codes don't move.
+    """
+    n_old = len(column)
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = np.full(n_rows, -1, dtype=np.int32)
+        codes[:n_old] = column.cat.codes.to_numpy()
+        dtype = column.dtype
+        if len(positions):
+            # look values up through the categories' (cached) hash table
+            present = np.array([not _missing(v) for v in values])
+            keys = pd.Index([str(v) for v in np.asarray(values, dtype=object)[present]], dtype=object)
+            found = dtype.categories.get_indexer(keys)
+            if (found < 0).any():
+                categories = dtype.categories.append(pd.Index(pd.unique(keys[found < 0]), dtype=object))
+                dtype = pd.CategoricalDtype(categories)
+                found = categories.get_indexer(keys)
+            value_codes = np.full(len(values), -1, dtype=np.int32)
+            value_codes[present] = found
+            # in order, so a later write to the same row wins
+            for position, code in zip(positions, value_codes):
+                codes[position] = code
+        return pd.Categorical.from_codes(codes, dtype=dtype, validate=False)
+
+    old = column.to_numpy()
+    if pd.api.types.is_bool_dtype(column.dtype) or not pd.api.types.is_numeric_dtype(column.dtype):
+        out = np.empty(n_rows, dtype=object)
+        out[:n_old] = old
+        out[n_old:] = np.nan
+        for position, value in zip(positions, values):
+            out[position] = np.nan if _missing(value) else value
+        if pd.api.types.is_bool_dtype(column.dtype) and not any(_missing(v) for v in out[n_old:]):
+            return out.astype(bool)
+        return out
+
+    positions = np.asarray(positions, dtype=np.intp)
+    new_values = pd.to_numeric(pd.Series(list(values), dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    if pd.api.types.is_integer_dtype(column.dtype) and np.all(np.isnan(new_values) |
+                                                              (new_values == np.round(new_values))):
+        return _written_integers(column, n_rows, positions, new_values)
+    dtype = old.dtype
+    if dtype.kind in 'iu' or dtype == object:
+        # non-integer values for an integer column (ingest validation rejects them)
+        dtype = np.dtype(np.float64)
+        old = column.to_numpy(dtype=np.float64, na_value=np.nan)
+    elif dtype == np.float32 and not np.array_equal(new_values.astype(np.float32), new_values, equal_nan=True):
+        dtype = np.dtype(np.float64)
+    out = np.full(n_rows, np.nan, dtype=dtype)
+    out[:n_old] = old
+    out[positions] = new_values
+    return out
+
+
+def _written_integers(column, n_rows, positions, new_values):
+    """
+    _written_column for an integer column and whole-number values (NaN =
+    missing). The column keeps its integer type: rows left without a value
+    make it a nullable Int array (<NA>) instead of turning it into floats,
+    and it is only widened when a value doesn't fit.
+    """
+    n_old = len(column)
+    width = np.dtype(getattr(column.dtype, 'numpy_dtype', column.dtype))
+    old = column.to_numpy(dtype=np.float64, na_value=np.nan)
+    missing = np.ones(n_rows, dtype=bool)
+    missing[:n_old] = np.isnan(old)
+    out = np.zeros(n_rows, dtype=np.int64)
+    out[:n_old][~missing[:n_old]] = old[~missing[:n_old]]
+    # in order, so a later write to the same row wins (missing or not)
+    for position, value in zip(positions, new_values):
+        missing[position] = np.isnan(value)
+        if not missing[position]:
+            out[position] = value
+
+    values = out[~missing]
+    if len(values) and not (np.iinfo(width).min <= values.min() and values.max() <= np.iinfo(width).max):
+        # the loader downcasts to the smallest type that held the CSV's range
+        width = np.dtype(np.int64)
+    if not missing.any():
+        return out.astype(width)
+    return pd.arrays.IntegerArray(out.astype(width), missing)
+
+
+def _encode(column):
+    """
+    Integer codes (-1 for missing) and the distinct values of a column,
+    reusing the categorical codes when the column already is one.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), np.asarray(column.cat.categories, dtype=object)
+    codes, uniques = pd.factorize(column)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+class Catalog:
+    """
+    The single in-process copy of the tracks table.
+
+    Blueprints and the recommender all read from this object instead of
+    loading their own DataFrames. Besides the table it keeps:
+      - genre, artist and album categorical codes (one small int per row;
+        album_codes is None without an album_name column)
+      - track_ids as str and the TrackLookup id/title/name indexes (built
+        on first use, see scripts/startup.py)
+      - a version (the source hash) for derived caches
+    Row positions are shared by every structure built on top of it.
+
+    A Catalog is never modified: upsert() returns a new one, so readers
+    holding the old object keep a consistent view.
+    """
+
+    def __init__(self, df, lookup=None, source=None):
+        self.df = df
+        # catalogs loaded from the CSV are identified by its hash; ingested
+        # ones by a hash chained from their parent (see scripts/ingest.py)
+        self.from_file = source is None and df.attrs.get('sha1') is not None
+        self.source = source or df.attrs.get('sha1')
+        self.genre_codes, self.genre_names = _encode(df['track_genre'])
+        self.artist_codes, self.artist_names = _encode(df['artists'])
+        self.album_codes, self.album_names = _encode(df['album_name']) if 'album_name' in df.columns else (None, None)
+        self.track_ids = df['track_id'].astype(str).to_numpy()
+        self._lookup = lookup
+        self._lookup_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def lookup(self):
+        if self._lookup is None:
+            with self._lookup_lock:
+                if self._lookup is None:
+                    self._lookup = TrackLookup(self.df)
+        return self._lookup
+
+    @property
+    def version(self):
+        """
+        Identifies the data behind the catalog, the same in every process
+        that loads or replays it (None when the source is unknown).
+        """
+        return self.source
+
+    def upsert(self, records, source=None):
+        """
+        New Catalog with records (dicts of column -> value) applied.
+
+        A record updates the given columns of every row with its track_id
+        (only the row of its track_genre, when it has one); records matching
+        no row are appended. track_search is derived from track_name and
+        artists when not given. Returns (catalog, updated rows, appended rows).
+        """
+        df = self.df
+        n_old = len(df)
+        writes = {column: ([], []) for column in df.columns}
+        updated, appended = set(), []
+        batch_rows = {}      # track_id -> rows appended by this batch
+        derive_search = set()
+
+        for record in records:
+            track_id = str(record['track_id'])
+            genre = record.get('track_genre')
+            rows = [int(r) for r in self.rows_for_id(track_id)] + batch_rows.get(track_id, [])
+            if not _missing(genre):
+                rows = [r for r in rows if self._genre_after(r, writes) == str(genre)]
+
+            if rows:
+                updated.update(r for r in rows if r < n_old)
+            else:
+                rows = [n_old + len(appended)]
+                appended.append(rows[0])
+                batch_rows.setdefault(track_id, []).append(rows[0])
+
+            for column, value in record.items():
+                if column in writes:
+                    for row in rows:
+                        writes[column][0].append(row)
+                        writes[column][1].append(value)
+            if 'track_search' not in record and ('track_name' in record or 'artists' in record or
+                                                 rows[0] >= n_old):
+                derive_search.update(rows)
+
+        n_rows = n_old + len(appended)
+        data = {column: _written_column(df[column], n_rows, positions, values) if positions or n_rows > n_old
+                else df[column] for column, (positions, values) in writes.items()}
+        new_df = pd.DataFrame(data, copy=False)
+
+        if derive_search and 'track_search' in new_df.columns:
+            rows = sorted(derive_search)
+            names, artists = new_df['track_name'].iloc[rows], new_df['artists'].iloc[rows]
+            titles = [f"{n} - {', '.join(str(a).split(';'))}" if pd.notna(n) and pd.notna(a) else None
+                      for n, a in zip(names, artists)]
+            new_df['track_search'] = _written_column(new_df['track_search'], n_rows, rows, titles)
+
+        changed = sorted(updated) + appended
+        catalog = Catalog(new_df, lookup=self.lookup.updated(new_df, changed), source=source)
+        return catalog, sorted(updated), appended
+
+    def _genre_after(self, row, writes):
+        """
+        Genre of a row including the writes queued so far in an upsert.
+        """
+        positions, values = writes.get('track_genre', ([], []))
+        for position, value in zip(reversed(positions), reversed(values)):
+            if position == row:
+                return None if _missing(value) else str(value)
+        return self.genre_of(row) if row < len(self.df) else None
+
+    def row_for_id(self, track_id):
+        """
+        First row with this track_id, or None.
+        """
+        rows = self.lookup.rows_for_id(track_id)
+        return int(rows[0]) if len(rows) else None
+
+    def rows_for_id(self, track_id):
+        return self.lookup.rows_for_id(track_id)
+
+    def rows_for_ids(self, track_ids):
+        return self.lookup.rows_for_ids(track_ids)
+
+    def genre_of(self, row):
+        code = self.genre_codes[row]
+        return self.genre_names[code] if code >= 0 else None
+
+    def title_of(self, row):
+        """
+        Normalized title of a row (track_search if available, else track_name).
+        """
+        for col in ('track_search', 'track_name'):
+            if col in self.df.columns:
+                value = self.df[col].iat[row]
+                if pd.notna(value):
+                    return str(value).strip()
+        return None
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Return the shared Catalog, loading it on first use (None if loading failed).
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                df = load_tracks_data()
+                if df is not None:
+                    _catalog = Catalog(df)
+    return _catalog
+
+
+def set_catalog(catalog):
+    """
+    Replace the shared Catalog (see scripts/ingest.py); code still holding
+    the previous one keeps a consistent view of it.
+    """
+    global _catalog
+    _catalog = catalog
@@ -0,0 +1,187 @@
+"""
+Diversity-aware reranking of recommendation lists.
+
+The scorer returns a candidate pool (the best pool_size(k) tracks by
+similarity to the seed) and the reranker picks k of them greedily by Maximal
+Marginal Relevance:
+    next = argmax  (1 - diversity) * relevance - diversity * max similarity
+                   to the tracks already picked
+with optional caps on tracks per artist and per album. The pool's pairwise
+similarities are one batched matrix product and every greedy step is one
+masked argmax over the pool, for one list or a block of seeds at once (the
+evaluation reranks every seed together).
+
+diversity=0 without caps keeps the scorer's order. Albums are told apart by
+artist and album name, so caps don't mix up same-named albums.
+"""
+import os
+import numpy as np
+from .evaluation import quality_metrics
+from .scoring import CompactFeatures
+
+# candidates scored per recommended track, and the most a pool may hold
+POOL_FACTOR = int(os.environ.get('RERANK_POOL_FACTOR', 5))
+MAX_POOL = 500
+# seeds per block in batch reranking: block x pool x pool similarities
+BLOCK_CELLS = 1 << 22
+
+
+class Reranking:
+    """
+    Options of one rerank: diversity in [0, 1] (the MMR trade-off) and
+    max_per_artist / max_per_album caps (None = no cap). Raises ValueError
+    for anything else.
+    """
+
+    def __init__(self, diversity=0.0, max_per_artist=None, max_per_album=None):
+        if isinstance(diversity, bool) or not isinstance(diversity, (int, float)) or not 0 <= diversity <= 1:
+            raise ValueError("'diversity' must be a number between 0 and 1")
+        for name, cap in (('max_per_artist', max_per_artist), ('max_per_album', max_per_album)):
+            if cap is not None and (isinstance(cap, bool) or not isinstance(cap, int) or cap < 1):
+                raise ValueError(f"'{name}' must be a positive integer")
+        self.diversity = float(diversity)
+        self.max_per_artist = max_per_artist
+        self.max_per_album = max_per_album
+
+    @property
+    def active(self):
+        return self.diversity > 0 or self.max_per_artist is not None or self.max_per_album is not None
+
+    def key(self):
+        """
+        Hashable form of the options (for result cache keys).
+        """
+        return self.diversity, self.max_per_artist, self.max_per_album
+
+    def pool_size(self, k):
+        """
+        Candidates to score for a list of k (k itself when inactive).
+        """
+        return min(max(k * POOL_FACTOR, k), MAX_POOL) if self.active else k
+
+    def options(self):
+        options = {"diversity": self.diversity}
+        if self.max_per_artist is not None:
+            options["max_per_artist"] = self.max_per_artist
+        if self.max_per_album is not None:
+            options["max_per_album"] = self.max_per_album
+        return options
+
+    def _groups(self, catalog, rows):
+        """
+        (codes, cap) per active cap for catalog rows of any shape, -1 where
+        a row has no value.
+        """
+        groups = []
+        artists = catalog.artist_codes[rows]
+        if self.max_per_artist is not None:
+            groups.append((artists, self.max_per_artist))
+        if self.max_per_album is not None and catalog.album_codes is not None:
+            albums = catalog.album_codes[rows].astype(np.int64)
+            # (artist, album) pairs, so same-named albums of other artists don't share a cap
+            keys = artists.astype(np.int64) * (len(catalog.album_names) + 1) + albums
+            groups.append((np.where((albums < 0) | (artists < 0), -1, keys), self.max_per_album))
+        return groups
+
+    def select(self, relevance, similarity, k, groups=()):
+        """
+        Greedy MMR over a block of pools: relevance (n, P) with -inf for empty
+        slots, similarity (n, P, P) and groups a list of ((n, P) codes, cap).
+        Returns (n, k) pool positions in pick order, -1 padded.
+        """
+        n, size = relevance.shape
+        k = max(0, min(k, size))
+        picked = np.full((n, k), -1, dtype=np.intp)
+        available = np.isfinite(relevance)
+        seeds = np.arange(n)
+        redundancy = np.zeros((n, size), dtype=similarity.dtype)
+        counts = [np.zeros((n, size), dtype=np.int32) for _ in groups]
+        gain = (1.0 - self.diversity) * np.where(available, relevance, 0.0)
+        for step in range(k):
+            if step == 0 or self.diversity == 0:
+                score = np.where(available, relevance, -np.inf)
+            else:
+                score = np.where(available, gain - self.diversity * redundancy, -np.inf)
+            # ties go to the lower pool position, i.e. the more relevant track
+            choice = score.argmax(axis=1)
+            ok = available[seeds, choice]
+            if not ok.any():
+                break
+            hit, choice = seeds[ok], choice[ok]
+            # pools that ran dry drop out; until then update whole arrays in place
+            rows = slice(None) if len(hit) == n else hit
+            picked[hit, step] = choice
+            available[hit, choice] = False
+            picked_similarity = similarity[hit, choice]
+            redundancy[rows] = picked_similarity if step == 0 else \
+                np.maximum(redundancy[rows], picked_similarity)
+            for (codes, cap), count in zip(groups, counts):
+                chosen = codes[hit, choice][:, None]
+                count[rows] += (codes[rows] == chosen) & (chosen >= 0)
+                available[rows] &= count[rows] < cap
+        return picked
+
+    def apply(self, catalog, seed_row, rows, sims, features, positions, k):
+        """
+        Rerank one scored pool: rows (catalog rows, best first) with their
+        similarities sims, and their vectors at positions of features (the
+        matrix they were scored on). Returns (rows, sims, report) with the
+        chosen k and the genre relevance / artist diversity of the list
+        before (top k by similarity) and after reranking.
+        """
+        rows, sims = np.asarray(rows, dtype=np.intp), np.asarray(sims)
+        positions = np.asarray(positions, dtype=np.intp)[None, :]
+        similarity = pool_similarities(features, positions)
+        relevance = sims.astype(similarity.dtype)[None, :]
+        picked = self.select(relevance, similarity, k, self._groups(catalog, rows[None, :]))[0]
+        picked = picked[picked >= 0]
+
+        report = self.options()
+        report["pool"] = int(len(rows))
+        for name, chosen in (("before", rows[:k]), ("after", rows[picked])):
+            relevance_score, diversity_score, _ = quality_metrics([seed_row], chosen[None, :], catalog.genre_codes,
+                                                                  catalog.artist_codes)
+            report[name] = {"genre_relevance": round(float(relevance_score[0]), 4),
+                            "artist_diversity": round(float(diversity_score[0]), 4)}
+        return rows[picked], sims[picked], report
+
+    def apply_batch(self, catalog, features, track_rows, seed_idx, top_idx, k):
+        """
+        Rerank the pools of many seeds at once, for the evaluation: seed_idx
+        and top_idx ((n_seeds, P), -1 padded, best first) are rows of
+        features, track_rows maps them to catalog rows. Returns (n_seeds, k)
+        rows of features, -1 padded.
+        """
+        top_idx = np.asarray(top_idx, dtype=np.intp)
+        n, size = top_idx.shape
+        result = np.full((n, min(k, size)), -1, dtype=np.intp)
+        block = max(1, BLOCK_CELLS // max((size + 1) ** 2, 1))
+        for start in range(0, n, block):
+            top = top_idx[start:start + block]
+            valid = top >= 0
+            safe = np.where(valid, top, 0)
+            # the seed is position 0 of its extended pool: row 0 holds the relevance
+            similarity = pool_similarities(features, np.column_stack([seed_idx[start:start + block], safe]))
+            relevance = np.where(valid, similarity[:, 0, 1:], -np.inf)
+            groups = [(np.where(valid, codes, -1), cap) for codes, cap in self._groups(catalog, track_rows[safe])]
+            picked = self.select(relevance, similarity[:, 1:, 1:], k, groups)
+            result[start:start + len(top)] = np.where(picked >= 0, np.take_along_axis(top, np.maximum(picked, 0),
+                                                                                       axis=1), -1)
+        return result
+
+
+def pool_similarities(features, positions):
+    """
+    (n, P, P) pairwise similarities of the rows at positions (n, P) of
+    features: a normalized dense matrix or CompactFeatures, whose genre term
+    is added where two rows share a genre code.
+    """
+    if isinstance(features, CompactFeatures):
+        numeric = features.numeric[positions]
+        weight = features.weight[positions]
+        codes = features.codes[positions]
+        similarity = numeric @ numeric.transpose(0, 2, 1)
+        similarity += (weight[:, :, None] * weight[:, None, :]) * (codes[:, :, None] == codes[:, None, :])
+        return similarity
+    vectors = np.asarray(features[positions.ravel()]).reshape(positions.shape + (-1,))
+    return vectors @ vectors.transpose(0, 2, 1)
@@ -0,0 +1,232 @@
+"""
+Offline quality evaluation: genre relevance, artist diversity and query
+speed of the recommender over a sample of seeds (or the whole catalog).
+
+/evaluate_model runs it on the request thread, within MAX_EVAL_SONGS seeds
+and without the process pool. Larger runs go through the command line, from
+backend/app:
+    python -m scripts.evaluation --all --jobs 0
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import recommender
+from .ann import ENGINES
+from .scoring import top_k_similar, DEFAULT_BLOCK_SIZE
+from .shared_arrays import offline_pool
+
+# most seeds (n, or the catalog size with all=true) and largest k /evaluate_model scores per request
+MAX_EVAL_SONGS = int(os.environ.get('EVAL_MAX_SONGS', 5000))
+MAX_EVAL_K = 100
+
+# state handed to forked pool workers (inherited copy-on-write, never pickled)
+_pool_state = {}
+
+
+def quality_metrics(seed_idx, top_idx, genre_codes, artist_codes):
+    """
+    Per-seed genre relevance and artist diversity for a (n_seeds, k) block of
+    recommendations (-1 marks an empty slot), compared on categorical codes
+    instead of strings.
+      genre_relevance  - share of recommendations in the seed's genre
+      artist_diversity - share of recommendations by a different artist
+    Also returns the number of recommendations per seed.
+    """
+    seed_idx = np.asarray(seed_idx)
+    top_idx = np.asarray(top_idx).reshape(len(seed_idx), -1)
+    valid = top_idx >= 0
+    safe = np.where(valid, top_idx, 0)
+    n_valid = valid.sum(axis=1)
+    denominator = np.maximum(n_valid, 1)
+
+    same_genre = (genre_codes[safe] == genre_codes[seed_idx][:, None]) & valid
+    other_artist = (artist_codes[safe] != artist_codes[seed_idx][:, None]) & valid
+    return same_genre.sum(axis=1) / denominator, other_artist.sum(axis=1) / denominator, n_valid
+
+
+def _score_block(bounds):
+    """
+    Pool worker: exact top-k for one block of seeds (features come from the
+    parent process through fork).
+    """
+    start, stop = bounds
+    seeds = _pool_state['seeds'][start:stop]
+    features = _pool_state['features']
+    top, _ = top_k_similar(features, features[seeds], _pool_state['k'], exclude=seeds)
+    return start, top
+
+
+def top_k_for_seeds(seed_idx, k=5, engine='exact', nprobe=None, block_size=DEFAULT_BLOCK_SIZE, n_jobs=1,
+                    state=None):
+    """
+    Top-k recommendation indices for every seed, shape (n_seeds, k), -1 padded.
+    Exact search runs in blocked matrix products, optionally spread over a
+    process pool; ANN engines answer one seed at a time.
+    state is the RecommenderState to score (default: the current one).
+    """
+    state = state or recommender.state
+    features = state.feature_matrix
+    seed_idx = np.asarray(seed_idx, dtype=np.intp)
+    k = min(k, len(features) - 1)
+
+    if engine != 'exact':
+        # ANN can return fewer than k candidates; missing slots are -1
+        result = np.full((len(seed_idx), k), -1, dtype=np.intp)
+        for j, i in enumerate(seed_idx):
+            rows, _ = state.searcher.search(features[i], k, exclude=i, engine=engine, nprobe=nprobe)
+            result[j, :len(rows)] = rows
+        return result
+
+    blocks = [(start, min(start + block_size, len(seed_idx))) for start in range(0, len(seed_idx), block_size)]
+    can_fork = 'fork' in multiprocessing.get_all_start_methods()
+    if n_jobs <= 1 or len(blocks) <= 1 or not can_fork:
+        top, _ = top_k_similar(features, features[seed_idx], k, exclude=seed_idx, block_size=block_size)
+        return top
+
+    _pool_state.update(features=features, seeds=seed_idx, k=k)
+    try:
+        result = np.empty((len(seed_idx), k), dtype=np.intp)
+        with offline_pool() as context, ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as pool:
+            for start, top in pool.map(_score_block, blocks):
+                result[start:start + len(top)] = top
+        return result
+    finally:
+        _pool_state.clear()
+
+
+def run_batch_evals(n_songs=100, engine='exact', nprobe=None, seed=None, k=5, n_jobs=1, full=False,
+                    reranking=None):
+    """
+    Run the evaluation on n songs to calculate average metrics fro the whole system.
+
+    full=True evaluates every song in the catalog; otherwise n_songs are
+    sampled at random (pass seed for a reproducible sample). Engine 'ivf' /
+    'lsh' also reports the average recall against exact search.
+    With an active reranking (scripts.diversity.Reranking) every seed's list
+    is reranked from a larger pool; the averages are for the reranked lists
+    and "reranking" has both metrics before and after.
+    """
+    # one snapshot for the whole run (ingest may swap in a new state meanwhile)
+    state = recommender.state
+    if state is None:
+        return {"error": "Recommender not initialized."}
+
+    catalog = state.catalog
+    n_total = len(state.track_rows)
+    if full:
+        seed_idx = np.arange(n_total)
+    else:
+        # Ensure we don't request more songs than available
+        if n_songs > n_total:
+            n_songs = n_total
+            print(f"Adjusting n_songs to {n_songs} (available samples)")
+        rng = np.random.default_rng(seed)
+        seed_idx = rng.choice(n_total, n_songs, replace=False)
+
+    if len(seed_idx) == 0:
+        return {"error": "All evaluation runs failed."}
+    print(f"Running evaluation on {len(seed_idx)} songs...")
+
+    # build the ANN index up front so it isn't counted in the query speed
+    if engine != 'exact':
+        state.searcher.index(engine)
+
+    n_jobs = os.cpu_count() if n_jobs in (0, None) else n_jobs
+    rerank = reranking is not None and reranking.active
+    start_time = time.time()
+    top_idx = top_k_for_seeds(seed_idx, k=reranking.pool_size(k) if rerank else k, engine=engine, nprobe=nprobe,
+                              n_jobs=n_jobs, state=state)
+    if rerank:
+        pool_idx = top_idx
+        top_idx = reranking.apply_batch(catalog, state.feature_matrix, state.track_rows, seed_idx, pool_idx, k)
+    elapsed_ms = (time.time() - start_time) * 1000
+
+    genre_codes = catalog.genre_codes[state.track_rows]
+    artist_codes = catalog.artist_codes[state.track_rows]
+    genre_relevance, artist_diversity, n_recs = quality_metrics(seed_idx, top_idx, genre_codes, artist_codes)
+    if rerank:
+        before_relevance, before_diversity, _ = quality_metrics(seed_idx, pool_idx[:, :k], genre_codes, artist_codes)
+
+    # seeds without any recommendation count as failed runs
+    ok = n_recs > 0
+    failed_runs = int((~ok).sum())
+    if not ok.any():
+        return {"error": "All evaluation runs failed."}
+    seed_idx, top_idx = seed_idx[ok], top_idx[ok]
+    genre_relevance, artist_diversity = genre_relevance[ok], artist_diversity[ok]
+    if rerank:
+        before_relevance, before_diversity = before_relevance[ok], before_diversity[ok]
+        pool_idx = pool_idx[ok]
+
+    # per-genre breakdown (keyed by the seed's genre)
+    seed_genres = genre_codes[seed_idx]
+    counts = np.bincount(seed_genres, minlength=len(catalog.genre_names))
+    relevance_sums = np.bincount(seed_genres, weights=genre_relevance, minlength=len(counts))
+    diversity_sums = np.bincount(seed_genres, weights=artist_diversity, minlength=len(counts))
+    per_genre = {
+        str(catalog.genre_names[g]): {
+            "songs_tested": int(counts[g]),
+            "average_genre_relevance": round(float(relevance_sums[g] / counts[g]), 4),
+            "average_artist_diversity": round(float(diversity_sums[g] / counts[g]), 4)
+        }
+        for g in np.flatnonzero(counts)
+    }
+
+    print(f"Evaluation complete: {len(seed_idx)} successful, {failed_runs} failed ({elapsed_ms:.0f}ms)")
+
+    # return averages
+    results = {
+        "total_songs_tested": int(len(seed_idx)),
+        "failed_runs": failed_runs,
+        "average_query_speed_ms": round(elapsed_ms / (len(seed_idx) + failed_runs), 4),
+        "average_genre_relevance": round(float(genre_relevance.mean()), 4),
+        "average_artist_diversity": round(float(artist_diversity.mean()), 4),
+        "per_genre": per_genre
+    }
+    if seed is not None:
+        results["seed"] = seed
+    if rerank:
+        results["reranking"] = {
+            **reranking.options(),
+            "pool": reranking.pool_size(k),
+            "before": {"average_genre_relevance": round(float(before_relevance.mean()), 4),
+                       "average_artist_diversity": round(float(before_diversity.mean()), 4)},
+            "after": {"average_genre_relevance": round(float(genre_relevance.mean()), 4),
+                      "average_artist_diversity": round(float(artist_diversity.mean()), 4)}
+        }
+
+    if engine != 'exact':
+        exact_idx = top_k_for_seeds(seed_idx, k=k, n_jobs=n_jobs, state=state)
+        # recall of the engine's own top k, before any reranking
+        found_idx = pool_idx[:, :k] if rerank else top_idx
+        hits = [len(np.intersect1d(a[a >= 0], e)) / len(e) for a, e in zip(found_idx, exact_idx) if len(e)]
+        results["engine"] = engine
+        results["average_recall"] = round(float(np.mean(hits)), 4) if hits else 1.0
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--n', type=int, default=100, help="songs to sample")
+    parser.add_argument('--all', action='store_true', help="evaluate every song in the catalog")
+    parser.add_argument('--k', type=int, default=5, help="recommendations per song")
+    parser.add_argument('--seed', type=int, default=None, help="random seed of the sample")
+    parser.add_argument('--engine', default='exact', choices=ENGINES, help="search engine")
+    parser.add_argument('--nprobe', type=int, default=None, help="clusters (ivf) or hash tables (lsh) to search")
+    parser.add_argument('--jobs', type=int, default=0, help="worker processes (0 = one per CPU)")
+    args = parser.parse_args(argv)
+    if args.n < 1 or args.k < 1:
+        parser.error("--n and --k must be at least 1")
+
+    recommender.initialize_recommender()
+    results = run_batch_evals(n_songs=args.n, engine=args.engine, nprobe=args.nprobe, seed=args.seed, k=args.k,
+                              n_jobs=args.jobs, full=args.all)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
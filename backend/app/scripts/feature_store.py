@@ -0,0 +1,627 @@
+import copy
+import numpy as np
+import pandas as pd
+from .scoring import normalize_rows, top_k_indices, top_k_rows, iter_blocks
+from .metrics import span
+from .ann import AnnSearcher
+from .shared_arrays import load_or_build, allocate, BUILD_BLOCK_ROWS
+from .neighbors import NeighborTable
+
+# features used by /songs/recommend_full
+FEATURE_COLS = ['danceability', 'energy', 'loudness', 'tempo', 'valence']
+
+# scaling modes
+#   global - one StandardScaler fit over the whole catalog
+#   genre  - one StandardScaler fit per genre partition
+#   auto   - genre scaling for same-genre queries, global scaling otherwise
+#   exact  - scaler fit on the candidate set minus the target, like the original
+#            per-request StandardScaler; derived from stored partition sums so
+#            no table copies are needed, but rows are rescaled per query
+SCALING_MODES = ('auto', 'global', 'genre', 'exact')
+
+# added to every partition radius (see FeatureStore._index_partitions)
+BOUND_SLACK = 1e-5
+
+
+def _fit(X):
+    """
+    StandardScaler parameters of X: mean and population std, with zero-variance
+    columns left unscaled (std 1). Accumulated a block of rows at a time, so X
+    can be a memory-mapped array larger than RAM.
+    """
+    blocks = list(iter_blocks(len(X), BUILD_BLOCK_ROWS))
+    mean = sum((X[start:stop].sum(axis=0) for start, stop in blocks), np.zeros(X.shape[1])) / len(X)
+    var = sum((((X[start:stop] - mean) ** 2).sum(axis=0) for start, stop in blocks), np.zeros(X.shape[1])) / len(X)
+    std = np.sqrt(var)
+    std[std == 0] = 1.0
+    return mean, std
+
+
+def _standardize(X, mean, std):
+    """
+    Same transform as sklearn's StandardScaler, applied in place to a float64 block.
+    """
+    X -= mean
+    X /= std
+    return X
+
+
+def _raw_features(df, rows=None):
+    """
+    Unscaled FEATURE_COLS as float64 (missing values become 0), for all rows
+    or the given row positions.
+    """
+    columns = [df[col] if rows is None else df[col].iloc[rows] for col in FEATURE_COLS]
+    return np.column_stack([
+        pd.to_numeric(col, errors='coerce').fillna(0.0).to_numpy(dtype=np.float64) for col in columns
+    ]).reshape(-1, len(FEATURE_COLS))
+
+
+def _ranges(bounds):
+    """
+    Positions covered by (start, stop) rows, concatenated in order.
+    """
+    if len(bounds) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate([np.arange(start, stop) for start, stop in bounds])
+
+
+def _build_arrays(catalog):
+    """
+    Genre-sorted raw features and their globally / per-genre scaled,
+    normalized float32 versions, the row order in both directions, and the
+    fitted scaler parameters (per genre code for the genre scalers).
+
+    The matrices are filled a block of rows at a time (into memory-mapped
+    files when shared, see allocate), so peak memory stays bounded.
+    """
+    n = len(catalog)
+    blocks = list(iter_blocks(n, BUILD_BLOCK_ROWS))
+
+    # sort rows by genre so each genre partition is contiguous
+    genre_codes = catalog.genre_codes
+    order = np.argsort(genre_codes, kind='stable')
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    # numeric dtype, replace missing with 0
+    raw = allocate('raw', (n, len(FEATURE_COLS)), np.float64)
+    for start, stop in blocks:
+        raw[start:stop] = _raw_features(catalog.df, order[start:stop])
+
+    global_mean, global_std = _fit(raw)
+    global_features = allocate('global_features', (n, len(FEATURE_COLS)), np.float32)
+    for start, stop in blocks:
+        global_features[start:stop] = normalize_rows(_standardize(raw[start:stop].copy(), global_mean, global_std))
+
+    sorted_codes = genre_codes[order]
+    _, starts = np.unique(sorted_codes, return_index=True)
+    stops = np.append(starts[1:], len(sorted_codes))
+    genre_mean = np.zeros((len(catalog.genre_names), len(FEATURE_COLS)))
+    genre_std = np.ones((len(catalog.genre_names), len(FEATURE_COLS)))
+    for start, stop, code in zip(starts, stops, sorted_codes[starts]):
+        if code >= 0:
+            genre_mean[code], genre_std[code] = _fit(raw[start:stop])
+
+    # rows without a genre are normalized unscaled
+    genre_features = allocate('genre_features', (n, len(FEATURE_COLS)), np.float32)
+    for start, stop in blocks:
+        codes = sorted_codes[start:stop]
+        known = (codes >= 0)[:, None]
+        mean = np.where(known, genre_mean[codes], 0.0)
+        std = np.where(known, genre_std[codes], 1.0)
+        genre_features[start:stop] = normalize_rows(_standardize(raw[start:stop].copy(), mean, std))
+
+    return {"order": order, "position": position, "raw": raw,
+            "global_features": global_features, "genre_features": genre_features,
+            "global_mean": global_mean, "global_std": global_std,
+            "genre_mean": genre_mean, "genre_std": genre_std}
+
+
+class FeatureStore:
+    """
+    Precomputed, scaled float32 features for full-catalog recommendations.
+
+    Rows are stored sorted by genre so every genre is a contiguous slice;
+    a query is a slice of the normalized matrix times the target vector.
+    Positions returned by the store are row positions in the catalog.
+    """
+
+    def __init__(self, catalog, scaling='auto'):
+        if scaling not in SCALING_MODES:
+            raise ValueError(f"Unknown scaling mode '{scaling}', expected one of {SCALING_MODES}")
+        self.scaling = scaling
+        self.catalog = catalog
+
+        # the matrices are built once per catalog version and memory-mapped
+        # by every worker process (see scripts/shared_arrays.py); catalogs
+        # changed by ingest are built in memory
+        version = catalog.version if catalog.from_file else None
+        arrays = load_or_build('feature_store', version, lambda: _build_arrays(catalog))
+        self.order = arrays['order']
+        self.position = arrays['position']
+        self.raw = arrays['raw']
+        self.global_features = arrays['global_features']
+        self.genre_features = arrays['genre_features']
+
+        # fitted scalers, by genre name (None = global); rows added later by
+        # ingest are transformed with these until compaction refits them
+        self.scalers = {None: (arrays['global_mean'], arrays['global_std'])}
+        for code, genre in enumerate(catalog.genre_names):
+            self.scalers[genre] = (arrays['genre_mean'][code], arrays['genre_std'][code])
+        self._index_partitions()
+
+        # ANN indexes over the globally scaled rows (built on first use)
+        self.searcher = AnnSearcher(self.global_features)
+
+        # precomputed exact neighbours by same_genre, for this catalog and
+        # scaling only (see scripts/neighbors.py)
+        self.neighbors = {}
+        for same_genre, name in ((True, 'recommend_full'), (False, 'recommend_full_all')):
+            table = NeighborTable.open(name, catalog)
+            if table is not None and table.scaling == scaling:
+                self.neighbors[same_genre] = table
+
+    def _index_partitions(self):
+        """
+        Genre slice bounds and the per-partition sums used by the exact mode.
+        """
+        raw = self.raw
+        sorted_codes = self.catalog.genre_codes[self.order]
+        codes, starts = np.unique(sorted_codes, return_index=True)
+        stops = np.append(starts[1:], len(sorted_codes))
+        self.genre_bounds = {self.catalog.genre_names[c]: (int(a), int(b))
+                             for c, a, b in zip(codes, starts, stops) if c >= 0}
+
+        # per-partition sums for the exact mode (None key = whole catalog)
+        self.sums = {None: (len(raw), raw.sum(axis=0), (raw ** 2).sum(axis=0))}
+        for genre, (start, stop) in self.genre_bounds.items():
+            block = raw[start:stop]
+            self.sums[genre] = (len(block), block.sum(axis=0), (block ** 2).sum(axis=0))
+
+        # every contiguous partition (rows without a genre included) with the
+        # centroid and radius of its globally scaled vectors: for a unit query q
+        # no row x of the partition scores above q . centroid + radius
+        self.partitions = np.column_stack([starts, stops]).astype(np.intp).reshape(-1, 2)
+        self.partition_genres = [self.catalog.genre_names[c] if c >= 0 else None for c in codes]
+        self.partition_index = {genre: i for i, genre in enumerate(self.partition_genres) if genre is not None}
+        self.centroids = np.zeros((len(starts), len(FEATURE_COLS)))
+        self.radii = np.zeros(len(starts))
+        for i, (start, stop) in enumerate(self.partitions):
+            block = np.asarray(self.global_features[start:stop], dtype=np.float64)
+            self.centroids[i] = block.mean(axis=0)
+            self.radii[i] = np.sqrt(((block - self.centroids[i]) ** 2).sum(axis=1).max())
+        # float32 dot products can round past the exact bound
+        self.radii += BOUND_SLACK
+
+    def updated(self, catalog, rows):
+        """
+        Store for catalog, a new version of self.catalog in which only the
+        given rows changed or were appended.
+
+        Changed rows are scaled with the existing scalers (a genre seen for
+        the first time gets a scaler fit on its own rows) and moved into their
+        genre's slice; every other vector is copied as is. ANN indexes are
+        updated rather than rebuilt.
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        n_old, n = len(self.order), len(catalog)
+
+        # catalog-ordered copies of the old matrices, with the changed rows rewritten
+        changed = np.zeros(n, dtype=bool)
+        changed[rows] = True
+        previous = np.full(n, -1, dtype=np.intp)
+        previous[:n_old] = self.position
+        previous[changed] = -1
+
+        kept = previous >= 0
+        raw = np.empty((n, len(FEATURE_COLS)))
+        raw[kept] = self.raw[previous[kept]]
+        raw[rows] = _raw_features(catalog.df, rows)
+
+        codes = catalog.genre_codes[rows]
+        scalers = dict(self.scalers)
+        for code in np.unique(codes[codes >= 0]):
+            if catalog.genre_names[code] not in scalers:
+                scalers[catalog.genre_names[code]] = _fit(raw[catalog.genre_codes == code])
+
+        global_features = np.empty((n, len(FEATURE_COLS)), dtype=np.float32)
+        global_features[kept] = self.global_features[previous[kept]]
+        global_features[rows] = normalize_rows(_standardize(raw[rows].copy(), *scalers[None]))
+
+        genre_features = np.empty((n, len(FEATURE_COLS)), dtype=np.float32)
+        genre_features[kept] = self.genre_features[previous[kept]]
+        mean, std = np.zeros((len(rows), len(FEATURE_COLS))), np.ones((len(rows), len(FEATURE_COLS)))
+        for code in np.unique(codes[codes >= 0]):
+            mean[codes == code], std[codes == code] = scalers[catalog.genre_names[code]]
+        genre_features[rows] = normalize_rows(_standardize(raw[rows].copy(), mean, std))
+
+        # back to genre order
+        order = np.argsort(catalog.genre_codes, kind='stable')
+        position = np.empty_like(order)
+        position[order] = np.arange(n)
+
+        new = copy.copy(self)
+        new.catalog = catalog
+        new.order, new.position = order, position
+        new.raw = raw[order]
+        new.global_features = global_features[order]
+        new.genre_features = genre_features[order]
+        new.scalers = scalers
+        new._index_partitions()
+        new.searcher = self.searcher.updated(new.global_features, previous[order])
+        new.neighbors = {}
+        for same_genre, table in self.neighbors.items():
+            n_seeds = len(table.records)
+            table = table.updated(rows, lambda changed: new._neighbor_scores(changed, same_genre, n_seeds))
+            if table is not None:
+                new.neighbors[same_genre] = table
+        return new
+
+    def _neighbor_scores(self, rows, same_genre, n):
+        """
+        Similarity of each of the given catalog rows to the first n catalog
+        rows as the neighbour table for same_genre scores them (-inf where a
+        row is not a candidate), for NeighborTable.updated.
+        """
+        features = self._features_for(same_genre, self.scaling)
+        scores = (features @ features[self.position[rows]].T)[self.position[:n]]
+        if same_genre:
+            # a seed with a genre only sees rows of that genre
+            seed_codes = self.catalog.genre_codes[:n, None]
+            outside = (seed_codes >= 0) & (seed_codes != self.catalog.genre_codes[rows][None, :])
+            scores[outside] = -np.inf
+        return scores
+
+    def drift(self):
+        """
+        How far the data moved from the fitted scalers: the largest shift of
+        a partition's mean (in fitted standard deviations) or relative change
+        of its standard deviation, over the global and per-genre partitions.
+        """
+        drift = 0.0
+        for partition, (count, total, total_sq) in self.sums.items():
+            if count == 0 or partition not in self.scalers:
+                continue
+            fit_mean, fit_std = self.scalers[partition]
+            mean = total / count
+            std = np.sqrt(np.maximum(total_sq / count - mean ** 2, 0.0))
+            std[std == 0] = 1.0
+            drift = max(drift, float(np.max(np.abs(mean - fit_mean) / fit_std)),
+                        float(np.max(np.abs(std / fit_std - 1.0))))
+        return drift
+
+    def __len__(self):
+        return len(self.order)
+
+    def recommend(self, row, k=5, same_genre=True, scaling=None, engine='exact', nprobe=None, genres=None):
+        """
+        Return (rows, similarities) for the k tracks most similar to the
+        track at catalog position row, best first.
+
+        engine 'ivf' / 'lsh' serves cross-genre queries on global scaling from an
+        ANN index; same-genre queries are a small slice and are always exact.
+        Exact cross-genre queries on global scaling skip the genre partitions
+        that can't reach the top k (see _pruned_top_k).
+
+        genres (a list of genre names) limits the candidates to those genres
+        instead of same_genre; they are scored like a cross-genre query.
+        Exact queries are answered from a precomputed neighbour table when
+        there is one (see precomputed).
+        """
+        scaling = scaling or self.scaling
+        if scaling not in SCALING_MODES:
+            raise ValueError(f"Unknown scaling mode '{scaling}', expected one of {SCALING_MODES}")
+        if genres is not None:
+            return self._recommend_in_genres(row, k, genres, scaling)
+        found = self.precomputed(row, k, same_genre, scaling, engine)
+        if found is not None:
+            return found
+
+        genre = self.catalog.genre_of(row)
+        partition = genre if same_genre and genre else None
+        if partition is not None:
+            start, stop = self.genre_bounds[genre]
+        else:
+            start, stop = 0, len(self.order)
+
+        # exclude the target itself (and any duplicate rows of the same id)
+        exclude = [self.position[r] - start for r in self.catalog.rows_for_id(self.catalog.track_ids[row])
+                   if start <= self.position[r] < stop]
+
+        if self.uses_ann(same_genre, scaling, engine):
+            position = self.position[row]
+            top, sims = self.searcher.search(self.global_features[position], k, exclude=exclude,
+                                             engine=engine, nprobe=nprobe)
+            return self.order[top], sims
+
+        if partition is None and scaling in ('auto', 'global'):
+            with span('feature_store.score'):
+                top, sims = self._pruned_top_k(self.global_features[self.position[row]],
+                                               np.arange(len(self.partitions)), k, self._excluded_positions(row))
+            return self.order[top], sims
+
+        with span('feature_store.score'):
+            if scaling == 'exact':
+                sims = self._exact_similarities(row, [partition], slice(start, stop), exclude)
+            else:
+                features = self._features_for(same_genre, scaling)
+                sims = features[start:stop] @ features[self.position[row]]
+
+        with span('feature_store.top_k'):
+            top = top_k_indices(sims, k, exclude=exclude or None)
+        return self.order[start + top], sims[top]
+
+    def precomputed(self, row, k, same_genre=True, scaling=None, engine='exact'):
+        """
+        (rows, similarities) from the neighbour table for these options, or
+        None if there is no table for them or it can't answer for this row.
+        """
+        if engine != 'exact' or (scaling or self.scaling) != self.scaling:
+            return None
+        table = self.neighbors.get(bool(same_genre))
+        if table is None:
+            return None
+        return table.lookup(row, k, score=lambda rows: self._similarities(row, rows, same_genre))
+
+    def _similarities(self, row, rows, same_genre):
+        """
+        Similarities of the given catalog rows to row, scored like an exact
+        recommend() with the store's scaling (re-scores neighbour table hits).
+        """
+        genre = self.catalog.genre_of(row)
+        partition = genre if same_genre and genre else None
+        positions = self.position[rows]
+        if self.scaling != 'exact':
+            features = self._features_for(partition is not None, self.scaling)
+            return features[positions] @ features[self.position[row]]
+
+        # the exact scaler is fit without the target's rows in the scored range
+        start, stop = self.genre_bounds[partition] if partition is not None else (0, len(self.order))
+        excluded = [p for p in self._excluded_positions(row) if start <= p < stop]
+        positions = np.concatenate([np.asarray(excluded, dtype=np.intp), positions])
+        return self._exact_similarities(row, [partition], positions, np.arange(len(excluded)))[len(excluded):]
+
+    def _recommend_in_genres(self, row, k, genres, scaling):
+        """
+        recommend() over the partitions of the given genres (unknown or empty
+        genres are skipped).
+        """
+        parts = sorted({self.partition_index[g] for g in genres if g in self.partition_index})
+        excluded = self._excluded_positions(row)
+        with span('feature_store.score'):
+            if scaling in ('auto', 'global'):
+                top, sims = self._pruned_top_k(self.global_features[self.position[row]], parts, k, excluded)
+                return self.order[top], sims
+
+            positions = _ranges(self.partitions[parts])
+            exclude = np.flatnonzero(np.isin(positions, excluded))
+            if scaling == 'exact':
+                sims = self._exact_similarities(row, [self.partition_genres[p] for p in parts], positions, exclude)
+            else:
+                sims = self.genre_features[positions] @ self.genre_features[self.position[row]]
+            top = top_k_indices(sims, k, exclude=exclude if len(exclude) else None)
+        return self.order[positions[top]], sims[top]
+
+    def _pruned_top_k(self, query, parts, k, excluded):
+        """
+        Exact top-k of global_features @ query over the given partitions
+        (indices into self.partitions), as (positions, scores) best first.
+
+        Branch and bound on the partition bounds: the partitions with the
+        highest bound are scored first until they hold k candidates; the k-th
+        of those scores is a threshold that no partition bounded below it can
+        reach, and the remaining partitions are scored in one product.
+        """
+        parts = np.asarray(parts, dtype=np.intp)
+        if len(parts) == 0 or k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=self.global_features.dtype)
+
+        bounds = self.centroids[parts] @ query + self.radii[parts]
+        whole = len(parts) == len(self.partitions)
+        if whole and bounds.min() >= 1.0:
+            # cosine scores never exceed 1, so no partition could be pruned
+            return self._top_k_at(query, slice(0, len(self.order)), k, excluded)
+        order = np.argsort(-bounds, kind='stable')
+        sizes = self.partitions[parts[order], 1] - self.partitions[parts[order], 0]
+        n_first = min(int(np.searchsorted(np.cumsum(sizes), k + len(excluded))) + 1, len(order))
+
+        positions, scores = self._top_k_at(query, _ranges(self.partitions[parts[order[:n_first]]]), k, excluded)
+        rest = order[n_first:]
+        if len(positions) >= k:
+            rest = rest[bounds[rest] >= scores[-1]]
+        if len(rest) == 0:
+            return positions, scores
+
+        if whole and len(rest) == len(order) - n_first:
+            # nothing pruned: score the whole (contiguous) matrix in one go
+            return self._top_k_at(query, slice(0, len(self.order)), k, excluded)
+        more, more_scores = self._top_k_at(query, _ranges(self.partitions[parts[rest]]), k, excluded)
+        positions = np.concatenate([positions, more])
+        scores = np.concatenate([scores, more_scores])
+        best = np.lexsort((positions, -scores))[:k]
+        return positions[best], scores[best]
+
+    def _top_k_at(self, query, positions, k, excluded):
+        """
+        Top-k (positions, scores) of global_features @ query among positions
+        (an index array or a slice), never returning an excluded position.
+        """
+        scores = self.global_features[positions] @ query
+        if isinstance(positions, slice):
+            excluded = np.asarray(excluded, dtype=np.intp)
+            exclude = excluded[(excluded >= positions.start) & (excluded < positions.stop)] - positions.start
+            top = top_k_indices(scores, k, exclude=exclude if len(exclude) else None)
+            return positions.start + top, scores[top]
+        if len(excluded) <= 8:
+            exclude = [i for p in excluded for i in np.flatnonzero(positions == p)]
+        else:
+            # e.g. a session's played tracks: one membership pass instead of one scan each
+            exclude = np.flatnonzero(np.isin(positions, excluded))
+        top = top_k_indices(scores, k, exclude=exclude if len(exclude) else None)
+        return positions[top], scores[top]
+
+    def vector_of(self, row):
+        """
+        Globally scaled, normalized feature vector of a catalog row.
+        """
+        return np.asarray(self.global_features[self.position[row]], dtype=np.float64)
+
+    def recommend_vector(self, vector, k=5, exclude_rows=(), genres=None):
+        """
+        Return (rows, similarities) for the k tracks most similar to a vector
+        in the globally scaled space (e.g. a session's taste vector), over
+        the whole catalog or the given genres. exclude_rows are never
+        returned. Exact, with the partition pruning of cross-genre queries.
+        """
+        norm = np.linalg.norm(vector)
+        if norm == 0 or k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=self.global_features.dtype)
+        query = (np.asarray(vector) / norm).astype(self.global_features.dtype)
+        if genres is None:
+            parts = np.arange(len(self.partitions))
+        else:
+            parts = sorted({self.partition_index[g] for g in genres if g in self.partition_index})
+        excluded = self.position[np.asarray(exclude_rows, dtype=np.intp)]
+        with span('feature_store.score'):
+            top, sims = self._pruned_top_k(query, parts, k, excluded)
+        return self.order[top], sims
+
+    def nearby_genres(self, genre, n):
+        """
+        genre followed by the n genres whose centroids are most similar to its
+        centroid (cosine of the globally scaled centroids), nearest first.
+        """
+        i = self.partition_index.get(genre)
+        if i is None:
+            return [genre]
+        directions = normalize_rows(self.centroids)
+        similar = np.argsort(-(directions @ directions[i]), kind='stable')
+        nearby = [self.partition_genres[j] for j in similar if j != i and self.partition_genres[j] is not None]
+        return [genre] + nearby[:max(n, 0)]
+
+    def _features_for(self, same_genre, scaling):
+        """
+        Precomputed matrix used for a query with these options.
+        """
+        use_genre_scaling = scaling == 'genre' or (scaling in ('auto', 'exact') and same_genre)
+        return self.genre_features if use_genre_scaling else self.global_features
+
+    def scored_features(self, rows, same_genre=True, scaling=None):
+        """
+        (matrix, positions): the normalized matrix a query with these options
+        is scored on and the positions of the given catalog rows in it.
+        """
+        return self._features_for(same_genre, scaling or self.scaling), self.position[np.asarray(rows, dtype=np.intp)]
+
+    def _excluded_positions(self, row):
+        return [self.position[r] for r in self.catalog.rows_for_id(self.catalog.track_ids[row])]
+
+    def recommend_batch(self, rows, k=5, same_genre=True, scaling=None):
+        """
+        Per-seed top-k for many seeds at once: one matrix-matrix product per
+        genre partition (or per block of seeds over the whole catalog) and a
+        row-wise argpartition. Returns a list of (rows, similarities) per seed.
+        """
+        scaling = scaling or self.scaling
+        if scaling not in SCALING_MODES:
+            raise ValueError(f"Unknown scaling mode '{scaling}', expected one of {SCALING_MODES}")
+        if scaling == 'exact':
+            # the exact scaler depends on each seed, so there is nothing to share
+            return [self.recommend(row, k=k, same_genre=same_genre, scaling='exact') for row in rows]
+
+        rows = np.asarray(rows, dtype=np.intp)
+        features = self._features_for(same_genre, scaling)
+        results = [self.precomputed(row, k, same_genre, scaling) for row in rows]
+
+        # group the remaining seeds by the range of rows they are scored against
+        groups = {}
+        for i, row in enumerate(rows):
+            if results[i] is not None:
+                continue
+            genre = self.catalog.genre_of(row) if same_genre else None
+            groups.setdefault(genre, []).append(i)
+
+        for genre, seed_ids in groups.items():
+            start, stop = self.genre_bounds[genre] if genre is not None else (0, len(self.order))
+            candidates = features[start:stop]
+            for b_start, b_stop in iter_blocks(len(seed_ids)):
+                block_ids = seed_ids[b_start:b_stop]
+                queries = features[self.position[rows[block_ids]]]
+                scores = queries @ candidates.T
+
+                # exclude each seed itself (and duplicate rows of the same id)
+                for j, i in enumerate(block_ids):
+                    for p in self._excluded_positions(rows[i]):
+                        if start <= p < stop:
+                            scores[j, p - start] = -np.inf
+
+                top, top_scores = top_k_rows(scores, k, copy=False)
+                for j, i in enumerate(block_ids):
+                    valid = np.isfinite(top_scores[j])
+                    results[i] = (self.order[start + top[j][valid]], top_scores[j][valid])
+        return results
+
+    def recommend_centroid(self, rows, k=5, same_genre=True, scaling=None):
+        """
+        One combined top-k for a set of seeds, scored against the normalized
+        mean of their vectors ("playlist centroid"). With same_genre the
+        candidates are every genre any seed belongs to. Seeds are excluded.
+        """
+        scaling = scaling or self.scaling
+        if scaling not in SCALING_MODES:
+            raise ValueError(f"Unknown scaling mode '{scaling}', expected one of {SCALING_MODES}")
+
+        rows = np.asarray(rows, dtype=np.intp)
+        features = self._features_for(same_genre, scaling)
+        centroid = normalize_rows(features[self.position[rows]].mean(axis=0, keepdims=True))[0]
+
+        if same_genre:
+            genres = {self.catalog.genre_of(row) for row in rows} - {None}
+            positions = np.concatenate([np.arange(*self.genre_bounds[g]) for g in sorted(genres)]) \
+                if genres else np.arange(len(self.order))
+        else:
+            positions = np.arange(len(self.order))
+
+        scores = features[positions] @ centroid
+        excluded = np.isin(positions, [p for row in rows for p in self._excluded_positions(row)])
+        top = top_k_indices(scores, k, exclude=np.flatnonzero(excluded))
+        return self.order[positions[top]], scores[top]
+
+    def uses_ann(self, same_genre, scaling, engine, genres=None):
+        """
+        Whether a query with these options is served by the ANN index.
+        """
+        return engine != 'exact' and not same_genre and genres is None and \
+            (scaling or self.scaling) in ('auto', 'global')
+
+    def recall(self, row, k=5, engine='ivf', nprobe=None):
+        """
+        Recall@k of the ANN engine against exact search for a cross-genre query.
+        """
+        exclude = self._excluded_positions(row)
+        return self.searcher.recall(self.global_features[self.position[row]], k, exclude=exclude,
+                                    engine=engine, nprobe=nprobe)
+
+    def _exact_similarities(self, row, partitions, positions, exclude):
+        """
+        Cosine similarities of the rows at positions (a slice or index array
+        covering the given sum partitions) with the scaler fit on the
+        candidates only (partitions minus the excluded target rows).
+        """
+        count = sum(self.sums[p][0] for p in partitions)
+        total = sum(self.sums[p][1] for p in partitions)
+        total_sq = sum(self.sums[p][2] for p in partitions)
+        excluded = self.raw[positions][exclude]
+        count = count - len(excluded)
+        if count <= 0:
+            return np.zeros(len(self.raw[positions]))
+
+        mean = (total - excluded.sum(axis=0)) / count
+        var = (total_sq - (excluded ** 2).sum(axis=0)) / count - mean ** 2
+        std = np.sqrt(np.maximum(var, 0.0))
+        std[std == 0] = 1.0
+
+        candidates = normalize_rows((self.raw[positions] - mean) / std)
+        target = normalize_rows(((self.raw[self.position[row]] - mean) / std)[None, :])[0]
+        return candidates @ target
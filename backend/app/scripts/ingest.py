@@ -0,0 +1,434 @@
+"""
+Incremental catalog updates behind POST /songs/ingest.
+
+A batch of tracks (JSON lines) is upserted into the live catalog without a
+restart: the catalog, lookup and search indexes, the feature store and the
+recommender are all updated from the previous version (new rows are scaled
+with the fitted scalers, new genres grow the one-hot space), then swapped in
+together. Nothing is modified in place, so requests in flight keep the
+version they started with.
+
+Accepted batches are appended to a journal next to the CSV
+(cleaned_tracks.ingest.jsonl). Every process applies the journal in order:
+at startup, before each of its own batches and on every background tick, so
+ingested tracks survive restarts and reach all worker processes.
+
+The same background thread refits the scalers (a full rebuild of the
+derived structures) once the data has drifted past INGEST_DRIFT_THRESHOLD;
+until then incremental updates keep the old scaling.
+"""
+import hashlib
+import hmac
+import json
+import math
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import database
+from . import recommender, service
+from .catalog import Catalog, set_catalog
+from .feature_store import FeatureStore, FEATURE_COLS
+from .startup import startup
+from .shared_arrays import in_pool_worker
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process journal lock
+    fcntl = None
+
+# seconds between background journal syncs / drift checks
+DEFAULT_INTERVAL = float(os.environ.get('INGEST_COMPACT_INTERVAL', 60))
+# refit the scalers once drift (see FeatureStore.drift / RecommenderState.drift) exceeds this
+DEFAULT_DRIFT_THRESHOLD = float(os.environ.get('INGEST_DRIFT_THRESHOLD', 0.05))
+MAX_INGEST_RECORDS = 10000
+# POST /songs/ingest is off unless a token is set; requests then need
+# "Authorization: Bearer <token>"
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN') or None
+
+# columns every new track needs (so the recommender and feature store can use it)
+REQUIRED_COLS = ['track_id', 'track_name', 'artists', 'track_genre'] + FEATURE_COLS
+
+# accepted (low, high) of numeric columns, None = open; Spotify's audio feature ranges
+VALUE_RANGES = {
+    'popularity': (0, 100), 'duration_ms': (0, None), 'key': (-1, 11), 'mode': (0, 1),
+    'time_signature': (0, 7), 'tempo': (0, None), 'loudness': (-60, 10),
+    **dict.fromkeys(['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness', 'liveness',
+                     'valence'], (0, 1))
+}
+# integer values must be exact in float64 (the ingest path goes through it)
+MAX_INT_VALUE = 2 ** 53
+
+
+def journal_path():
+    """
+    Journal of ingested batches, next to the CSV it applies to (resolved per
+    call so it follows database.CSV_PATH).
+    """
+    return os.path.splitext(database.CSV_PATH)[0] + '.ingest.jsonl'
+
+
+def _is_bool_column(column):
+    """
+    bool columns, including ones that became object dtype once an ingested
+    track left them missing.
+    """
+    if pd.api.types.is_bool_dtype(column.dtype):
+        return True
+    if column.dtype != object:
+        return False
+    first = column.first_valid_index()
+    return first is not None and isinstance(column.loc[first], (bool, np.bool_))
+
+
+def _check_value(column, value, df):
+    """
+    Error message for a value that doesn't fit the column's type, or None.
+    """
+    if value is None:
+        return f"'{column}' is required" if column in REQUIRED_COLS else None
+    dtype = df[column].dtype
+    if _is_bool_column(df[column]):
+        ok = isinstance(value, bool)
+    elif pd.api.types.is_numeric_dtype(dtype):
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+        if ok and pd.api.types.is_integer_dtype(dtype):
+            # whole numbers only, so the column keeps its integer type
+            ok = (isinstance(value, int) or value.is_integer()) and abs(value) <= MAX_INT_VALUE
+        low, high = VALUE_RANGES.get(column, (None, None))
+        if ok and ((low is not None and value < low) or (high is not None and value > high)):
+            return f"'{column}' must be between {low} and {'any' if high is None else high}, not {value!r}"
+    elif column == 'track_id':
+        ok = isinstance(value, (str, int)) and not isinstance(value, bool) and str(value) != ''
+    else:
+        ok = isinstance(value, str)
+    return None if ok else f"invalid value for '{column}': {value!r}"
+
+
+def parse_jsonl(text, df):
+    """
+    Records from a JSON lines body, checked against the columns of df.
+    Raises ValueError naming the first bad line.
+    """
+    records = []
+    for n, line in enumerate((text or '').splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {n}: invalid JSON ({e})")
+        if not isinstance(record, dict):
+            raise ValueError(f"line {n}: expected a JSON object")
+        if 'track_id' not in record:
+            raise ValueError(f"line {n}: 'track_id' is required")
+
+        unknown = sorted(set(record) - set(df.columns))
+        if unknown:
+            raise ValueError(f"line {n}: unknown columns {unknown}")
+        for column, value in record.items():
+            error = _check_value(column, value, df)
+            if error:
+                raise ValueError(f"line {n}: {error}")
+        record['track_id'] = str(record['track_id'])
+        records.append(record)
+
+        if len(records) > MAX_INGEST_RECORDS:
+            raise ValueError(f"At most {MAX_INGEST_RECORDS} records per request")
+    if not records:
+        raise ValueError("No records in the request body")
+    return records
+
+
+def _check_new_rows(df, rows):
+    """
+    New tracks must come with every REQUIRED_COLS value.
+    """
+    for column in REQUIRED_COLS:
+        missing = df[column].iloc[rows].isna().to_numpy()
+        if missing.any():
+            track_id = df['track_id'].iat[rows[missing.argmax()]]
+            raise ValueError(f"new track {track_id} is missing '{column}'")
+
+
+def _publish(catalog, feature_store, search_index, recommender_state):
+    """
+    Swap a new version in. The recommender goes first: every reader of the
+    serving state then finds its rows in the recommender too.
+    """
+    recommender.state = recommender_state
+    set_catalog(catalog)
+    service.state = service.ServingState(catalog, feature_store, search_index)
+
+
+class CatalogUpdater:
+    """
+    Applies ingested batches to the live state and runs the background
+    journal sync and drift compaction. One writer per process (a lock);
+    across processes the journal is appended under a file lock and every
+    process applies it in the same order.
+
+    Catalog sources are chained per batch (sha1 of the parent source and the
+    journal line), so every process replaying the journal ends up with the
+    same source.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, drift_threshold=DEFAULT_DRIFT_THRESHOLD):
+        self.interval = interval
+        self.drift_threshold = drift_threshold
+        self._lock = threading.Lock()
+        self._offset = 0    # bytes of the journal applied by this process
+        self._path = None   # journal the offset refers to
+        self._thread = None
+        self.last_drift = None
+        self.stats = dict.fromkeys(['batches', 'records', 'appended', 'updated', 'replayed', 'skipped',
+                                    'compactions'], 0)
+
+    def start(self):
+        """
+        Replay the journal and start the background thread (restarted in
+        forked server workers, whose offset is inherited from the parent;
+        not in offline pool workers, see shared_arrays.offline_pool).
+        """
+        self.sync()
+        if self._thread is None:
+            self._start_thread()
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        if in_pool_worker():
+            self._thread = None
+        else:
+            self._start_thread()
+
+    def _start_thread(self):
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='catalog-updater', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sync()
+                self.compact()
+            except Exception as e:
+                print(f"Catalog update failed: {e}")
+
+    def ingest(self, records):
+        """
+        Apply a batch of validated records and journal it.
+        Returns (catalog, updated rows, appended rows); raises ValueError if
+        the batch is rejected (nothing is journaled or published then).
+        """
+        line = json.dumps(records, separators=(',', ':'), ensure_ascii=False)
+        with self._lock, self._journal() as journal:
+            # apply what other processes wrote first, so every process sees the same order
+            self._catch_up(journal)
+            catalog, feature_store, search_index, recommender_state, updated, appended = \
+                self._build([(line, records)])
+
+            journal.seek(0, os.SEEK_END)
+            journal.write(line.encode('utf-8') + b'\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+            self._offset = journal.tell()
+            _publish(catalog, feature_store, search_index, recommender_state)
+
+            self.stats['batches'] += 1
+            self.stats['records'] += len(records)
+            self.stats['updated'] += len(updated)
+            self.stats['appended'] += len(appended)
+            return catalog, updated, appended
+
+    def sync(self):
+        """
+        Apply batches journaled by other processes (or before a restart).
+        """
+        if service.state is None:
+            return
+        with self._lock:
+            if not os.path.exists(journal_path()) and self._offset == 0:
+                return
+            with self._journal() as journal:
+                self._catch_up(journal)
+
+    def compact(self, force=False):
+        """
+        Refit the scalers and rebuild the feature store and recommender from
+        the current catalog once drift exceeds drift_threshold. The new
+        catalog object shares the table and lookup; only its source changes
+        (chained like a journal batch, so cached results are dropped).
+        """
+        with self._lock:
+            current = service.state
+            if current is None:
+                return False
+            drift = current.feature_store.drift()
+            if recommender.state is not None:
+                drift = max(drift, recommender.state.drift())
+            self.last_drift = drift
+            if drift <= self.drift_threshold and not force:
+                return False
+
+            old = current.catalog
+            source = hashlib.sha1(f"{old.source}\ncompact".encode('utf-8')).hexdigest()
+            catalog = Catalog(old.df, lookup=old.lookup, source=source)
+            feature_store = FeatureStore(catalog, scaling=current.feature_store.scaling)
+            _publish(catalog, feature_store, current.search_index, recommender.build_state(catalog))
+            self.last_drift = 0.0
+            self.stats['compactions'] += 1
+            print(f"Compacted catalog {catalog.version} (drift {drift:.4f})")
+            return True
+
+    def info(self):
+        current = service.state
+        return {
+            **self.stats,
+            "catalog_size": len(current.catalog) if current is not None else 0,
+            "version": current.catalog.version if current is not None else None,
+            "journal_bytes": self._offset,
+            "last_drift": self.last_drift,
+            "drift_threshold": self.drift_threshold,
+            "interval": self.interval
+        }
+
+    # journal (callers hold self._lock)
+
+    def _journal(self):
+        return _Journal(journal_path())
+
+    def _catch_up(self, journal):
+        """
+        Apply every complete journal line past self._offset. Lines are
+        applied as one upsert; if that fails they are retried one by one and
+        bad ones skipped (logged and counted), so one line can't stop the
+        replay.
+        """
+        if journal.name != self._path:
+            self._path, self._offset = journal.name, 0
+        journal.seek(self._offset)
+        data = journal.read()
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return
+
+        batches = []
+        for line in data[:end].decode('utf-8', errors='replace').splitlines():
+            try:
+                batches.append((line, json.loads(line)))
+            except ValueError:
+                print("Skipping unreadable journal line")
+                self.stats['skipped'] += 1
+        try:
+            _publish(*self._build(batches)[:4])
+        except Exception:
+            for batch in batches:
+                try:
+                    _publish(*self._build([batch])[:4])
+                except Exception as e:
+                    print(f"Skipping journaled batch: {e}")
+                    self.stats['skipped'] += 1
+        self._offset += end
+        self.stats['replayed'] += len(batches)
+
+    def _build(self, batches):
+        """
+        Upsert (line, records) batches into the current state. Returns the
+        new (catalog, feature store, search index, recommender state) to
+        publish, and the updated and appended rows.
+        """
+        current = service.state
+        if current is None:
+            raise ValueError("Dataset not loaded")
+
+        source = current.catalog.source
+        records = []
+        for line, batch in batches:
+            source = hashlib.sha1(f"{source}\n{line}".encode('utf-8')).hexdigest()
+            records.extend(batch)
+
+        catalog, updated, appended = current.catalog.upsert(records, source=source)
+        _check_new_rows(catalog.df, appended)
+
+        changed = updated + appended
+        feature_store = current.feature_store.updated(catalog, changed)
+        search_index = current.search_index.updated(catalog.df, changed)
+        if recommender.state is not None:
+            recommender_state = recommender.state.updated(catalog, changed)
+        else:
+            recommender_state = recommender.build_state(catalog)
+        return catalog, feature_store, search_index, recommender_state, updated, appended
+
+
+class _Journal:
+    """
+    The journal file opened for appending and reading, exclusively locked
+    across processes while open.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self.file
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+
+updater = CatalogUpdater()
+
+
+def start_updater():
+    """
+    Replay the journal and start the background sync/compaction (app startup).
+    """
+    updater.start()
+
+
+def authorize(token):
+    """
+    None if token (the request's bearer token, or None) may ingest, else
+    the (error payload, status) to answer with.
+    """
+    if INGEST_TOKEN is None:
+        return {"error": "Ingest is disabled; set INGEST_TOKEN to enable it"}, 403
+    if token is None or not hmac.compare_digest(token.encode('utf-8'), INGEST_TOKEN.encode('utf-8')):
+        return {"error": "Missing or wrong ingest token"}, 401
+    return None
+
+
+def ingest(text):
+    """
+    Upsert the tracks in a JSON lines body (see POST /songs/ingest).
+    """
+    # batches wait for the journal replay, so they apply on top of it
+    unavailable = startup.unavailable('ingest')
+    if unavailable:
+        return unavailable
+    current = service.state
+    try:
+        records = parse_jsonl(text, current.df)
+        catalog, updated, appended = updater.ingest(records)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except OSError as e:
+        return {"error": f"Could not write the ingest journal: {e}"}, 500
+
+    return {
+        "received": len(records),
+        "updated": len(updated),
+        "appended": len(appended),
+        "catalog_size": len(catalog),
+        "version": catalog.version
+    }, 200
+
+
+def ingest_stats():
+    return updater.info(), 200
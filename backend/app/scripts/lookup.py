@@ -0,0 +1,196 @@
+import copy
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+
+# sorts after every other character, used as the upper bound of a prefix range
+_MAX_CHAR = chr(0x10FFFF)
+
+
+def factorize_strings(column, lower=False):
+    """
+    (codes, values) of a string column (lowercased if lower), like
+    pd.factorize: values in order of first appearance, -1 for missing.
+
+    Categorical columns (as loaded from the tracks cache) are factorized
+    through their categories, so no per-row strings are created.
+    """
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        keys = column.astype(str).where(column.notna()) if not lower else column.str.lower()
+        codes, uniques = pd.factorize(keys)
+        return codes, [str(v) for v in uniques]
+
+    categories = column.cat.categories.astype(str)
+    codes = column.cat.codes.to_numpy()
+    if len(categories) == 0:
+        return np.full(len(codes), -1, dtype=np.intp), []
+    category_codes, uniques = pd.factorize(categories.str.lower() if lower else categories)
+    codes = np.where(codes >= 0, category_codes[codes], -1)
+
+    # renumber by first appearance (categories may be in any order)
+    present, first = np.unique(codes, return_index=True)
+    first, present = first[present >= 0], present[present >= 0]
+    order = np.argsort(first, kind='stable')
+    remap = np.full(len(uniques) + 1, -1, dtype=np.intp)
+    remap[present[order]] = np.arange(len(present))
+    return remap[codes], [str(uniques[v]) for v in present[order]]
+
+
+def _rows_by_code(codes, values):
+    """
+    Map each distinct key to the (ascending) row positions holding it.
+    """
+    valid = codes >= 0
+    order = np.argsort(codes, kind='stable')
+    order = order[valid[order]]
+    counts = np.bincount(codes[valid], minlength=len(values))
+    return dict(zip(values, np.split(order, np.cumsum(counts)[:-1])))
+
+
+class TrackLookup:
+    """
+    Hash and sorted indexes over a tracks DataFrame, built once at load time.
+
+      - track_id            -> rows (dict)
+      - lower(track_search) -> rows (dict)
+      - lower(track_name)   -> rows (dict)
+      - sorted lower(track_name) array for bisect prefix queries
+
+    Lookups return row positions; only the matched rows are ever materialized.
+    """
+
+    def __init__(self, df):
+        self.df = df
+
+        # keys are factorized first (through the categories for cached
+        # columns), so building never holds a string per row
+        self.id_rows = _rows_by_code(*factorize_strings(df['track_id']))
+        self.search_rows = _rows_by_code(*factorize_strings(df['track_search'], lower=True))
+
+        codes, names = factorize_strings(df['track_name'], lower=True)
+        self.name_rows = _rows_by_code(codes, names)
+
+        # sorted names for "startswith" queries (nulls never match a prefix)
+        rank = np.empty(len(names), dtype=np.intp)
+        rank[np.argsort(np.array(names, dtype=str), kind='stable')] = np.arange(len(names))
+        rows = np.flatnonzero(codes >= 0)
+        self.sorted_rows = rows[np.argsort(rank[codes[rows]], kind='stable')]
+        self.sorted_names = [names[c] for c in codes[self.sorted_rows].tolist()]
+
+        self.artists_lower = df['artists'].str.lower().to_numpy()
+
+    def __len__(self):
+        return len(self.df)
+
+    def updated(self, df, rows):
+        """
+        Copy of the lookup for df, a version of self.df in which only the
+        given rows changed or were appended. Dicts and arrays are copied before
+        being patched, so readers still holding this lookup are unaffected.
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        old_n = len(self.df)
+        new = copy.copy(self)
+        new.df = df
+
+        new.id_rows = self._patched(self.id_rows, df, rows, 'track_id', str)
+        new.search_rows = self._patched(self.search_rows, df, rows, 'track_search', str.lower)
+        new.name_rows = self._patched(self.name_rows, df, rows, 'track_name', str.lower)
+
+        # sorted names: drop the changed rows' entries and merge in the new ones
+        # (timsort only really sorts the new tail)
+        keep = ~np.isin(self.sorted_rows, rows)
+        pairs = list(zip(np.asarray(self.sorted_names, dtype=object)[keep].tolist(),
+                         self.sorted_rows[keep].tolist()))
+        names = df['track_name']
+        pairs += [(names.iat[r].lower(), int(r)) for r in rows if pd.notna(names.iat[r])]
+        pairs.sort()
+        new.sorted_names = [name for name, _ in pairs]
+        new.sorted_rows = np.array([row for _, row in pairs], dtype=np.intp)
+
+        artists = np.empty(len(df), dtype=object)
+        artists[:old_n] = self.artists_lower
+        artists[rows] = df['artists'].iloc[rows].str.lower().to_numpy()
+        new.artists_lower = artists
+        return new
+
+    def _patched(self, key_rows, df, rows, column, normalize):
+        """
+        Copy of a key -> rows dict with the given rows moved to their new keys.
+        """
+        old_n = len(self.df)
+        moves = {}
+        for r in rows:
+            if r < old_n:
+                old = self.df[column].iat[r]
+                if pd.notna(old):
+                    moves.setdefault(normalize(str(old)), [set(), set()])[1].add(int(r))
+            value = df[column].iat[r]
+            if pd.notna(value):
+                moves.setdefault(normalize(str(value)), [set(), set()])[0].add(int(r))
+
+        patched = dict(key_rows)
+        for key, (added, removed) in moves.items():
+            current = set(patched.get(key, np.empty(0, dtype=np.intp)).tolist())
+            current = (current - removed) | added
+            if current:
+                patched[key] = np.array(sorted(current), dtype=np.intp)
+            else:
+                patched.pop(key, None)
+        return patched
+
+    def rows_for_id(self, track_id):
+        return self.id_rows.get(str(track_id), np.empty(0, dtype=np.intp))
+
+    def rows_for_ids(self, track_ids):
+        """
+        Rows of all the given track_ids in one array (unknown ids are skipped).
+        """
+        id_rows = self.id_rows
+        found = [id_rows[key] for key in map(str, track_ids) if key in id_rows]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.intp)
+
+    def rows_for_search(self, track_search):
+        return self.search_rows.get(track_search.lower(), np.empty(0, dtype=np.intp))
+
+    def rows_for_name(self, track_name):
+        return self.name_rows.get(track_name.lower(), np.empty(0, dtype=np.intp))
+
+    def rows_with_prefix(self, prefix):
+        """
+        Rows whose lowercased track_name starts with prefix, in file order.
+        """
+        prefix = prefix.lower()
+        lo = bisect_left(self.sorted_names, prefix)
+        hi = bisect_left(self.sorted_names, prefix + _MAX_CHAR, lo)
+        return np.sort(self.sorted_rows[lo:hi])
+
+    def find(self, track_id=None, track_search=None, track_name=None, artists=None):
+        """
+        Row positions matching track_id, the exact track_search, and
+        track_name (exact with artists as a partial match, else a prefix).
+        Every given criterion must match.
+        """
+        candidates = []
+        if track_id:
+            candidates.append(self.rows_for_id(track_id))
+        if track_search:
+            candidates.append(self.rows_for_search(track_search))
+        if track_name and artists:
+            # exact name, then partial match for artists on the few name hits
+            rows = self.rows_for_name(track_name)
+            needle = artists.lower()
+            candidates.append(np.array(
+                [r for r in rows if isinstance(self.artists_lower[r], str) and needle in self.artists_lower[r]],
+                dtype=np.intp
+            ))
+        elif track_name:
+            candidates.append(self.rows_with_prefix(track_name))
+
+        if not candidates:
+            return np.arange(len(self.df))
+
+        rows = candidates[0]
+        for other in candidates[1:]:
+            rows = np.intersect1d(rows, other)
+        return rows
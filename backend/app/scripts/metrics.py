@@ -0,0 +1,298 @@
+"""
+Hot-path instrumentation: timing spans, histograms and a sampling profiler.
+
+    with span('feature_store.score'):
+        ...
+
+records the block's duration in the stage histogram exported at /metrics
+(Prometheus text format, one set per process) and, for requests made with
+?profile=1, in a per-request stage breakdown added to the JSON response (and
+to a Server-Timing header for every response type).
+
+Stages (nested ones overlap their parent):
+  - startup: init.catalog, init.lookup, init.search_index, init.feature_store,
+    init.recommender, init.ingest (one per stage, see scripts/startup.py)
+  - /recommend: service.score (recommender.lookup, then neighbors.lookup or
+    ann.score, ann.top_k, then recommender.rerank with diversity options),
+    service.enrich
+  - /recommend_full: service.resolve, service.score (neighbors.lookup, or
+    feature_store.score and feature_store.top_k, or ann.candidates/score/top_k),
+    service.rerank (diversity options only), service.records
+  - /search: search.index, search.records
+  - every /songs route: serialize (jsonify)
+Whole requests go to a separate histogram labelled by route. Stages run on
+the scoring pool (batched serving) reach the histograms but not ?profile=1.
+
+With METRICS_ENABLED=0 and no profiled request, span() returns a shared no-op
+object, so instrumented code pays one flag check per stage.
+
+The sampling profiler runs cProfile on a random share of requests (one at a
+time) and accumulates the stats until reset; it is switched on at runtime
+through POST /metrics/profiler.
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from flask import Blueprint, Response, g, jsonify, json, request
+
+METRICS_PREFIX = 'song_recommender'
+enabled = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# histogram bucket upper bounds, in seconds (startup stages can take a while)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# (stage, ms) list of the request being profiled on this thread/context, if any
+_profile = ContextVar('profile', default=None)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram of durations (seconds), one per label value.
+    """
+
+    def __init__(self, name, help_text, label, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}   # label value -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, seconds):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += seconds
+
+    def render(self):
+        """
+        Prometheus text exposition lines for this histogram.
+        """
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {value: list(counts) for value, counts in self._series.items()}
+        for value, counts in sorted(series.items()):
+            label = f'{self.label}="{_escape(value)}"'
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {total}')
+            total += counts[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f'{self.name}_sum{{{label}}} {counts[-1]}')
+            lines.append(f'{self.name}_count{{{label}}} {total}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+stage_seconds = Histogram(f"{METRICS_PREFIX}_stage_seconds", "Time spent in each instrumented stage.", 'stage')
+request_seconds = Histogram(f"{METRICS_PREFIX}_request_seconds", "Request latency by route.", 'route')
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(stage):
+    """
+    Context manager timing a stage (a no-op when nothing would record it).
+    """
+    if not enabled and _profile.get() is None:
+        return _NO_SPAN
+    return _Span(stage)
+
+
+def record(stage, seconds):
+    """
+    Add one stage duration to the histogram and the current request's profile.
+    """
+    if enabled:
+        stage_seconds.observe(stage, seconds)
+    stages = _profile.get()
+    if stages is not None:
+        stages.append((stage, seconds * 1000))
+
+
+def render():
+    """
+    Every metric in the Prometheus text format.
+    """
+    lines = stage_seconds.render() + request_seconds.render()
+    lines += [f"# HELP {METRICS_PREFIX}_profiler_sample_rate Share of requests run under cProfile.",
+              f"# TYPE {METRICS_PREFIX}_profiler_sample_rate gauge",
+              f"{METRICS_PREFIX}_profiler_sample_rate {profiler.rate}"]
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Runs cProfile on a random share (rate) of requests and merges their stats.
+    Only one request is profiled at a time (cProfile can't nest across
+    threads on newer Pythons); samples that find it busy are skipped.
+    """
+
+    def __init__(self, rate=0.0):
+        self.rate = rate
+        self.samples = 0
+        self._stats = None
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        A running cProfile.Profile if this request is sampled, else None.
+        """
+        if not self.rate or random.random() >= self.rate or not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiling tool is active
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile):
+        profile.disable()
+        self._busy.release()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.samples += 1
+
+    def report(self, sort='cumulative', limit=40):
+        """
+        pstats text of everything sampled so far.
+        """
+        with self._lock:
+            if self._stats is None:
+                return "No samples yet.\n"
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+            return f"{self.samples} sampled requests\n{out.getvalue()}"
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self.samples = 0
+
+
+profiler = SamplingProfiler(float(os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+
+@metrics_bp.before_app_request
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_profile = profiler.start()
+    if request.args.get('profile') == '1':
+        g.metrics_stages = []
+        g.metrics_token = _profile.set(g.metrics_stages)
+
+
+@metrics_bp.after_app_request
+def _finish_request(response):
+    elapsed = time.perf_counter() - g.metrics_start
+    if g.get('metrics_profile') is not None:
+        profiler.stop(g.metrics_profile)
+    if enabled:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_seconds.observe(route, elapsed)
+
+    stages = g.get('metrics_stages')
+    if stages is not None:
+        _profile.reset(g.metrics_token)
+        response.headers['Server-Timing'] = ", ".join(
+            [f"{stage};dur={ms:.3f}" for stage, ms in stages] + [f"total;dur={elapsed * 1000:.3f}"])
+        if response.is_json:
+            payload = response.get_json(silent=True)
+            if isinstance(payload, dict):
+                payload["profile"] = {
+                    "total_ms": round(elapsed * 1000, 3),
+                    "stages": [{"stage": stage, "ms": round(ms, 3)} for stage, ms in stages]
+                }
+                response.set_data(json.dumps(payload))
+    return response
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+@metrics_bp.route('/metrics/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    """
+    GET: cProfile report of the sampled requests
+      - sort (pstats key, default cumulative), limit (int, default 40)
+    POST: switch sampling at runtime
+      - rate (float 0-1, 0 turns it off), reset (bool) - JSON body or query
+    """
+    if request.method == 'GET':
+        sort = request.args.get('sort', default='cumulative', type=str)
+        limit = request.args.get('limit', default=40, type=int)
+        try:
+            return Response(profiler.report(sort, limit), mimetype='text/plain')
+        except KeyError:
+            return jsonify({"error": f"Unknown sort key '{sort}'"}), 400
+
+    body = request.get_json(silent=True) or {}
+    rate = body.get('rate', request.args.get('rate'))
+    reset = body.get('reset', request.args.get('reset', 'false'))
+    if rate is not None:
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            rate = -1
+        if not 0 <= rate <= 1:
+            return jsonify({"error": "'rate' must be a number between 0 and 1"}), 400
+        profiler.rate = rate
+    if reset is True or str(reset).lower() == 'true':
+        profiler.reset()
+    return jsonify({"rate": profiler.rate, "samples": profiler.samples})
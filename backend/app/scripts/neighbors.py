@@ -0,0 +1,298 @@
+"""
+Offline top-k neighbour tables.
+
+Run from backend/app:
+    python -m scripts.neighbors --k 50 --jobs 0
+
+builds the recommender features and the feature store from the CSV (the
+same pipelines the app runs at startup), computes every track's top K
+neighbours in blocks of seeds over a process pool and writes one table per
+query type next to the CSV (cleaned_tracks.<table>.neighbors):
+  recommend          - /songs/recommend (exact engine)
+  recommend_full     - /songs/recommend_full, same_genre=true
+  recommend_full_all - /songs/recommend_full, same_genre=false
+(/recommend_full tables use the store's default scaling and the exact engine).
+
+A table is a fixed-width binary file: a HEADER_BYTES header (magic line and
+JSON: table, catalog source hash, K, rows, scaling) followed by one record per
+catalog row, K int32 neighbour rows (-1 padded) then K float16 scores. It is
+served memory-mapped, so a lookup reads one record and worker processes share
+the pages. The app re-scores the k rows it serves at full precision, so the
+similarities match live scoring; float16 only decides which K rows are stored.
+
+--csv builds the tables (and the tracks cache they are built from) next to
+another CSV instead of the app's.
+
+A table is only opened for the catalog it was built from (same source hash
+and size). Ingest updates keep it but mark stale every seed whose top K a
+changed track could have entered or left; stale seeds, rows past the table,
+k above K and other engines or options fall back to live scoring.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import database
+from .metrics import span
+from .shared_arrays import offline_pool
+
+TABLES = ('recommend', 'recommend_full', 'recommend_full_all')
+MAGIC = b'SONG-NEIGHBORS 1\n'
+HEADER_BYTES = 4096
+
+DEFAULT_K = 50
+# serve from the tables when they exist (NEIGHBOR_TABLES=0 always scores live)
+enabled = os.environ.get('NEIGHBOR_TABLES', '1') != '0'
+
+# scores are float16: a changed track within this much of a seed's K-th
+# stored score may have entered its top K
+STALE_MARGIN = 1e-3
+# ingest batches larger than this drop the table instead of checking every seed
+MAX_UPDATE_ROWS = 1024
+# seeds per pool task are capped so one score block stays around this many cells
+BLOCK_CELLS = 1 << 24
+
+# state handed to forked pool workers (inherited copy-on-write, never pickled)
+_pool_state = {}
+
+
+def table_path(name):
+    """
+    File of a table, next to the CSV it was built from (resolved per call so
+    it follows database.CSV_PATH).
+    """
+    return os.path.splitext(database.CSV_PATH)[0] + f'.{name}.neighbors'
+
+
+def _record_dtype(k):
+    return np.dtype([('rows', '<i4', (k,)), ('scores', '<f2', (k,))])
+
+
+class NeighborTable:
+    """
+    A memory-mapped neighbour table plus the seeds marked stale since it was
+    opened. Never modified: updated() returns a new table over the same file.
+    """
+
+    def __init__(self, header, records, stale=None):
+        self.header = header
+        self.name = header['table']
+        self.k = header['k']
+        self.scaling = header.get('scaling')
+        self.records = records
+        self.stale = stale if stale is not None else np.zeros(len(records), dtype=bool)
+
+    @classmethod
+    def open(cls, name, catalog):
+        """
+        The table called name if it was built from this catalog, else None.
+        """
+        path = table_path(name)
+        if not enabled or catalog is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(HEADER_BYTES)
+            if not head.startswith(MAGIC):
+                return None
+            header = json.loads(head[len(MAGIC):].rstrip(b'\0'))
+            if header['table'] != name or header['source'] != catalog.source or header['rows'] != len(catalog):
+                return None
+            records = np.memmap(path, dtype=_record_dtype(header['k']), mode='r', offset=HEADER_BYTES,
+                                shape=(header['rows'],))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring neighbour table '{name}': {e}")
+            return None
+        return cls(header, records)
+
+    def lookup(self, row, k, score=None):
+        """
+        (rows, similarities) of the k nearest neighbours of catalog row, best
+        first, or None when the table can't answer (stale seed, unknown row
+        or k above K).
+
+        The stored scores are float16; score(rows), when given, recomputes
+        the similarities of the k stored rows at full precision (the same
+        values live scoring returns) and the rows are re-sorted by them.
+        """
+        if k > self.k or row >= len(self.records) or self.stale[row]:
+            return None
+        with span('neighbors.lookup'):
+            record = self.records[row]
+            rows = record['rows'][:k]
+            found = rows >= 0
+            rows = rows[found].astype(np.intp)
+            if score is None:
+                return rows, record['scores'][:k][found].astype(np.float32)
+            sims = score(rows)
+            best = np.argsort(-sims, kind='stable')
+            return rows[best], sims[best]
+
+    def updated(self, rows, score_block):
+        """
+        Table for a catalog in which the given rows changed or were appended.
+        score_block(rows) gives the new similarity of each of those rows to
+        every seed, shaped (table rows, len(rows)), -inf where a row is no
+        candidate for the seed. Seeds that are changed rows, list one, or
+        could now rank one in their top K become stale. Returns None for
+        batches above MAX_UPDATE_ROWS.
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        if len(rows) > MAX_UPDATE_ROWS:
+            return None
+        n = len(self.records)
+        stale = self.stale.copy()
+        stale[rows[rows < n]] = True
+
+        # lists holding a changed row (changed[-1] is the padding slot)
+        changed = np.zeros(n + 1, dtype=bool)
+        changed[rows[rows < n]] = True
+        listed = self.records['rows']
+        for start in range(0, n, 65536):
+            stale[start:start + 65536] |= changed[listed[start:start + 65536]].any(axis=1)
+
+        # seeds a changed row could enter: score above their stored K-th
+        kth = self.records['scores'][:, -1].astype(np.float32) - STALE_MARGIN
+        kth[self.records['rows'][:, -1] < 0] = -np.inf
+        for start in range(0, len(rows), 64):
+            scores = score_block(rows[start:start + 64])
+            stale |= (scores > kth[:, None]).any(axis=1)
+        return NeighborTable(self.header, self.records, stale)
+
+
+def _recommend_block(bounds):
+    """
+    Pool worker: /recommend neighbours for the recommender rows in bounds.
+    """
+    from .scoring import top_k_similar
+    start, stop = bounds
+    state, records, k = _pool_state['state'], _pool_state['records'], _pool_state['k']
+    features = state.feature_matrix
+    seeds = np.arange(start, stop)
+    top, scores = top_k_similar(features, features[seeds], k, exclude=seeds)
+    seed_rows = state.track_rows[seeds]
+    width = top.shape[1]
+    records['rows'][seed_rows, :width] = state.track_rows[top]
+    records['scores'][seed_rows, :width] = scores
+    return stop - start
+
+
+def _recommend_full_block(bounds):
+    """
+    Pool worker: /recommend_full neighbours for the catalog rows in bounds.
+    """
+    start, stop = bounds
+    store, records, k = _pool_state['store'], _pool_state['records'], _pool_state['k']
+    results = store.recommend_batch(np.arange(start, stop), k=k, same_genre=_pool_state['same_genre'])
+    for row, (top, scores) in zip(range(start, stop), results):
+        records['rows'][row, :len(top)] = top
+        records['scores'][row, :len(top)] = scores
+    return stop - start
+
+
+def _write_table(name, catalog, k, n_jobs, worker, n_seeds, n_candidates, **pool_state):
+    """
+    Fill a new table file for name through worker(bounds) over n_seeds seeds
+    (in blocks over a forked pool) and move it into place.
+    """
+    path = table_path(name)
+    header = {"table": name, "source": catalog.source, "k": k, "rows": len(catalog),
+              "scaling": pool_state.get('scaling'), "built": time.strftime('%Y-%m-%dT%H:%M:%S')}
+    head = MAGIC + json.dumps(header).encode('utf-8')
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(head.ljust(HEADER_BYTES, b'\0'))
+    records = np.memmap(tmp, dtype=_record_dtype(k), mode='r+', offset=HEADER_BYTES, shape=(len(catalog),))
+    records['rows'] = -1
+    records['scores'] = 0
+
+    block = max(1, min(1024, BLOCK_CELLS // max(n_candidates, 1)))
+    blocks = [(start, min(start + block, n_seeds)) for start in range(0, n_seeds, block)]
+    _pool_state.update(pool_state, records=records, k=k)
+    try:
+        can_fork = 'fork' in multiprocessing.get_all_start_methods()
+        if n_jobs <= 1 or len(blocks) <= 1 or not can_fork:
+            for bounds in blocks:
+                worker(bounds)
+        else:
+            # the children write through the inherited shared mapping
+            with offline_pool() as context, ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as pool:
+                for _ in pool.map(worker, blocks):
+                    pass
+        records.flush()
+    finally:
+        _pool_state.clear()
+        del records
+    os.replace(tmp, path)
+    return path
+
+
+def build_tables(tables=TABLES, k=DEFAULT_K, n_jobs=0):
+    """
+    Build the given tables for the catalog in database.CSV_PATH.
+    Returns {table: (path, seconds)}.
+    """
+    from . import recommender
+    from .catalog import get_catalog
+    from .feature_store import FeatureStore
+
+    unknown = sorted(set(tables) - set(TABLES))
+    if unknown:
+        raise ValueError(f"Unknown tables {unknown}, expected some of {TABLES}")
+    n_jobs = os.cpu_count() if n_jobs in (0, None) else n_jobs
+    catalog = get_catalog()
+    if catalog is None or len(catalog) == 0:
+        raise ValueError("No data loaded from CSV")
+
+    built = {}
+    if 'recommend' in tables:
+        start = time.perf_counter()
+        state = recommender.build_state(catalog)
+        n = len(state.track_rows)
+        path = _write_table('recommend', catalog, k, n_jobs, _recommend_block, n, n, state=state)
+        built['recommend'] = (path, time.perf_counter() - start)
+
+    store = None
+    for name, same_genre in (('recommend_full', True), ('recommend_full_all', False)):
+        if name not in tables:
+            continue
+        start = time.perf_counter()
+        if store is None:
+            store = FeatureStore(catalog)
+            # score everything live, not from the tables being replaced
+            store.neighbors = {}
+        # same-genre seeds score one genre slice, so blocks can be larger
+        n_candidates = max(stop - begin for begin, stop in store.genre_bounds.values()) \
+            if same_genre and store.genre_bounds else len(catalog)
+        path = _write_table(name, catalog, k, n_jobs, _recommend_full_block, len(catalog), n_candidates,
+                            store=store, same_genre=same_genre, scaling=store.scaling)
+        built[name] = (path, time.perf_counter() - start)
+    return built
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help="neighbours stored per track")
+    parser.add_argument('--tables', default=','.join(TABLES), help="comma-separated tables to build")
+    parser.add_argument('--jobs', type=int, default=0, help="worker processes (0 = one per CPU)")
+    parser.add_argument('--csv', default=None, help="tracks CSV (default: the app's)")
+    args = parser.parse_args(argv)
+    if args.k < 1:
+        parser.error("--k must be at least 1")
+    if args.csv:
+        database.use_csv(args.csv)
+
+    tables = [name.strip() for name in args.tables.split(',') if name.strip()]
+    try:
+        built = build_tables(tables, k=args.k, n_jobs=args.jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    for name, (path, seconds) in built.items():
+        print(f"{name}: {path} ({os.path.getsize(path) / 2 ** 20:.1f} MiB, {seconds:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
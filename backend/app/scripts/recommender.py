@@ -1,250 +1,352 @@
-import pandas as pd
+import copy
+import numpy as np
 import os
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
-from database import load_tracks_data
-import time
+from .catalog import get_catalog
+from .scoring import CompactFeatures, category_rows, iter_blocks
+from .ann import AnnSearcher
+from .shared_arrays import load_or_build, allocate, BUILD_BLOCK_ROWS
+from .neighbors import NeighborTable
+from .metrics import span
+
+# features used by the recommender (plus the one-hot genre)
+NUMERICAL_FEATURES = ['danceability', 'energy', 'loudness', 'tempo', 'valence']
+
+# precision the normalized features are stored and scored in: float32
+# (default) or float64
+FEATURE_DTYPE = np.dtype(os.environ.get('RECOMMENDER_DTYPE', 'float32'))
+if FEATURE_DTYPE not in (np.float32, np.float64):
+    raise ValueError(f"RECOMMENDER_DTYPE must be float32 or float64, not {FEATURE_DTYPE}")
 
 # global variables
-similarity_matrix = None
-df_sample = None
-indices = None
+# RecommenderState for the current catalog: an L2-normalized feature matrix
+# (one row per track) scored per query instead of a dense N x N matrix, plus
+# the row mappings. Replaced as a whole when the catalog changes (see
+# scripts/ingest.py), so read it once per request.
+state = None
 
-def initialize_recommender():
 
-    global similarity_matrix, df_sample, indices
+class RecommenderState:
+    """
+    The recommender's view of one catalog version:
+      - feature_matrix: normalized features of every usable catalog row, as
+        CompactFeatures (numeric part, genre weight and genre code per row
+        instead of the one-hot block)
+      - track_rows: catalog row behind each feature_matrix row
+      - row_to_index: catalog row -> feature_matrix row (-1 for rows dropped in preprocessing)
+      - searcher: exact or approximate (ivf / lsh) top-k search over feature_matrix
+      - neighbors: the precomputed 'recommend' NeighborTable, if one was
+        built for this catalog (see scripts/neighbors.py)
+    Never modified: updated() returns a new state.
+    """
+
+    def __init__(self, catalog, arrays):
+        self.catalog = catalog
+        self.track_rows = arrays['track_rows']
+        self.row_to_index = arrays['row_to_index']
+        self.feature_matrix = CompactFeatures(arrays['numeric'], arrays['genre_weight'], arrays['genre_codes'],
+                                              len(arrays['genre_offsets']) - 1, arrays['genre_order'],
+                                              arrays['genre_offsets'])
+        # fitted MinMaxScaler (X * scale + min) and the range it was fit on
+        self.scale, self.min = arrays['scale'], arrays['min']
+        self.data_min, self.data_max = arrays['data_min'], arrays['data_max']
+        # range of everything loaded since, for drift()
+        self.seen_min, self.seen_max = self.data_min, self.data_max
+        # genres of the (virtual) one-hot columns, in order
+        self.genre_names = catalog.genre_names[:self.feature_matrix.n_categories]
+        self.searcher = AnnSearcher(self.feature_matrix)
+        self.neighbors = NeighborTable.open('recommend', catalog)
+
+    def updated(self, catalog, rows):
+        """
+        State for catalog, a new version of self.catalog in which only the
+        given rows changed or were appended. Changed rows are rewritten in
+        place, newly usable rows appended; they are scaled with the fitted
+        scaler and new genres add (virtual) one-hot columns.
+        Falls back to a full build when rows became unusable or genre codes moved.
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        n_old_rows = len(self.row_to_index)
+        usable = _usable(catalog.df, rows)
+        was_loaded = np.zeros(len(rows), dtype=bool)
+        was_loaded[rows < n_old_rows] = self.row_to_index[rows[rows < n_old_rows]] >= 0
+        if np.any(was_loaded & ~usable) or \
+                list(catalog.genre_names[:len(self.genre_names)]) != list(self.genre_names):
+            return build_state(catalog)
+
+        row_to_index = np.full(len(catalog), -1, dtype=np.intp)
+        row_to_index[:n_old_rows] = self.row_to_index
+        added = rows[usable & (row_to_index[rows] < 0)]
+        n_old = len(self.track_rows)
+        row_to_index[added] = np.arange(n_old, n_old + len(added))
+        track_rows = np.concatenate([self.track_rows, added])
+
+        old = self.feature_matrix
+        numeric = np.empty((len(track_rows), len(NUMERICAL_FEATURES)), dtype=old.dtype)
+        weight = np.empty(len(track_rows), dtype=old.dtype)
+        codes = np.empty(len(track_rows), dtype=old.codes.dtype)
+        numeric[:n_old], weight[:n_old], codes[:n_old] = old.numeric, old.weight, old.codes
+        written = rows[usable]
+        X = _numeric(catalog.df, written)
+        numeric[row_to_index[written]], weight[row_to_index[written]] = _feature_vectors(X, self.scale, self.min)
+        codes[row_to_index[written]] = catalog.genre_codes[written]
+        feature_matrix = CompactFeatures.grouped(numeric, weight, codes, len(catalog.genre_names))
+
+        previous = np.arange(len(track_rows))
+        previous[n_old:] = -1
+        previous[row_to_index[written]] = -1
+
+        new = copy.copy(self)
+        new.catalog = catalog
+        new.track_rows, new.row_to_index, new.feature_matrix = track_rows, row_to_index, feature_matrix
+        if len(X):
+            new.seen_min = np.minimum(self.seen_min, X.min(axis=0))
+            new.seen_max = np.maximum(self.seen_max, X.max(axis=0))
+        new.genre_names = catalog.genre_names
+        if feature_matrix.n_categories == old.n_categories:
+            new.searcher = self.searcher.updated(feature_matrix, previous)
+        else:
+            # ANN indexes are fit on the old dimensionality; rebuilt on first use
+            new.searcher = AnnSearcher(feature_matrix)
+        if self.neighbors is not None:
+            new.neighbors = self.neighbors.updated(written, new._neighbor_scores)
+        return new
+
+    def _neighbor_scores(self, rows):
+        """
+        Similarity of each of the given catalog rows to every catalog row
+        (-inf for rows the recommender doesn't load), for NeighborTable.updated.
+        """
+        n = len(self.neighbors.records)
+        scores = np.full((n, len(rows)), -np.inf, dtype=np.float32)
+        queries = np.stack([self.feature_matrix[i] for i in self.row_to_index[rows]], axis=1)
+        seeds = self.track_rows < n
+        scores[self.track_rows[seeds]] = (self.feature_matrix @ queries)[seeds]
+        return scores
+
+    def drift(self):
+        """
+        How far loaded values fall outside the range the scaler was fit on,
+        as a fraction of that range (0 while every value is inside it).
+        """
+        data_range = self.data_max - self.data_min
+        data_range = np.where(data_range == 0, 1.0, data_range)
+        outside = np.maximum(self.data_min - self.seen_min, 0) + np.maximum(self.seen_max - self.data_max, 0)
+        return float(np.max(outside / data_range))
+
+
+def initialize_recommender():
+    """
+    Build the recommender state for the shared catalog (the 'recommender'
+    startup stage). Raises RuntimeError if there is nothing to recommend from.
+    """
+    global state
     print("Intializing recommender engine...")
 
     # LOAD THE DATA 
-    # featch data FROM CSV
-    try:
-        df_sample = load_tracks_data()
-        
-        if df_sample is None or len(df_sample) == 0:
-            print("Error: No data loaded from CSV")
-            return
-
-        print(f"Loaded {len(df_sample)} records from CSV")
-        
-        # use a small sample for testing
-        sample_size = 2000
-        df_sample = df_sample.sample(sample_size, random_state=42)
-        print(f"Using sample of {sample_size} songs for testing")
-
-        # ML PREPROCESSING
-        numerical_features = ['danceability', 'energy', 'loudness', 'tempo', 'valence']
-
-        # drop the rows if essential data is missing
-        initial_count = len(df_sample)
-        df_sample = df_sample.dropna(subset=numerical_features + ['track_genre', 'track_search']).reset_index(drop=True)
-        print(f"After dropping NA: {len(df_sample)} records (removed {initial_count - len(df_sample)})")
-
-        if len(df_sample) == 0:
-            print("Error: No records left after dropping NA values")
-            return
-
-        # scale the numeric values so that the model understands it
-        scaler = MinMaxScaler()
-        X_numerical_scaled = pd.DataFrame(
-            scaler.fit_transform(df_sample[numerical_features]),
-            columns=numerical_features,
-            index=df_sample.index
-        )
-
-        # one-hot encoding for track genres
-        genre_encoded = pd.get_dummies(df_sample['track_genre'], prefix='genre')
-        final_features = pd.concat([X_numerical_scaled, genre_encoded], axis=1)
-
-        # CALCULATE SIMILARITY 
-        similarity_matrix = cosine_similarity(final_features)
-
-        # create indices map
-        indices = pd.Series(df_sample.index, index=df_sample['track_search'].str.lower())
-        indices = indices[~indices.index.duplicated(keep='first')]
-
-        print("Engine ready")
-    
-    except Exception as e:
-        print(f"Failed to initialize recommender: {e}")
-
-def get_ml_recommendations(song_title):
-    if similarity_matrix is None:
-        return {"error": "Recommender is still initializing or failed."}
+    # shared catalog (loaded once for the whole app, by the 'catalog' stage)
+    catalog = get_catalog()
 
-    song_title = song_title.lower()
+    if catalog is None or len(catalog) == 0:
+        raise RuntimeError("No data loaded from CSV")
 
-    # get the index of the song
-    try:
-        idx = indices[song_title]
-    except KeyError:
-        print(song_title)
-        return {f"error": "Song not found in the currently loaded sample"}
-    
-    # get the pairwise similarity score of all songs with the song entered by the user
-    sim_scores = list(enumerate(similarity_matrix[idx]))
+    df = catalog.df
+    print(f"Using {len(df)} records from the catalog")
 
-    # sort the songs based on the similarity score (descending)
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
+    new_state = build_state(catalog)
+    track_rows = new_state.track_rows
+    print(f"After dropping NA: {len(track_rows)} records (removed {len(df) - len(track_rows)})")
+
+    if len(track_rows) == 0:
+        raise RuntimeError("No records left after dropping NA values")
+
+    state = new_state
+    print(f"Engine ready ({len(track_rows)} songs)")
+
+def build_state(catalog):
+    """
+    RecommenderState for catalog, fitting the scaler on all of it.
+    """
+    # features are built once per catalog version and memory-mapped by
+    # every worker process (see scripts/shared_arrays.py); catalogs
+    # changed by ingest are built in memory
+    version = f"{catalog.version}:{FEATURE_DTYPE.name}" if catalog.from_file else None
+    return RecommenderState(catalog, load_or_build('recommender', version, lambda: _build_features(catalog)))
+
+def _usable(df, rows=None):
+    """
+    True for rows that have every feature the recommender needs.
+    """
+    columns = NUMERICAL_FEATURES + ['track_genre', 'track_search']
+    subset = df[columns] if rows is None else df[columns].iloc[rows]
+    return subset.notna().all(axis=1).to_numpy()
+
+def _numeric(df, rows):
+    return df[NUMERICAL_FEATURES].iloc[rows].to_numpy(dtype=np.float64).reshape(-1, len(NUMERICAL_FEATURES))
+
+def _feature_vectors(X, scale, offset):
+    """
+    Normalized rows of scaled numeric features + one-hot genre, as the
+    numeric part and the weight of the genre's 1 (see CompactFeatures).
+    """
+    scaled = X * scale + offset
+    inverse_norm = 1.0 / np.sqrt(np.einsum('ij,ij->i', scaled, scaled) + 1.0)
+    return scaled * inverse_norm[:, None], inverse_norm
 
-    # get top 5 songs with highest similarity scores
-    sim_scores = sim_scores[1:6]
+def _build_features(catalog):
+    """
+    Normalized features (scaled numeric features + one-hot genre, stored as
+    CompactFeatures arrays) for every usable catalog row, plus the row
+    mappings in both directions and the fitted scaler.
+    """
+    df = catalog.df
+
+    # ML PREPROCESSING
+    # drop the rows if essential data is missing
+    track_rows = np.flatnonzero(_usable(df))
+
+    # map catalog rows back to feature rows
+    row_to_index = np.full(len(df), -1, dtype=np.intp)
+    row_to_index[track_rows] = np.arange(len(track_rows))
+
+    if len(track_rows) == 0:
+        empty = np.zeros(len(NUMERICAL_FEATURES))
+        return {"track_rows": track_rows, "row_to_index": row_to_index,
+                "numeric": np.empty((0, len(NUMERICAL_FEATURES)), dtype=FEATURE_DTYPE),
+                "genre_weight": np.empty(0, dtype=FEATURE_DTYPE), "genre_codes": np.empty(0, dtype=np.int32),
+                "genre_order": np.empty(0, dtype=np.int32), "genre_offsets": np.zeros(1, dtype=np.intp),
+                "scale": empty + 1, "min": empty, "data_min": empty, "data_max": empty}
+
+    # scale the numeric values so that the model understands it
+    # (fit and transform a block of rows at a time, so peak memory doesn't
+    # grow with the catalog; the matrix itself is written to disk when shared)
+    # imported here: sklearn takes over a second to import (see scripts/startup.py)
+    from sklearn.preprocessing import MinMaxScaler
+    scaler = MinMaxScaler()
+    blocks = list(iter_blocks(len(track_rows), BUILD_BLOCK_ROWS))
+    for start, stop in blocks:
+        scaler.partial_fit(_numeric(df, track_rows[start:stop]))
+
+    # one-hot encoding for track genres (from the catalog's genre codes)
+    # NORMALIZE FEATURES
+    # cosine similarity is a dot product of unit vectors, so we only keep
+    # the normalized rows (linear in catalog size) and score on demand; the
+    # one-hot block is never materialized, only each row's genre code and weight
+    numeric = allocate('numeric', (len(track_rows), len(NUMERICAL_FEATURES)), FEATURE_DTYPE)
+    weight = allocate('genre_weight', (len(track_rows),), FEATURE_DTYPE)
+    codes = allocate('genre_codes', (len(track_rows),), np.int32)
+    for start, stop in blocks:
+        rows = track_rows[start:stop]
+        numeric[start:stop], weight[start:stop] = _feature_vectors(_numeric(df, rows), scaler.scale_, scaler.min_)
+        codes[start:stop] = catalog.genre_codes[rows]
+    order, offsets = category_rows(codes, len(catalog.genre_names))
+    return {"track_rows": track_rows, "row_to_index": row_to_index,
+            "numeric": numeric, "genre_weight": weight, "genre_codes": codes,
+            "genre_order": order, "genre_offsets": offsets,
+            "scale": scaler.scale_, "min": scaler.min_,
+            "data_min": scaler.data_min_, "data_max": scaler.data_max_}
+
+def _index_for_title(current, song_title):
+    """
+    feature_matrix row of the first loaded song with this track_search, or None
+    """
+    for row in current.catalog.lookup.rows_for_search(song_title):
+        if current.row_to_index[row] >= 0:
+            return int(current.row_to_index[row])
+    return None
 
-    # get the songs' indices
-    song_indices = [i[0] for i in sim_scores]
+def get_recommendation_rows(song_title, k=5, engine='exact', nprobe=None):
+    """
+    (catalog, rows, similarities) for the k songs most similar to song_title,
+    best first, or an {"error": ...} dict. rows are positions in catalog.df
+    (the recommender's own snapshot), so callers can fetch any columns for
+    them in one lookup.
+    """
+    current = state
+    if current is None:
+        return {"error": "Recommender is still initializing or failed."}
 
-    # return recommended songs info
-    return df_sample[['track_name', 'artists', 'track_genre', 'track_search']].iloc[song_indices].to_dict(orient='records')
+    # get the index of the song
+    with span('recommender.lookup'):
+        idx = _index_for_title(current, song_title)
+    if idx is None:
+        return {f"error": "Song not found in the catalog"}
+    rows, sims = _candidate_rows(current, idx, k, engine, nprobe)
+    return current.catalog, rows, sims
+
+def _candidate_rows(current, idx, k, engine, nprobe):
+    """
+    (catalog rows, similarities) of the k nearest neighbours of feature_matrix row idx.
+    """
+    # precomputed offline for this catalog (see scripts/neighbors.py)
+    if engine == 'exact' and current.neighbors is not None:
+        # (re-scored at full precision: the table stores float16 scores)
+        found = current.neighbors.lookup(
+            int(current.track_rows[idx]), k,
+            score=lambda rows: current.feature_matrix[current.row_to_index[rows]] @ current.feature_matrix[idx])
+        if found is not None:
+            return found
+
+    # get top k songs with highest similarity scores (excluding the song itself),
+    # scoring every song (exact) or only the ANN candidates (ivf / lsh)
+    song_indices, sims = current.searcher.search(current.feature_matrix[idx], k, exclude=idx, engine=engine,
+                                                 nprobe=nprobe)
+    return current.track_rows[song_indices], sims
+
+def get_reranked_rows(song_title, reranking, k=5, engine='exact', nprobe=None):
+    """
+    get_recommendation_rows for a diversity-aware list: the best
+    reranking.pool_size(k) songs, reranked to k by reranking (a
+    scripts.diversity.Reranking). Returns (catalog, rows, similarities,
+    report) or an {"error": ...} dict; report has the list's metrics before
+    and after reranking.
+    """
+    current = state
+    if current is None:
+        return {"error": "Recommender is still initializing or failed."}
+    with span('recommender.lookup'):
+        idx = _index_for_title(current, song_title)
+    if idx is None:
+        return {"error": "Song not found in the catalog"}
+    rows, sims = _candidate_rows(current, idx, reranking.pool_size(k), engine, nprobe)
+    with span('recommender.rerank'):
+        rows, sims, report = reranking.apply(current.catalog, current.track_rows[idx], rows, sims,
+                                             current.feature_matrix, current.row_to_index[rows], k)
+    return current.catalog, rows, sims, report
+
+def get_ann_recall(song_title, k=5, engine='ivf', nprobe=None):
+    """
+    Recall@k of an ANN engine against exact search for one song,
+    or None if the song is unknown.
+    """
+    current = state
+    if current is None:
+        return None
+    idx = _index_for_title(current, song_title)
+    if idx is None:
+        return None
+    return current.searcher.recall(current.feature_matrix[idx], k, exclude=idx, engine=engine, nprobe=nprobe)
 
 
-def get_loaded_track_ids():
+def get_loaded_mask():
     """
-    Return list of track_ids present in the in-memory df_sample.
-    Read-only; no model changes.
+    Boolean array over catalog rows: True where the track is loaded in the
+    recommender (survived preprocessing). Read-only; no model changes.
     """
-    if df_sample is None or 'track_id' not in df_sample.columns:
-        return []
-    # ensure str for consistent comparison
-    return df_sample['track_id'].dropna().astype(str).tolist()
+    current = state
+    if current is None:
+        return None
+    return current.row_to_index >= 0
 
 
 def get_title_for_id(track_id):
     """
-    If the given track_id is in the in-memory sample, return the normalized title
+    If the given track_id is loaded in the recommender, return the normalized title
     (track_search if available, else track_name). Otherwise return None.
     """
-    if df_sample is None:
-        return None
-    # ensure same dtype comparison
-    mask = df_sample['track_id'].astype(str) == str(track_id)
-    if not mask.any():
+    current = state
+    if current is None:
         return None
-    row = df_sample.loc[mask].iloc[0]
-    title = None
-    if 'track_search' in df_sample.columns and pd.notna(row.get('track_search')):
-        return str(row.get('track_search')).strip()
-    elif 'track_name' in df_sample.columns and pd.notna(row.get('track_name')):
-        return str(row.get('track_name')).strip()
+    for row in current.catalog.rows_for_id(track_id):
+        if current.row_to_index[row] >= 0:
+            return current.catalog.title_of(row)
     return None
-
-def get_performance_metrics(song_title):
-
-    # Check if recommender is properly initialized
-    if df_sample is None or indices is None:
-        return {"error": "Recommender not properly initialized"}
-
-    song_title_lower = song_title.lower()
-
-    # check if the song exists and get its details for comparison
-    try:
-        if song_title_lower not in indices:
-            return {"error": f"Song '{song_title}' not found in the sample"}
-        
-        idx = indices[song_title_lower]
-        input_song_details = df_sample.iloc[idx]
-        input_genre = input_song_details['track_genre']
-        input_artist = input_song_details['artists']
-
-    except KeyError:
-        return {"error": f"Song '{song_title}' not found in the sample"}
-
-    # measure the speed
-    start_time = time.time()
-    recommendations = get_ml_recommendations(song_title)
-    end_time = time.time()
-
-
-    # calculate duration in ms
-    query_duration_ms = (end_time - start_time) * 1000
-
-    # handle if the recommendation fails
-    if isinstance(recommendations, dict) and "error" in recommendations:
-        return {"error": recommendations["error"]}
-
-    if not recommendations:
-        return {"error": "No recommendations generated"}
-
-    # calculate quality metrics
-
-    # find the percentage of recommendations that share the same genre
-    matching_genres = 0
-    for song in recommendations: 
-        if song['track_genre'] == input_genre:
-            matching_genres += 1
-    
-    # find a score from 0 to 1
-    genre_relevance = matching_genres / len(recommendations)
-
-    # find the percentage of recommendations that come from diverse artists
-    different_artists = 0
-    for song in recommendations:
-        if song['artists'] != input_artist:
-            different_artists += 1
-    
-    # find a score from 0 to 1
-    artist_diversity = different_artists / len(recommendations)
-
-    return{
-        "input_song": song_title,
-        "input_genre": input_genre,
-        "query_speed_ms": round(query_duration_ms, 2),
-        "metrics": {
-            "genre_relevance": genre_relevance,
-            "artist_diversity": artist_diversity
-        },
-        "recommendations": recommendations
-    }
-
-def run_batch_evals(n_songs=100):
-    """
-    Run the evaluation on n songs to calculate average metrics fro the whole system
-    """
-
-    if df_sample is None:
-        return {"error": "Recommender not initialized."}
-
-    # Ensure we don't request more songs than available
-    if n_songs > len(df_sample):
-        n_songs = len(df_sample)
-        print(f"Adjusting n_songs to {n_songs} (available samples)")
-
-    # select songs to test
-    test_songs = df_sample.sample(n_songs)
-    print(f"Selected {len(test_songs)} songs for evaluation")
-
-    total_speed = 0
-    total_genre_relevance = 0
-    total_artist_diversity = 0
-    successful_runs = 0
-    failed_runs = 0
-
-    print(f"Running evaluation on {n_songs} random songs...")
-
-    for idx, (_, song) in enumerate(test_songs.iterrows()):
-        song_title = song['track_search']
-        print(f"Processing {idx+1}/{n_songs}: {song_title}")
-        
-        metrics = get_performance_metrics(song_title)
-
-        if "error" not in metrics:
-            total_speed += metrics['query_speed_ms']
-            total_genre_relevance += metrics['metrics']['genre_relevance']
-            total_artist_diversity += metrics['metrics']['artist_diversity']
-            successful_runs += 1
-            print(f"  Success - Speed: {metrics['query_speed_ms']}ms")
-        else:
-            failed_runs += 1
-            print(f"  Failed: {metrics['error']}")
-
-    print(f"Evaluation complete: {successful_runs} successful, {failed_runs} failed")
-
-    if successful_runs == 0:
-        return {"error": "All evaluation runs failed."}
-
-    # return averages
-    return {
-        "total_songs_tested": successful_runs,
-        "failed_runs": failed_runs,
-        "average_query_speed_ms": round(total_speed / successful_runs, 2),
-        "average_genre_relevance": round(total_genre_relevance / successful_runs, 4),
-        "average_artist_diversity": round(total_artist_diversity / successful_runs, 4)
-    }
\ No newline at end of file
@@ -0,0 +1,370 @@
+"""
+Response bodies for the /songs routes, written from the catalog's column arrays.
+
+Record lists (recommendations, search results) are Records: catalog rows,
+field names and any per-request values (similarity, in_sample), turned into
+dicts only when something asks for them (templates, msgpack). JSON is
+written without building them:
+  - every catalog column gets an encoder per DataFrame: categorical columns
+    encode each category once and gather the encoded strings by code, other
+    columns encode just the rows asked for;
+  - the encoded catalog part of a record ("key":value pairs, per
+    (row, fields)) is kept in a bounded LRU shared by all requests, so
+    popular tracks are encoded once and only the per-request values are
+    spliced in.
+
+dumps() writes what Flask's jsonify writes in its compact mode (sorted
+keys, ASCII escapes, no spaces), except that NaN and infinity become null
+(jsonify writes NaN, which JSON parsers reject) and numpy scalars and arrays
+are accepted. encode() adds the other formats: the 'columns' layout (every
+record list becomes {field: [values]}) and msgpack, if it is installed.
+"""
+import math
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
+import numpy as np
+import pandas as pd
+
+try:
+    import msgpack
+except ImportError:  # optional: format=msgpack answers 400 without it
+    msgpack = None
+
+FORMATS = ('json', 'msgpack')
+LAYOUTS = ('records', 'columns')
+
+# encoded (row, fields) fragments kept per DataFrame
+DEFAULT_MAX_FRAGMENTS = int(os.environ.get('RESPONSE_FRAGMENT_ROWS', 50000))
+
+# id(DataFrame) -> its RecordEncoder, dropped when the DataFrame is collected
+# (DataFrames aren't hashable, so no WeakKeyDictionary)
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def _native(value):
+    """
+    Python value of a cell: numpy scalars unboxed, NaN / NaT as None.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if value is pd.NaT:
+        return None
+    return value
+
+
+def _encode_scalar(value):
+    """
+    JSON text of one scalar, as json.dumps writes it (floats with repr);
+    NaN and infinity are null.
+    """
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return float.__repr__(value) if math.isfinite(value) else 'null'
+    if isinstance(value, np.generic):
+        return _encode_scalar(value.item())
+    return _dumps(value)
+
+
+class _Column:
+    """
+    Encoded values and native values of one DataFrame column, for any rows.
+    """
+
+    def __init__(self, column):
+        self.categories = None
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # each category is encoded once; code -1 (missing) picks the None slot at the end
+            self.codes = column.cat.codes.to_numpy()
+            categories = [_native(c) for c in column.cat.categories] + [None]
+            self.categories = np.empty(len(categories), dtype=object)
+            self.categories[:] = categories
+            self.encoded = np.empty(len(categories), dtype=object)
+            self.encoded[:] = [_encode_scalar(c) for c in categories]
+        elif isinstance(column.dtype, pd.api.extensions.ExtensionDtype):
+            # nullable columns (e.g. Int16 after an ingest): Python values, <NA> as None
+            self.values = column.to_numpy(dtype=object, na_value=None)
+            self.floats = False
+        else:
+            self.values = column.to_numpy()
+            self.floats = self.values.dtype.kind == 'f'
+
+    def natives(self, rows):
+        if self.categories is not None:
+            return self.categories[self.codes[rows]].tolist()
+        values = self.values[rows].tolist()
+        if self.floats or self.values.dtype.kind == 'O':
+            return [_native(v) for v in values]
+        return values
+
+    def encode(self, rows):
+        if self.categories is not None:
+            return self.encoded[self.codes[rows]].tolist()
+        return [_encode_scalar(v) for v in self.values[rows].tolist()]
+
+
+class RecordEncoder:
+    """
+    Column encoders and the LRU of encoded record fragments for one DataFrame.
+    """
+
+    def __init__(self, df, max_fragments=DEFAULT_MAX_FRAGMENTS):
+        self._df = weakref.ref(df)
+        self.max_fragments = max_fragments
+        self._columns = {}
+        self._layouts = {}                # layout -> small id for the fragment keys
+        self._fragments = OrderedDict()   # (layout id, row) -> encoded pieces
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(['hits', 'misses'], 0)
+
+    def column(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            column = self._columns[name] = _Column(self._df()[name])
+        return column
+
+    def fragments(self, rows, layout):
+        """
+        Encoded catalog pieces of every row for a layout (see _layout):
+        one string of comma-joined "key":value pairs per run of catalog
+        fields between the spliced-in values.
+        """
+        runs = layout[0]
+        result = [None] * len(rows)
+        missing = []
+        with self._lock:
+            layout_id = self._layouts.setdefault(layout, len(self._layouts))
+            for i, row in enumerate(rows):
+                pieces = self._fragments.get((layout_id, row))
+                if pieces is None:
+                    missing.append(i)
+                else:
+                    self._fragments.move_to_end((layout_id, row))
+                    result[i] = pieces
+            self.stats['hits'] += len(rows) - len(missing)
+            self.stats['misses'] += len(missing)
+        if not missing:
+            return result
+
+        missing_rows = np.asarray(rows, dtype=np.intp)[missing]
+        encoded_runs = []
+        for run in runs:
+            pairs = [[encode_basestring_ascii(field) + ':' + value for value in self.column(field).encode(missing_rows)]
+                     for field in run]
+            encoded_runs.append([','.join(row_pairs) for row_pairs in zip(*pairs)] if pairs
+                                else [''] * len(missing_rows))
+        with self._lock:
+            for j, i in enumerate(missing):
+                pieces = result[i] = tuple(run[j] for run in encoded_runs)
+                self._fragments[(layout_id, rows[i])] = pieces
+            while len(self._fragments) > self.max_fragments:
+                self._fragments.popitem(last=False)
+        return result
+
+    def info(self):
+        with self._lock:
+            return {**self.stats, "fragments": len(self._fragments), "max_fragments": self.max_fragments}
+
+
+def record_encoder(df):
+    """
+    The RecordEncoder of a DataFrame (one per catalog table).
+    """
+    encoder = _encoders.get(id(df))
+    if encoder is None or encoder._df() is not df:
+        with _encoders_lock:
+            encoder = _encoders.get(id(df))
+            if encoder is None or encoder._df() is not df:
+                encoder = _encoders[id(df)] = RecordEncoder(df)
+                weakref.finalize(df, _forget, id(df), encoder)
+    return encoder
+
+
+def _forget(key, encoder):
+    with _encoders_lock:
+        if _encoders.get(key) is encoder:
+            del _encoders[key]
+
+
+def _layout(fields, extra):
+    """
+    JSON key order of records with these catalog fields and extra (spliced)
+    fields: (runs of catalog fields, extra fields), in jsonify's sorted order,
+    with one run before each extra field and one after the last.
+    """
+    runs, run, extras = [], [], []
+    for field in sorted(set(fields) | set(extra)):
+        if field in extra:
+            runs.append(tuple(run))
+            extras.append(field)
+            run = []
+        else:
+            run.append(field)
+    runs.append(tuple(run))
+    return tuple(runs), tuple(extras)
+
+
+class Records:
+    """
+    A list of records for rows of df: catalog fields plus per-record values
+    (field -> array, e.g. similarity) in fields order. Behaves like the list
+    of dicts (len, iteration, indexing, slicing); dicts are only built when
+    asked for, JSON comes from the record fragments.
+    """
+
+    def __init__(self, df, rows, fields, values=None):
+        self.df = df
+        self.rows = np.asarray(rows, dtype=np.intp)
+        self.fields = list(fields)
+        self.values = {field: np.asarray(v) for field, v in (values or {}).items()}
+        self._json = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Records(self.df, self.rows[key], self.fields, {f: v[key] for f, v in self.values.items()})
+        return self.to_list(self.rows[[key]], {f: v[[key]] for f, v in self.values.items()})[0]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"Records({self.to_list()!r})"
+
+    def _field_values(self, field, rows=None, values=None):
+        rows = self.rows if rows is None else rows
+        values = self.values if values is None else values
+        if field in values:
+            return [_native(v) for v in values[field].tolist()]
+        return record_encoder(self.df).column(field).natives(rows)
+
+    def to_list(self, rows=None, values=None):
+        """
+        The records as dicts (NaN as None).
+        """
+        rows = self.rows if rows is None else rows
+        columns = [self._field_values(field, rows, values) for field in self.fields]
+        return [dict(zip(self.fields, record)) for record in zip(*columns)] if columns else [{} for _ in rows]
+
+    def columns(self):
+        """
+        {field: [values]} (the 'columns' layout).
+        """
+        return {field: self._field_values(field) for field in self.fields}
+
+    def to_json(self):
+        """
+        JSON text of the list of records, spliced from the cached fragments.
+        """
+        if self._json is None:
+            extra = [field for field in self.fields if field in self.values]
+            catalog_fields = [field for field in self.fields if field not in self.values]
+            layout = _layout(catalog_fields, extra)
+            fragments = record_encoder(self.df).fragments(self.rows.tolist(), layout)
+            spliced = [[encode_basestring_ascii(field) + ':' + v
+                        for v in (_encode_scalar(x) for x in self.values[field].tolist())] for field in layout[1]]
+            records = []
+            for i, pieces in enumerate(fragments):
+                parts = [pieces[0]]
+                for j, values in enumerate(spliced):
+                    parts.append(values[i])
+                    parts.append(pieces[j + 1])
+                records.append('{' + ','.join(part for part in parts if part) + '}')
+            self._json = '[' + ','.join(records) + ']'
+        return self._json
+
+    def columns_json(self):
+        """
+        JSON text of the 'columns' layout, one encoded array per field.
+        """
+        encoder = record_encoder(self.df)
+        arrays = {}
+        for field in self.fields:
+            if field in self.values:
+                encoded = [_encode_scalar(v) for v in self.values[field].tolist()]
+            else:
+                encoded = encoder.column(field).encode(self.rows)
+            arrays[field] = '[' + ','.join(encoded) + ']'
+        return '{' + ','.join(encode_basestring_ascii(field) + ':' + arrays[field] for field in sorted(arrays)) + '}'
+
+
+def _key(key):
+    # json.dumps turns non-string keys into strings
+    if isinstance(key, str):
+        return key
+    return _encode_scalar(key).strip('"') if key is not None else 'null'
+
+
+def _dumps(value, columns=False):
+    if isinstance(value, Records):
+        return value.columns_json() if columns else value.to_json()
+    if isinstance(value, dict):
+        items = sorted(((_key(k), v) for k, v in value.items()), key=lambda item: item[0])
+        return '{' + ','.join(encode_basestring_ascii(k) + ':' + _dumps(v, columns) for k, v in items) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(_dumps(v, columns) for v in value) + ']'
+    if isinstance(value, np.ndarray):
+        return _dumps(value.tolist(), columns)
+    if isinstance(value, (str, int, float, np.generic)) or value is None:
+        return _encode_scalar(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload, layout='records'):
+    """
+    Compact JSON text of a payload (dicts, lists, scalars, numpy values and
+    Records), keys sorted like jsonify's.
+    """
+    return _dumps(payload, columns=layout == 'columns')
+
+
+def plain(payload, layout='records'):
+    """
+    The payload with Records turned into lists of dicts (or {field: [values]}
+    for the 'columns' layout) and numpy values into Python ones.
+    """
+    if isinstance(payload, Records):
+        return payload.columns() if layout == 'columns' else payload.to_list()
+    if isinstance(payload, dict):
+        return {k: plain(v, layout) for k, v in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [plain(v, layout) for v in payload]
+    if isinstance(payload, np.ndarray):
+        return plain(payload.tolist(), layout)
+    return _native(payload)
+
+
+def encode(payload, format='json', layout='records'):
+    """
+    (body bytes, mimetype) of a payload. Raises ValueError for an unknown
+    format or layout, or msgpack without the msgpack package.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"'format' must be one of {list(FORMATS)}")
+    if layout not in LAYOUTS:
+        raise ValueError(f"'layout' must be one of {list(LAYOUTS)}")
+    if format == 'msgpack':
+        if msgpack is None:
+            raise ValueError("format=msgpack needs the msgpack package")
+        return msgpack.packb(plain(payload, layout)), 'application/msgpack'
+    # trailing newline like jsonify
+    return (dumps(payload, layout) + '\n').encode('ascii'), 'application/json'
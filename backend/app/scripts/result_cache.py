@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from .responses import dumps
+
+# bump whenever scoring changes what a cached response would contain
+ENGINE_VERSION = 1
+
+# memory budget for cached responses (per process)
+DEFAULT_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_MB', 64)) * 1024 * 1024
+# seconds an entry stays valid (unset = until evicted or the catalog changes)
+DEFAULT_TTL = float(os.environ['RESULT_CACHE_TTL']) if os.environ.get('RESULT_CACHE_TTL') else None
+# optional directory shared by all worker processes (e.g. under /dev/shm)
+DEFAULT_DISK_DIR = os.environ.get('RESULT_CACHE_DIR') or None
+DEFAULT_DISK_MAX_BYTES = int(os.environ.get('RESULT_CACHE_DISK_MAX_MB', 512)) * 1024 * 1024
+
+# rough per-entry bookkeeping cost on top of the body (key tuple, dict slot)
+_ENTRY_OVERHEAD = 256
+# the disk tier is trimmed back under its budget every this many writes
+_DISK_PRUNE_EVERY = 256
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of response payloads (JSON-serializable dicts).
+
+    Entries are sized by their serialized JSON and evicted least-recently-used
+    first once they add up to more than max_bytes, and expire after ttl
+    seconds when a ttl is set.
+    version() is checked on every access: when it changes (catalog reloaded or
+    updated) the memory tier is dropped, and disk entries are stored under the
+    version so stale ones are never read. A version must mean the same data in
+    every process (e.g. the catalog's source hash).
+
+    With disk_dir set, misses fall through to a directory of one file per
+    entry, so worker processes reuse each other's results. Point it at a
+    tmpfs such as /dev/shm to keep that tier in shared memory.
+    """
+
+    def __init__(self, version=lambda: None, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL,
+                 disk_dir=DEFAULT_DISK_DIR, disk_max_bytes=DEFAULT_DISK_MAX_BYTES):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._entries = OrderedDict()   # key -> (payload, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._current_version = None
+        self._disk_writes = 0
+        self.stats = dict.fromkeys(
+            ['hits', 'misses', 'disk_hits', 'evictions', 'expirations', 'invalidations'], 0)
+
+    def _check_version(self):
+        """
+        Drop the memory tier if the data changed since it was filled.
+        Must hold the lock.
+        """
+        version = self.version()
+        if version != self._current_version:
+            if self._entries:
+                self.stats['invalidations'] += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._current_version = version
+        return version
+
+    def get(self, key):
+        """
+        Cached payload for key, or None. Payloads are shared: don't mutate them.
+        """
+        with self._lock:
+            version = self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, expires_at, size = entry
+                if expires_at is not None and expires_at < time.time():
+                    self._remove(key)
+                    self.stats['expirations'] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return payload
+
+        body = self._disk_get(version, key)
+        payload = None
+        if body is not None:
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                pass
+        with self._lock:
+            if payload is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self.stats['disk_hits'] += 1
+            if version == self._current_version:
+                self._store(key, payload, len(body))
+        return payload
+
+    def put(self, key, payload):
+        """
+        Cache a response payload under key.
+        """
+        body = dumps(payload).encode('ascii')
+        with self._lock:
+            version = self._check_version()
+            self._store(key, payload, len(body))
+        self._disk_put(version, key, body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def info(self):
+        """
+        Counters and occupancy, for the stats endpoint.
+        """
+        with self._lock:
+            self._check_version()
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                "hit_rate": round(self.stats['hits'] / lookups, 4) if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "version": self._current_version,
+                "engine_version": ENGINE_VERSION,
+                "disk_dir": self.disk_dir
+            }
+
+    # memory tier (callers hold the lock)
+
+    def _store(self, key, payload, body_size):
+        size = body_size + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        expires_at = time.time() + self.ttl if self.ttl else None
+        self._entries[key] = (payload, expires_at, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            old_key = next(iter(self._entries))
+            self._remove(old_key)
+            self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    # disk tier (one file per entry; writes are atomic renames so concurrent
+    # workers only ever see complete files)
+
+    def _disk_path(self, version, key):
+        digest = hashlib.sha1(repr((version, ENGINE_VERSION, key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, digest[:2], f"{digest}.json")
+
+    def _disk_get(self, version, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(version, key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, version, key, body):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(version, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not write result cache entry: {e}")
+            return
+
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % _DISK_PRUNE_EVERY == 0
+        if prune:
+            self._disk_prune()
+
+    def _disk_prune(self):
+        """
+        Delete the oldest files until the disk tier fits its budget.
+        """
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,207 @@
+import numpy as np
+
+# rows are scored in blocks of this size so a batch of queries never
+# materializes more than block_size x n_tracks similarities at once
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def normalize_rows(X):
+    """
+    L2-normalize every row of X so a dot product equals the cosine similarity.
+    All-zero rows stay zero (same convention as sklearn's cosine_similarity).
+    """
+    X = np.asarray(X)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return X / norms
+
+
+class CompactFeatures:
+    """
+    L2-normalized rows of [numeric features, one-hot category] without the
+    one-hot block. The normalized row of numeric features x in category c is
+    [x / n, e_c / n] with n = sqrt(|x|^2 + 1), so only x / n (numeric), 1 / n
+    (weight) and c (codes) are kept; the category part of any dot product is
+    added analytically (weight * the other side's entry for c).
+
+    Behaves like the dense (n_rows, n_numeric + n_categories) matrix where
+    the scoring code needs it: len/shape, features @ vector or matrix,
+    features[i] (a dense row), features[rows or slice] (a CompactFeatures)
+    and np.asarray(features) (dense, e.g. for k-means).
+    """
+
+    def __init__(self, numeric, weight, codes, n_categories, order=None, offsets=None):
+        self.numeric = numeric
+        self.weight = weight
+        self.codes = codes
+        self.n_categories = n_categories
+        # rows of each category (order[offsets[c]:offsets[c + 1]]), for the
+        # full matrix; subsets gather per row instead
+        self.order, self.offsets = order, offsets
+
+    @classmethod
+    def grouped(cls, numeric, weight, codes, n_categories):
+        """
+        CompactFeatures with the per-category row lists filled in.
+        """
+        order, offsets = category_rows(codes, n_categories)
+        return cls(numeric, weight, codes, n_categories, order, offsets)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def shape(self):
+        return len(self.codes), self.numeric.shape[1] + self.n_categories
+
+    @property
+    def dtype(self):
+        return self.numeric.dtype
+
+    @property
+    def nbytes(self):
+        grouped = 0 if self.order is None else self.order.nbytes + self.offsets.nbytes
+        return self.numeric.nbytes + self.weight.nbytes + self.codes.nbytes + grouped
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            row = np.zeros(self.shape[1], dtype=self.dtype)
+            d = self.numeric.shape[1]
+            row[:d] = self.numeric[key]
+            row[d + self.codes[key]] = self.weight[key]
+            return row
+        return CompactFeatures(self.numeric[key], self.weight[key], self.codes[key], self.n_categories)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = np.zeros(self.shape, dtype=dtype or self.dtype)
+        d = self.numeric.shape[1]
+        dense[:, :d] = self.numeric
+        dense[np.arange(len(self)), d + self.codes] = self.weight
+        return dense
+
+    def __matmul__(self, other):
+        """
+        Dense rows @ other, for a vector (scores) or a (n_cols, m) matrix.
+        """
+        other = np.asarray(other, dtype=self.dtype)
+        d = self.numeric.shape[1]
+        out = self.numeric @ other[:d]
+        categories = other[d:]
+        if other.ndim == 1 and self.order is not None:
+            # a catalog row's query has a single category entry: touch only its rows
+            for c in np.flatnonzero(categories):
+                rows = self.order[self.offsets[c]:self.offsets[c + 1]]
+                out[rows] += self.weight[rows] * categories[c]
+        elif other.ndim == 1:
+            out += self.weight * categories[self.codes]
+        else:
+            out += self.weight[:, None] * categories[self.codes]
+        return out
+
+    def similarities(self, queries):
+        """
+        (n_queries, n_rows) dot products with the rows of queries, another
+        CompactFeatures of the same layout.
+        """
+        out = queries.numeric @ self.numeric.T
+        for c in np.unique(queries.codes):
+            query_rows = np.flatnonzero(queries.codes == c)
+            rows = self.order[self.offsets[c]:self.offsets[c + 1]] if self.order is not None \
+                else np.flatnonzero(self.codes == c)
+            out[np.ix_(query_rows, rows)] += np.outer(queries.weight[query_rows], self.weight[rows])
+        return out
+
+
+def category_rows(codes, n_categories):
+    """
+    Rows grouped by category code: (order, offsets) with the rows of
+    category c at order[offsets[c]:offsets[c + 1]].
+    """
+    order = np.argsort(codes, kind='stable').astype(np.int32)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n_categories))])
+    return order, offsets
+
+
+def top_k_indices(scores, k, exclude=None):
+    """
+    Return the indices of the k highest scores, best first.
+    Uses a partial sort (argpartition) so only the k winners get ordered.
+    Ties are broken by the lower index to keep results deterministic.
+    """
+    scores = np.asarray(scores)
+    if exclude is not None:
+        scores = scores.copy()
+        scores[exclude] = -np.inf
+
+    n_valid = len(scores) if exclude is None else len(scores) - np.size(exclude)
+    k = max(0, min(k, n_valid))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def top_k_rows(scores, k, exclude=None, copy=True):
+    """
+    Row-wise version of top_k_indices for a (n_queries, n_tracks) score block.
+    exclude is an optional column index per row (e.g. each query's own row).
+    copy=False lets a freshly computed block be reused as scratch space.
+    Returns (indices, scores), both shaped (n_queries, k).
+    """
+    # work on negated scores so argpartition's ascending order is "best first"
+    neg = np.negative(scores) if copy else np.negative(scores, out=scores)
+    n_queries, n_tracks = neg.shape
+    if exclude is not None:
+        neg[np.arange(n_queries), exclude] = np.inf
+
+    k = max(0, min(k, n_tracks - (0 if exclude is None else 1)))
+    if k == 0:
+        return np.empty((n_queries, 0), dtype=np.intp), np.empty((n_queries, 0), dtype=neg.dtype)
+
+    if k < n_tracks:
+        candidates = np.argpartition(neg, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(n_tracks), (n_queries, 1))
+
+    candidate_neg = np.take_along_axis(neg, candidates, axis=1)
+    order = np.lexsort((candidates, candidate_neg), axis=1)
+    top = np.take_along_axis(candidates, order, axis=1)
+    return top, -np.take_along_axis(candidate_neg, order, axis=1)
+
+
+def iter_blocks(n, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Yield (start, stop) bounds covering range(n) in chunks of block_size.
+    """
+    for start in range(0, n, block_size):
+        yield start, min(start + block_size, n)
+
+
+def top_k_similar(features, queries, k, exclude=None, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Streaming top-k cosine search.
+    features is the L2-normalized (n_tracks, d) matrix, queries a
+    normalized (n_queries, d) matrix (or both CompactFeatures). Similarities
+    are computed one block of queries at a time, so memory stays at
+    block_size x n_tracks.
+    """
+    compact = isinstance(features, CompactFeatures)
+    if not compact:
+        queries = np.atleast_2d(queries)
+    all_idx, all_scores = [], []
+    for start, stop in iter_blocks(len(queries), block_size):
+        block = features.similarities(queries[start:stop]) if compact else queries[start:stop] @ features.T
+        block_exclude = None if exclude is None else np.asarray(exclude)[start:stop]
+        idx, scores = top_k_rows(block, k, exclude=block_exclude, copy=False)
+        all_idx.append(idx)
+        all_scores.append(scores)
+
+    if not all_idx:
+        return np.empty((0, 0), dtype=np.intp), np.empty((0, 0))
+    return np.vstack(all_idx), np.vstack(all_scores)
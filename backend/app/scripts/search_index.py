@@ -0,0 +1,272 @@
+import copy
+from bisect import bisect_left
+import numpy as np
+import pandas as pd
+from .lookup import factorize_strings
+
+# fields covered by /songs/search, best match field first
+SEARCH_FIELDS = ['track_name', 'artists', 'album_name']
+
+# padding so strings shorter than a trigram (and word edges) still get grams
+_PAD = '\x00'
+_MAX_CHAR = chr(0x10FFFF)
+
+# share of query trigrams a title must contain to count as a fuzzy match
+FUZZY_MIN_OVERLAP = 0.4
+
+
+def trigrams(text, pad=True):
+    """
+    Set of character trigrams of text (padded at both ends by default).
+    """
+    if pad:
+        text = f"{_PAD}{text}{_PAD}"
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _FieldIndex:
+    """
+    Trigram inverted index over the distinct lowercased values of one column.
+    Postings hold value ids; each value id maps back to its rows (CSR layout).
+    """
+
+    def __init__(self, column):
+        codes, self.values = factorize_strings(column, lower=True)
+        self.value_ids = {value: vid for vid, value in enumerate(self.values)}
+
+        self.codes = codes
+        self._build_rows()
+
+        # sorted values for prefix queries
+        sorted_ids = np.argsort(np.array(self.values, dtype=str), kind='stable')
+        self.sorted_values = [self.values[i] for i in sorted_ids]
+        self.sorted_ids = sorted_ids
+
+        postings = {}
+        for vid, value in enumerate(self.values):
+            for gram in trigrams(value):
+                postings.setdefault(gram, []).append(vid)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._short_keys = None
+
+    def _build_rows(self):
+        """
+        value id -> rows, stored as one array sliced by offsets
+        """
+        codes = self.codes
+        valid = codes >= 0
+        order = np.argsort(codes, kind='stable')
+        self.row_order = order[valid[order]]
+        counts = np.bincount(codes[valid], minlength=len(self.values))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def updated(self, column, rows):
+        """
+        Copy of the index for a column in which only the given rows changed or
+        were appended. New values get new ids (old ids stay valid, so values no
+        longer used by any row just match nothing); their trigrams are merged
+        into copies of the affected posting lists.
+        """
+        new = copy.copy(self)
+        new.codes = np.full(len(column), -1, dtype=self.codes.dtype)
+        new.codes[:len(self.codes)] = self.codes
+        new.values = list(self.values)
+        new.value_ids = dict(self.value_ids)
+
+        added = []
+        for r in rows:
+            value = column.iat[r]
+            if pd.isna(value):
+                new.codes[r] = -1
+                continue
+            value = str(value).lower()
+            vid = new.value_ids.get(value)
+            if vid is None:
+                vid = new.value_ids[value] = len(new.values)
+                new.values.append(value)
+                added.append(vid)
+            new.codes[r] = vid
+        new._build_rows()
+
+        if added:
+            pairs = list(zip(self.sorted_values, self.sorted_ids.tolist()))
+            pairs += [(new.values[vid], vid) for vid in added]
+            pairs.sort()
+            new.sorted_values = [value for value, _ in pairs]
+            new.sorted_ids = np.array([vid for _, vid in pairs], dtype=self.sorted_ids.dtype)
+
+            grams = {}
+            for vid in added:
+                for gram in trigrams(new.values[vid]):
+                    grams.setdefault(gram, []).append(vid)
+            new.postings = dict(self.postings)
+            for gram, ids in grams.items():
+                # new ids are larger than every old one, so lists stay sorted
+                old = self.postings.get(gram)
+                ids = np.array(ids, dtype=np.int32)
+                new.postings[gram] = ids if old is None else np.concatenate([old, ids])
+            new._short_keys = None
+        return new
+
+    def rows(self, value_ids):
+        """
+        Rows holding any of the given value ids.
+        """
+        if len(value_ids) == 0:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate([self.row_order[self.offsets[v]:self.offsets[v + 1]] for v in value_ids])
+
+    def exact(self, query):
+        vid = self.value_ids.get(query)
+        return np.array([], dtype=np.intp) if vid is None else np.array([vid])
+
+    def prefix(self, query):
+        lo = bisect_left(self.sorted_values, query)
+        hi = bisect_left(self.sorted_values, query + _MAX_CHAR, lo)
+        return self.sorted_ids[lo:hi]
+
+    def contains(self, query):
+        """
+        Value ids containing query as a substring.
+        Intersects the trigram posting lists (shortest first) and verifies the
+        survivors; queries shorter than a trigram union the grams containing them.
+        """
+        if len(query) < 3:
+            lists = [self.postings[gram] for gram in self._grams_containing(query)]
+            return np.unique(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int32)
+
+        lists = []
+        for gram in trigrams(query, pad=False):
+            ids = self.postings.get(gram)
+            if ids is None:
+                return np.empty(0, dtype=np.int32)
+            lists.append(ids)
+
+        lists.sort(key=len)
+        candidates = lists[0]
+        for ids in lists[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, ids, assume_unique=True)
+
+        if len(query) == 3:
+            return candidates
+        return np.array([v for v in candidates if query in self.values[v]], dtype=np.int32)
+
+    def _grams_containing(self, query):
+        """
+        Trigrams containing a 1- or 2-character query, by bisect instead of a
+        scan of every posting. Values are padded, so each occurrence of a
+        2-character query starts a trigram and each single character is the
+        middle of one: the grams sorted as is, and sorted by their last two
+        characters, hold them as prefix ranges.
+        """
+        if self._short_keys is None:
+            grams = sorted(self.postings)
+            self._short_keys = grams, sorted(gram[1:] + gram[0] for gram in grams)
+        grams, rotated = self._short_keys
+        keys = grams if len(query) == 2 else rotated
+        lo = bisect_left(keys, query)
+        hi = bisect_left(keys, query + _MAX_CHAR, lo)
+        return keys[lo:hi] if len(query) == 2 else [key[-1] + key[:-1] for key in keys[lo:hi]]
+
+    def fuzzy(self, query, min_overlap=FUZZY_MIN_OVERLAP):
+        """
+        Value ids sharing at least min_overlap of the query's trigrams,
+        best overlap first (tolerates typos that exact substring search misses).
+        """
+        grams = trigrams(query)
+        lists = [self.postings[g] for g in grams if g in self.postings]
+        if not lists:
+            return np.empty(0, dtype=np.int32)
+
+        hits = np.bincount(np.concatenate(lists), minlength=len(self.values))
+        needed = max(1, int(np.ceil(min_overlap * len(grams))))
+        candidates = np.flatnonzero(hits >= needed)
+        return candidates[np.argsort(-hits[candidates], kind='stable')]
+
+
+class SearchIndex:
+    """
+    Ranked substring search over track_name, artists and album_name.
+
+    Results are produced in tiers and each tier is ordered by popularity:
+      1. exact title   2. title prefix   3. word in title starts with query
+      4. title substring   5. artist substring   6. album substring
+      7. fuzzy title match (only when fuzzy=True, ordered by trigram overlap)
+    Tiers are only computed until the requested page is filled.
+    """
+
+    def __init__(self, df, fields=SEARCH_FIELDS):
+        self.fields = {field: _FieldIndex(df[field]) for field in fields if field in df.columns}
+        if 'popularity' in df.columns:
+            self.popularity = pd.to_numeric(df['popularity'], errors='coerce').fillna(0).to_numpy()
+        else:
+            self.popularity = np.zeros(len(df))
+
+    def updated(self, df, rows):
+        """
+        Copy of the index for df, a version of the indexed table in which only
+        the given rows changed or were appended.
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.intp))
+        new = copy.copy(self)
+        new.fields = {field: index.updated(df[field], rows) for field, index in self.fields.items()}
+        if 'popularity' in df.columns:
+            new.popularity = pd.to_numeric(df['popularity'], errors='coerce').fillna(0).to_numpy()
+        else:
+            new.popularity = np.zeros(len(df))
+        return new
+
+    def _tiers(self, query, fuzzy):
+        """
+        Yield (rows, presorted) per tier; presorted tiers keep their own order.
+        """
+        name = self.fields.get('track_name')
+        if name is not None:
+            yield name.rows(name.exact(query)), False
+            yield name.rows(name.prefix(query)), False
+
+            word_start, substring = [], []
+            for vid in name.contains(query):
+                value = name.values[vid]
+                if value.startswith(query):
+                    continue
+                (word_start if f" {query}" in value else substring).append(vid)
+            yield name.rows(word_start), False
+            yield name.rows(substring), False
+
+        for field in ('artists', 'album_name'):
+            index = self.fields.get(field)
+            if index is not None:
+                yield index.rows(index.contains(query)), False
+
+        if fuzzy and name is not None:
+            yield name.rows(name.fuzzy(query)), True
+
+    def search(self, query, offset=0, limit=20, fuzzy=False):
+        """
+        Return (rows, has_more) for one page of ranked matches.
+        """
+        query = query.strip().lower()
+        needed = offset + limit
+        if not query or limit <= 0:
+            return np.empty(0, dtype=np.intp), False
+
+        ranked = []
+        for rows, presorted in self._tiers(query, fuzzy):
+            # every earlier tier was taken whole (or the loop stopped), so
+            # rows already ranked are the ones to skip
+            if ranked:
+                rows = rows[~np.isin(rows, ranked)]
+            if len(rows) == 0:
+                continue
+            if not presorted:
+                rows = rows[np.lexsort((rows, -self.popularity[rows]))]
+            ranked.extend(rows[:needed + 1 - len(ranked)].tolist())
+
+            # stop once the page (plus one row to tell if there is more) is filled
+            if len(ranked) > needed:
+                break
+
+        return np.array(ranked[offset:needed], dtype=np.intp), len(ranked) > needed
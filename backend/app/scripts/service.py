@@ -0,0 +1,649 @@
+"""
+In-process service layer behind the /songs JSON routes and the HTML pages.
+
+Every function returns (payload, status): a JSON-serializable dict and the
+HTTP status code. The blueprints only parse their inputs and render the
+payload (jsonify in scripts/songs.py, templates in ui.py), so both see the
+same data without going through HTTP.
+"""
+import threading
+import numpy as np
+from .catalog import get_catalog
+from .recommender import get_recommendation_rows, get_reranked_rows, get_loaded_mask, get_title_for_id, \
+    get_ann_recall
+from .ann import ENGINES
+from .feature_store import FeatureStore, SCALING_MODES, FEATURE_COLS
+from .search_index import SearchIndex
+from .result_cache import ResultCache
+from .serving import MicroBatcher, Overloaded
+from .session import TasteSession, MAX_SESSION_TRACKS
+from .diversity import Reranking
+from .evaluation import MAX_EVAL_K
+from .responses import Records, record_encoder
+from .metrics import span
+from .startup import startup
+
+MAX_SEARCH_LIMIT = 100
+
+
+class ServingState:
+    """
+    The catalog and the structures the routes build on it, as one object.
+
+    Requests read the module-level `state` once and use only that snapshot;
+    scripts/ingest.py builds a new ServingState and swaps it in with a single
+    assignment, so a request never mixes two catalog versions. During
+    startup feature_store and search_index are None until their stage is
+    ready (routes check with startup.unavailable first).
+    """
+
+    def __init__(self, catalog, feature_store=None, search_index=None):
+        # shared catalog (also used by the recommender)
+        self.catalog = catalog
+        self.df = catalog.df
+        # scaled features for /recommend_full, built once instead of per request
+        self.feature_store = feature_store
+        # trigram index for /search
+        self.search_index = search_index
+
+    @property
+    def lookup(self):
+        # hash/sorted indexes for track_id / title / name queries (the 'lookup' startup stage)
+        return self.catalog.lookup
+
+
+# current ServingState (None until the catalog is loaded, see scripts/startup.py)
+state = None
+_state_lock = threading.Lock()
+
+
+def _publish_built(**parts):
+    """
+    Swap in the current state with a structure built by a startup stage.
+    """
+    global state
+    with _state_lock:
+        current = state
+        state = ServingState(current.catalog, parts.get('feature_store', current.feature_store),
+                             parts.get('search_index', current.search_index))
+
+
+def load_catalog():
+    """
+    'catalog' startup stage: load the shared catalog and publish it.
+    """
+    global state
+    catalog = get_catalog()
+    if catalog is None:
+        raise RuntimeError("Could not load the tracks data")
+    with _state_lock:
+        state = ServingState(catalog)
+
+
+def build_lookup():
+    state.catalog.lookup
+
+
+def build_feature_store():
+    _publish_built(feature_store=FeatureStore(state.catalog))
+
+
+def build_search_index():
+    _publish_built(search_index=SearchIndex(state.df))
+
+
+# finished /recommend and /recommend_full responses, dropped whenever the catalog changes
+result_cache = ResultCache(version=lambda: state.catalog.version if state is not None else None)
+
+# micro-batching scoring pool; None = score inline on the request thread
+# (the default for the dev server, enable_batching() turns it on)
+batcher = None
+
+# /recommend_batch limits and aggregation modes (k, like /session's, is
+# capped at the /evaluate_model limit MAX_EVAL_K)
+MAX_BATCH_SEEDS = 1000
+BATCH_AGGREGATES = ('per_seed', 'centroid')
+
+# columns returned for every recommended track
+RECOMMENDATION_COLS = ["track_id", "track_name", "artists", "track_genre", "track_search"]
+
+# default fields of /recommend_full and /recommend_batch records (/recommend leaves out similarity);
+# 'fields' picks any catalog columns plus 'similarity', or 'all'
+RECOMMENDATION_FIELDS = RECOMMENDATION_COLS + ["similarity"]
+
+# fields of every /search result (plus in_sample)
+SEARCH_COLS = ["track_id", "track_name", "artists", "album_name"]
+
+
+def resolve_target_row(track_id=None, song=None, lookup=None):
+    """
+    Catalog row of a seed given by track_id or song title, or None.
+    Titles prefer an exact 'track_search' match, then the first track_name prefix match.
+    lookup defaults to the current state's.
+    """
+    if lookup is None:
+        lookup = state.lookup if state is not None else None
+    if lookup is None:
+        return None
+    if track_id:
+        rows = lookup.find(track_id=track_id)
+    else:
+        # prefer exact match on track_search = "Title - Artist"
+        rows = lookup.find(track_search=song)
+        if len(rows) == 0:
+            # fallback: try track_name ilike (first match)
+            rows = lookup.find(track_name=song)
+    return int(rows[0]) if len(rows) else None
+
+
+def enable_batching(**options):
+    """
+    Route scoring through a bounded MicroBatcher pool (see scripts/serving.py).
+    Requests over its queue limit raise Overloaded.
+    """
+    global batcher
+    if batcher is None:
+        batcher = MicroBatcher(**options)
+    return batcher
+
+
+def _score_full(feature_store, row, k, same_genre, scaling, engine, nprobe, genres=None):
+    """
+    feature_store.recommend, merged with concurrent requests when batching is on.
+    """
+    if batcher is None:
+        return feature_store.recommend(row, k=k, same_genre=same_genre, scaling=scaling, engine=engine,
+                                       nprobe=nprobe, genres=genres)
+    found = feature_store.precomputed(row, k, same_genre, scaling, engine) if genres is None else None
+    if found is not None:
+        # a table lookup is cheaper than a trip through the scoring pool
+        return found
+
+    scaling = scaling or feature_store.scaling
+    if scaling == 'exact' or genres is not None or feature_store.uses_ann(same_genre, scaling, engine):
+        # per-seed scaler / genre list / ANN probes: nothing to share between requests
+        return batcher.run(feature_store.recommend, row, k=k, same_genre=same_genre, scaling=scaling,
+                           engine=engine, nprobe=nprobe, genres=genres)
+    # only requests against the same store (catalog version) are merged
+    return batcher.submit(('recommend_full', feature_store, same_genre, scaling), (row, k),
+                          lambda items: _score_full_batch(feature_store, items, same_genre, scaling))
+
+
+def _score_full_batch(feature_store, items, same_genre, scaling):
+    """
+    One recommend_batch call for a list of (row, k) requests.
+    """
+    max_k = max(k for _, k in items)
+    results = feature_store.recommend_batch([row for row, _ in items], k=max_k, same_genre=same_genre,
+                                            scaling=scaling)
+    return [(rows[:k], sims[:k]) for (rows, sims), (_, k) in zip(results, items)]
+
+
+def recommend(song=None, track_id=None, engine='exact', nprobe=None, report_recall=False, fields=None,
+              diversity=0.0, max_per_artist=None, max_per_album=None):
+    """
+    Recommendations from the in-memory recommender, by title or track_id.
+    diversity / max_per_artist / max_per_album rerank a larger candidate
+    pool (see scripts/diversity.py).
+    """
+    if engine not in ENGINES:
+        return {"error": f"'engine' must be one of {list(ENGINES)}"}, 400
+    try:
+        reranking = Reranking(diversity, max_per_artist, max_per_album)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    unavailable = startup.unavailable('lookup', 'recommender')
+    if unavailable:
+        return unavailable
+    current = state
+    fields, error = record_fields(fields, current.df, default=RECOMMENDATION_COLS)
+    if error:
+        return {"error": error}, 400
+
+    # If track_id is provided and no title, resolve the title from the recommender catalog
+    if track_id and not song:
+        song = get_title_for_id(track_id)
+        if not song:
+            return {"error": f"No song found for track_id={track_id}"}, 404
+
+    if not song:
+        return {"error": "Provide either 'song' (title) or 'track_id'"}, 400
+
+    cache_key = ('recommend', song, engine, nprobe, report_recall, tuple(fields), reranking.key())
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached, 200
+
+    # catalog rows from the recommender (no changes to their logic)
+    score, args = (get_reranked_rows, (song, reranking)) if reranking.active else (get_recommendation_rows, (song,))
+    with span('service.score'):
+        if batcher is None:
+            result = score(*args, engine=engine, nprobe=nprobe)
+        else:
+            result = batcher.run(score, *args, engine=engine, nprobe=nprobe)
+
+    if isinstance(result, dict) and "error" in result:
+        return result, 404
+
+    # track_id and the other fields come straight from the recommended rows,
+    # in one lookup against the catalog the recommender scored
+    catalog, rows, sims = result[:3]
+    with span('service.enrich'):
+        enriched = recommendation_records(rows, sims, df=catalog.df, fields=fields)
+
+    response = {
+        "input": song,
+        "recommendations": enriched
+    }
+    if reranking.active:
+        response["reranking"] = result[3]
+    if report_recall and engine != 'exact':
+        response["engine"] = engine
+        response["recall"] = get_ann_recall(song, k=len(enriched), engine=engine, nprobe=nprobe)
+
+    result_cache.put(cache_key, response)
+    return response, 200
+
+
+def search(query, offset=0, limit=20, fuzzy=False):
+    """
+    Ranked search over track name, artists and album (one page of results).
+    """
+    if not query:
+        return {"error": "A search query 'q' is required."}, 400
+
+    unavailable = startup.unavailable('search_index')
+    if unavailable:
+        return unavailable
+    offset = max(offset, 0)
+    limit = min(max(limit, 0), MAX_SEARCH_LIMIT)
+    current = state
+    try:
+        # search in the full dataset through the trigram index
+        if current is not None:
+            with span('search.index'):
+                rows, has_more = current.search_index.search(query, offset=offset, limit=limit, fuzzy=fuzzy)
+        else:
+            rows = []
+            has_more = False
+
+        loaded = get_loaded_mask()
+        results = []
+
+        with span('search.records'):
+            if current is not None:
+                # in_sample: the track is loaded in the recommender (null until its startup stage is ready)
+                rows = np.asarray(rows, dtype=np.intp)
+                if loaded is None:
+                    in_sample = np.full(len(rows), None, dtype=object)
+                else:
+                    in_sample = np.zeros(len(rows), dtype=bool)
+                    known = rows < len(loaded)
+                    in_sample[known] = loaded[rows[known]]
+                results = Records(current.df, rows, SEARCH_COLS + ["in_sample"], {"in_sample": in_sample})
+
+        return {
+            "message": f"Found {len(results)} results for '{query}'",
+            "results": results,
+            "offset": offset,
+            "limit": limit,
+            "has_more": has_more
+        }, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def song_details(track_id):
+    """
+    Every column of the first track with this track_id.
+    """
+    unavailable = startup.unavailable('lookup')
+    if unavailable:
+        return unavailable
+    current = state
+    try:
+        rows = current.lookup.find(track_id=track_id) if current is not None and len(current.df) else []
+        if len(rows) == 0:
+            return {"error": f"No song found for track_id={track_id}"}, 404
+
+        return Records(current.df, rows[:1], list(current.df.columns))[0], 200
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+def recommend_full(track_id=None, song=None, k=5, same_genre=True, scaling=None, engine='exact', nprobe=None,
+                   report_recall=False, fields=None, genres=None, nearby_genres=None, diversity=0.0,
+                   max_per_artist=None, max_per_album=None):
+    """
+    Full-dataset recommendations from the feature store (see /songs/recommend_full).
+    """
+    if not (song or track_id):
+        return {"error": "Provide either 'song' or 'track_id'"}, 400
+    try:
+        reranking = Reranking(diversity, max_per_artist, max_per_album)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    unavailable = startup.unavailable('lookup', 'feature_store')
+    if unavailable:
+        return unavailable
+    current = state
+    feature_store = current.feature_store
+
+    if scaling and scaling not in SCALING_MODES:
+        return {"error": f"'scaling' must be one of {list(SCALING_MODES)}"}, 400
+
+    if engine not in ENGINES:
+        return {"error": f"'engine' must be one of {list(ENGINES)}"}, 400
+
+    fields, error = record_fields(fields, current.df)
+    if error:
+        return {"error": error}, 400
+
+    genres, error = _genre_list(genres, current.catalog)
+    if error:
+        return {"error": error}, 400
+    if genres is not None and nearby_genres is not None:
+        return {"error": "Pass either 'genres' or 'nearby_genres', not both"}, 400
+    if nearby_genres is not None and (not isinstance(nearby_genres, int) or nearby_genres < 0):
+        return {"error": "'nearby_genres' must be a non-negative integer"}, 400
+
+    # resolve target row from DB
+    try:
+        with span('service.resolve'):
+            target_row = resolve_target_row(track_id=track_id, song=song, lookup=current.lookup)
+        if target_row is None:
+            return {"error": "Target song not found in dataset."}, 404
+
+        target = current.df.iloc[target_row]
+    except Exception as e:
+        return {"error": f"Lookup failed: {e}"}, 500
+
+    if nearby_genres is not None:
+        # the target's genre and the genres with the most similar centroids
+        genre = current.catalog.genre_of(target_row)
+        if genre is None:
+            return {"error": "Target song has no genre; 'nearby_genres' needs one"}, 400
+        genres = feature_store.nearby_genres(genre, nearby_genres)
+
+    # keyed on the resolved track, so title and track_id requests share entries
+    cache_key = ('recommend_full', current.catalog.track_ids[target_row], k, same_genre, scaling, engine, nprobe,
+                 report_recall, tuple(fields), tuple(genres) if genres is not None else None, reranking.key())
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached, 200
+
+    try:
+        # score against the precomputed feature store (genre slice or whole catalog)
+        # (includes the wait for the scoring pool when batching is on)
+        with span('service.score'):
+            rows, sims = _score_full(feature_store, target_row, reranking.pool_size(k), same_genre, scaling, engine,
+                                     nprobe, genres)
+
+        report = None
+        if reranking.active and len(rows):
+            # pick k of the pool for diversity, on the vectors it was scored with
+            with span('service.rerank'):
+                features, positions = feature_store.scored_features(rows, same_genre and genres is None, scaling)
+                rows, sims, report = reranking.apply(current.catalog, target_row, rows, sims, features, positions,
+                                                     k)
+
+        if len(rows) == 0:
+            response = {"input": target.get("track_search") or target.get("track_name"), "recommendations": []}
+            result_cache.put(cache_key, response)
+            return response, 200
+
+        # top-k similar songs
+        with span('service.records'):
+            recs = recommendation_records(rows, sims, df=current.df, fields=fields)
+
+        response = {
+            "input": target.get("track_search") or target.get("track_name"),
+            "same_genre": same_genre,
+            "k": k,
+            "recommendations": recs
+        }
+        if genres is not None:
+            response["genres"] = genres
+        if report is not None:
+            response["reranking"] = report
+        if report_recall and feature_store.uses_ann(same_genre, scaling, engine, genres):
+            response["engine"] = engine
+            response["recall"] = feature_store.recall(target_row, k=k, engine=engine, nprobe=nprobe)
+
+        result_cache.put(cache_key, response)
+        return response, 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        return {"error": f"Similarity calculation failed: {e}"}, 500
+
+
+def _valid_k(k):
+    """
+    k from a JSON body: an int (not a bool) in 0..MAX_EVAL_K.
+    """
+    return isinstance(k, int) and not isinstance(k, bool) and 0 <= k <= MAX_EVAL_K
+
+
+def recommend_batch(track_ids=None, songs=None, k=5, same_genre=True, scaling=None, aggregate='per_seed',
+                    fields=None):
+    """
+    Recommendations for many seeds at once (see /songs/recommend_batch).
+    """
+    track_ids = track_ids or []
+    songs = songs or []
+
+    if not isinstance(track_ids, list) or not isinstance(songs, list):
+        return {"error": "'track_ids' and 'songs' must be lists"}, 400
+    if not (track_ids or songs):
+        return {"error": "Provide 'track_ids' and/or 'songs'"}, 400
+    if len(track_ids) + len(songs) > MAX_BATCH_SEEDS:
+        return {"error": f"At most {MAX_BATCH_SEEDS} seeds per request"}, 400
+    if not _valid_k(k):
+        return {"error": f"'k' must be an integer between 0 and {MAX_EVAL_K}"}, 400
+    if isinstance(same_genre, str):
+        same_genre = same_genre.lower() == 'true'
+    if scaling and scaling not in SCALING_MODES:
+        return {"error": f"'scaling' must be one of {list(SCALING_MODES)}"}, 400
+    if aggregate not in BATCH_AGGREGATES:
+        return {"error": f"'aggregate' must be one of {list(BATCH_AGGREGATES)}"}, 400
+
+    unavailable = startup.unavailable('lookup', 'feature_store')
+    if unavailable:
+        return unavailable
+    current = state
+    catalog, feature_store = current.catalog, current.feature_store
+    fields, error = record_fields(fields, current.df)
+    if error:
+        return {"error": error}, 400
+
+    # resolve every seed through the lookup indexes
+    seeds, not_found = [], []
+    for seed, kwargs in [(t, {"track_id": str(t)}) for t in track_ids] + [(s, {"song": str(s)}) for s in songs]:
+        row = resolve_target_row(**kwargs, lookup=current.lookup)
+        if row is None:
+            not_found.append(seed)
+        else:
+            seeds.append((seed, row))
+
+    response = {"same_genre": same_genre, "k": k, "aggregate": aggregate, "not_found": not_found}
+    if not seeds:
+        response["results" if aggregate == 'per_seed' else "recommendations"] = []
+        return response, 200
+
+    try:
+        seed_rows = [row for _, row in seeds]
+        if aggregate == 'centroid':
+            rows, sims = feature_store.recommend_centroid(seed_rows, k=k, same_genre=same_genre, scaling=scaling)
+            response["inputs"] = [catalog.title_of(row) for row in seed_rows]
+            response["recommendations"] = recommendation_records(rows, sims, df=current.df, fields=fields)
+            return response, 200
+
+        results = feature_store.recommend_batch(seed_rows, k=k, same_genre=same_genre, scaling=scaling)
+
+        # fetch metadata for every recommended row in one go, then split per seed
+        all_rows = np.concatenate([rows for rows, _ in results]) if results else np.empty(0, dtype=np.intp)
+        all_sims = np.concatenate([sims for _, sims in results]) if results else np.empty(0)
+        records = recommendation_records(all_rows, all_sims, df=current.df, fields=fields)
+
+        response["results"] = []
+        offset = 0
+        for (seed, row), (rows, _) in zip(seeds, results):
+            response["results"].append({
+                "seed": seed,
+                "input": catalog.title_of(row),
+                "recommendations": records[offset:offset + len(rows)]
+            })
+            offset += len(rows)
+        return response, 200
+    except Exception as e:
+        return {"error": f"Similarity calculation failed: {e}"}, 500
+
+
+def session_recommend(session=None, add=None, remove=None, played=None, k=10, same_genre=False, genres=None,
+                      fields=None, decay=None):
+    """
+    Update a listening session and recommend for its taste vector (see
+    /songs/session and scripts/session.py). remove is applied before add;
+    the session's tracks and played tracks are never recommended.
+    """
+    add, remove, played = add or [], remove or [], played or []
+    for name, ids in (('add', add), ('remove', remove), ('played', played)):
+        if not isinstance(ids, list) or not all(isinstance(i, (str, int)) and not isinstance(i, bool)
+                                                for i in ids):
+            return {"error": f"'{name}' must be a list of track_ids"}, 400
+    if not _valid_k(k):
+        return {"error": f"'k' must be an integer between 0 and {MAX_EVAL_K}"}, 400
+    if isinstance(same_genre, str):
+        same_genre = same_genre.lower() == 'true'
+    if decay is not None and (not isinstance(decay, (int, float)) or isinstance(decay, bool) or
+                              not 0 < decay <= 1):
+        return {"error": "'decay' must be a number in (0, 1]"}, 400
+
+    unavailable = startup.unavailable('lookup', 'feature_store')
+    if unavailable:
+        return unavailable
+    current = state
+    catalog, feature_store = current.catalog, current.feature_store
+    fields, error = record_fields(fields, current.df)
+    if error:
+        return {"error": error}, 400
+    genres, error = _genre_list(genres, catalog)
+    if error:
+        return {"error": error}, 400
+    if genres is not None and same_genre:
+        return {"error": "Pass either 'genres' or 'same_genre', not both"}, 400
+
+    try:
+        taste = TasteSession.from_dict(session, len(FEATURE_COLS))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if session is None and decay is not None:
+        taste.decay = float(decay)
+
+    # O(d) per added or removed track
+    not_found = []
+    with span('service.resolve'):
+        for track_id, update in [(i, taste.remove) for i in remove] + [(i, taste.add) for i in add]:
+            row = catalog.row_for_id(str(track_id))
+            if row is None:
+                not_found.append(track_id)
+            else:
+                update(str(track_id), feature_store.vector_of(row), catalog.genre_of(row))
+        for track_id in played:
+            taste.mark_played(str(track_id))
+    if len(taste) + len(taste.played) > MAX_SESSION_TRACKS:
+        return {"error": f"At most {MAX_SESSION_TRACKS} tracks per session"}, 400
+
+    response = {"session": taste.to_dict(), "size": len(taste), "k": k, "same_genre": same_genre,
+                "not_found": not_found}
+    if genres is not None:
+        response["genres"] = genres
+    try:
+        with span('service.score'):
+            exclude_rows = catalog.rows_for_ids(list(taste.tracks) + taste.played)
+            candidates = genres if genres is not None else (list(taste.genres) if same_genre else None)
+            if batcher is not None:
+                rows, sims = batcher.run(feature_store.recommend_vector, taste.taste(), k=k,
+                                         exclude_rows=exclude_rows, genres=candidates)
+            else:
+                rows, sims = feature_store.recommend_vector(taste.taste(), k=k, exclude_rows=exclude_rows,
+                                                            genres=candidates)
+        with span('service.records'):
+            response["recommendations"] = recommendation_records(rows, sims, df=current.df, fields=fields)
+        return response, 200
+    except Overloaded:
+        raise
+    except Exception as e:
+        return {"error": f"Similarity calculation failed: {e}"}, 500
+
+
+def _genre_list(genres, catalog):
+    """
+    Validated list of genre names from a 'genres' option (a list or a
+    comma-separated string), or None. Returns (genres, error message or None).
+    """
+    if genres is None or genres == '':
+        return None, None
+    if isinstance(genres, str):
+        genres = [genre.strip() for genre in genres.split(',') if genre.strip()]
+    if not isinstance(genres, list) or not genres or not all(isinstance(genre, str) for genre in genres):
+        return None, "'genres' must be a non-empty list of genre names"
+    known = set(catalog.genre_names)
+    unknown = [genre for genre in genres if genre not in known]
+    if unknown:
+        return None, f"Unknown genres {unknown}"
+    return list(dict.fromkeys(genres)), None
+
+
+def cache_stats():
+    current = state
+    stats = result_cache.info()
+    if current is not None:
+        # encoded record fragments of the current catalog (see scripts/responses.py)
+        stats["record_fragments"] = record_encoder(current.df).info()
+    return stats, 200
+
+
+def serving_stats():
+    if batcher is None:
+        return {"batching": False}, 200
+    return {"batching": True, **batcher.info()}, 200
+
+
+def record_fields(fields, df, default=RECOMMENDATION_FIELDS):
+    """
+    Validated list of record fields from a 'fields' option: None for the
+    default, 'all', or field names (a list or comma-separated string) among
+    df's columns and 'similarity'. Returns (fields, error message or None).
+    """
+    available = list(df.columns) + ["similarity"]
+    if fields is None or fields == '':
+        return list(default), None
+    if fields == 'all':
+        return available, None
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not isinstance(fields, list) or not fields or not all(isinstance(field, str) for field in fields):
+        return None, "'fields' must be 'all' or a non-empty list of field names"
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        return None, f"Unknown fields {unknown}; available: {available}"
+    # keep the first occurrence of each field
+    return list(dict.fromkeys(fields)), None
+
+
+def recommendation_records(rows, sims, df=None, fields=None):
+    """
+    Recommendation records (fields, default RECOMMENDATION_FIELDS) for catalog
+    rows (of df, default the current catalog's table), read straight from
+    the column arrays (see scripts/responses.py).
+    """
+    if len(rows) == 0:
+        return []
+    df = df if df is not None else state.df
+    fields = fields or RECOMMENDATION_FIELDS
+    values = {"similarity": np.asarray(sims, dtype=float)} if "similarity" in fields else None
+    return Records(df, rows, fields, values)
@@ -0,0 +1,153 @@
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# defaults for the batched serving mode (see wsgi.py)
+DEFAULT_WORKERS = int(os.environ.get('SCORING_WORKERS', os.cpu_count() or 1))
+DEFAULT_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', 2))
+DEFAULT_MAX_BATCH = int(os.environ.get('BATCH_MAX_SIZE', 64))
+DEFAULT_MAX_QUEUE = int(os.environ.get('SCORING_MAX_QUEUE', 512))
+DEFAULT_RETRY_AFTER = int(os.environ.get('SCORING_RETRY_AFTER', 1))
+
+
+class Overloaded(Exception):
+    """
+    Raised instead of queueing when too much scoring work is outstanding.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Server is busy, retry shortly")
+        self.retry_after = retry_after
+
+
+class _Group:
+    def __init__(self, run_batch, deadline):
+        self.run_batch = run_batch
+        self.deadline = deadline
+        self.items = []
+        self.futures = []
+
+
+class MicroBatcher:
+    """
+    Bounded thread pool for scoring work with request micro-batching.
+
+    submit(key, item, run_batch) queues one item and blocks until its result
+    is ready. Items with the same key that arrive within window_ms of the
+    first one are handed to run_batch together (one matrix product instead
+    of one per request); run_batch(items) must return one result per item.
+    Batches run on a pool of `workers` threads, which overlap because NumPy
+    releases the GIL in its kernels.
+
+    At most max_queue items may be outstanding (queued or running); beyond
+    that submit raises Overloaded, which the routes turn into a 503 with a
+    Retry-After header.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH,
+                 max_queue=DEFAULT_MAX_QUEUE, retry_after=DEFAULT_RETRY_AFTER):
+        self.workers = workers
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+        self._unique = itertools.count()
+        self._start()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        """
+        (Re)create the pool and dispatcher thread. Threads don't survive fork,
+        so a batcher created in a preloading parent restarts in each worker.
+        """
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scoring')
+        self._groups = {}
+        self._outstanding = 0
+        self._cond = threading.Condition()
+        self.stats = dict.fromkeys(['requests', 'batches', 'rejected', 'max_batch_seen'], 0)
+
+        self._dispatcher = threading.Thread(target=self._dispatch, name='scoring-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, key, item, run_batch, timeout=None):
+        """
+        Result of run_batch for item, possibly computed together with other
+        items queued under the same key.
+        """
+        future = Future()
+        with self._cond:
+            if self._outstanding >= self.max_queue:
+                self.stats['rejected'] += 1
+                raise Overloaded(self.retry_after)
+            self._outstanding += 1
+            self.stats['requests'] += 1
+
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = _Group(run_batch, time.monotonic() + self.window)
+            group.items.append(item)
+            group.futures.append(future)
+            self._cond.notify()
+        return future.result(timeout)
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Run one unbatchable call on the pool (still bounded by max_queue).
+        """
+        key = ('unbatched', next(self._unique))
+        return self.submit(key, None, lambda items: [fn(*args, **kwargs)])
+
+    def info(self):
+        with self._cond:
+            batches = self.stats['batches']
+            return {
+                **self.stats,
+                "average_batch_size": round((self.stats['requests'] - self._outstanding) / batches, 2)
+                                      if batches else None,
+                "outstanding": self._outstanding,
+                "workers": self.workers,
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "max_queue": self.max_queue
+            }
+
+    def _dispatch(self):
+        """
+        Hand every group to the pool once it is full or its window closed.
+        """
+        while True:
+            with self._cond:
+                while not self._groups:
+                    self._cond.wait()
+                now = time.monotonic()
+                ready = [key for key, group in self._groups.items()
+                         if group.deadline <= now or len(group.items) >= self.max_batch
+                         or key[0] == 'unbatched']
+                if not ready:
+                    self._cond.wait(min(group.deadline for group in self._groups.values()) - now)
+                    continue
+                batches = [self._groups.pop(key) for key in ready]
+
+            for group in batches:
+                # split oversized groups so no batch exceeds max_batch
+                for start in range(0, len(group.items), self.max_batch):
+                    self._pool.submit(self._run, group.run_batch, group.items[start:start + self.max_batch],
+                                      group.futures[start:start + self.max_batch])
+
+    def _run(self, run_batch, items, futures):
+        try:
+            results = run_batch(items)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        finally:
+            with self._cond:
+                self._outstanding -= len(items)
+                self.stats['batches'] += 1
+                self.stats['max_batch_seen'] = max(self.stats['max_batch_seen'], len(items))
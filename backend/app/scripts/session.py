@@ -0,0 +1,129 @@
+"""
+Listening sessions behind POST /songs/session.
+
+A session holds a taste vector: the exponentially decayed mean of the
+globally scaled feature vectors (see FeatureStore) of the tracks added so
+far, newest weighted 1, the one before decay, then decay^2, ... It is kept
+as the decayed sum and its total weight, so adding a track is
+    vector = decay * vector + v,  weight = decay * weight + 1
+and removing the track added at step t is
+    vector -= decay^(step - t) * v,  weight -= decay^(step - t)
+both O(d) whatever the playlist length. Played tracks are only excluded.
+
+Worker processes don't share memory, so the session isn't stored on the
+server: every response returns its state and the client sends it back with
+the next update (to_dict / from_dict).
+"""
+import os
+import numpy as np
+
+DEFAULT_DECAY = float(os.environ.get('SESSION_DECAY', 0.9))
+# tracks a session may hold (added plus played)
+MAX_SESSION_TRACKS = 5000
+
+
+class TasteSession:
+    """
+    Taste vector of a session plus the tracks behind it:
+      - tracks: track_id -> step it was (last) added at
+      - genres: genre -> number of added tracks in it (for same_genre)
+      - played: track_ids excluded from recommendations without being added
+    """
+
+    def __init__(self, decay=DEFAULT_DECAY, vector=None, weight=0.0, step=0, tracks=None, genres=None,
+                 played=None):
+        self.decay = decay
+        self.vector = np.zeros(0) if vector is None else np.asarray(vector, dtype=np.float64)
+        self.weight = weight
+        self.step = step
+        self.tracks = dict(tracks or {})
+        self.genres = dict(genres or {})
+        self.played = list(played or [])
+        self._played = set(self.played)
+
+    @classmethod
+    def from_dict(cls, data, dim):
+        """
+        Session from the state a client sent back. Raises ValueError if it
+        isn't one (or was made for features of another width).
+        """
+        if data is None:
+            return cls(vector=np.zeros(dim))
+        if not isinstance(data, dict):
+            raise ValueError("'session' must be an object returned by this endpoint")
+        try:
+            session = cls(decay=float(data['decay']), vector=data['vector'], weight=float(data['weight']),
+                          step=int(data['step']), tracks=data['tracks'], genres=data.get('genres'),
+                          played=data.get('played'))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("'session' must be an object returned by this endpoint")
+        if session.vector.shape != (dim,) or not np.all(np.isfinite(session.vector)) or \
+                not 0 < session.decay <= 1 or not all(_is_int(t) for t in session.tracks.values()) or \
+                not all(isinstance(g, str) and _is_int(n) and n > 0 for g, n in session.genres.items()) or \
+                not all(isinstance(t, str) for t in session.played):
+            raise ValueError("'session' does not match the current feature space")
+        return session
+
+    def to_dict(self):
+        return {
+            "decay": self.decay,
+            "vector": [float(x) for x in self.vector],
+            "weight": float(self.weight),
+            "step": self.step,
+            "tracks": self.tracks,
+            "genres": self.genres,
+            "played": self.played
+        }
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def add(self, track_id, vector, genre):
+        """
+        Make track_id the newest track of the session (moving it there if
+        it was added before).
+        """
+        if track_id in self.tracks:
+            self.remove(track_id, vector, genre)
+        self.step += 1
+        self.vector = self.decay * self.vector + vector
+        self.weight = self.decay * self.weight + 1.0
+        self.tracks[track_id] = self.step
+        if genre is not None:
+            self.genres[genre] = self.genres.get(genre, 0) + 1
+
+    def remove(self, track_id, vector, genre):
+        """
+        Take track_id's contribution out again (vector is its current
+        features; no-op for tracks not in the session).
+        """
+        added = self.tracks.pop(track_id, None)
+        if added is None:
+            return
+        weight = self.decay ** (self.step - added)
+        self.vector = self.vector - weight * vector
+        self.weight -= weight
+        if not self.tracks:
+            # nothing left: drop the rounding residue
+            self.vector = np.zeros_like(self.vector)
+            self.weight = 0.0
+        if genre is not None and genre in self.genres:
+            self.genres[genre] -= 1
+            if self.genres[genre] <= 0:
+                del self.genres[genre]
+
+    def mark_played(self, track_id):
+        if track_id not in self._played:
+            self._played.add(track_id)
+            self.played.append(track_id)
+
+    def taste(self):
+        """
+        The decayed mean of the added tracks' vectors (zeros when empty).
+        """
+        return self.vector / self.weight if self.weight > 0 else np.zeros_like(self.vector)
+
+
+def _is_int(value):
+    # JSON true/false arrive as bools, which are ints too
+    return isinstance(value, int) and not isinstance(value, bool)
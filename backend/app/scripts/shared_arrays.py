@@ -0,0 +1,148 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+from numpy.lib.format import open_memmap
+import database
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock
+    fcntl = None
+
+# bump when the layout of any derived array set changes
+ARRAYS_FORMAT_VERSION = 3
+
+# rows builders fill at a time when writing into allocate()d arrays
+BUILD_BLOCK_ROWS = 65536
+
+# directory of the set load_or_build is writing on this thread (see allocate)
+_building = threading.local()
+
+# set while this process forks offline pool workers (they inherit it, see offline_pool)
+_pool_forks = False
+
+
+def shared_dir():
+    """
+    Directory for derived arrays, next to the tracks cache (resolved per call
+    so it follows database.CACHE_DIR).
+    """
+    return os.path.join(os.path.dirname(database.CACHE_DIR), '.derived_cache')
+
+
+def _read_manifest(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _load(path, manifest):
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in manifest['arrays']}
+
+
+@contextlib.contextmanager
+def offline_pool():
+    """
+    The fork context for an offline process pool (evaluation, neighbour
+    tables), whose workers inherit the parent's arrays copy-on-write.
+    Processes forked inside the block are marked as pool workers, so the
+    server's background threads aren't restarted in them (see
+    in_pool_worker and scripts/ingest.py).
+    """
+    global _pool_forks
+    previous, _pool_forks = _pool_forks, True
+    try:
+        yield multiprocessing.get_context('fork')
+    finally:
+        _pool_forks = previous
+
+
+def in_pool_worker():
+    """
+    True in a process forked by an offline_pool (checked right after fork).
+    """
+    return _pool_forks
+
+
+def allocate(name, shape, dtype):
+    """
+    Output array for a build() function. Under load_or_build it is the
+    memory-mapped .npy file of that name in the set being written, so a
+    builder filling it block by block never holds the whole array in memory;
+    otherwise (version None, or no cache dir) it is a plain array.
+    """
+    tmp_dir = getattr(_building, 'dir', None)
+    if tmp_dir is None:
+        return np.empty(shape, dtype=dtype)
+    return open_memmap(os.path.join(tmp_dir, f"{name}.npy"), mode='w+', dtype=dtype, shape=shape)
+
+
+def _spilled(array, path):
+    return isinstance(array, np.memmap) and array.filename is not None and \
+        os.path.abspath(array.filename) == os.path.abspath(path)
+
+
+def load_or_build(name, version, build):
+    """
+    Arrays produced by build() (a dict of name -> ndarray), memory-mapped
+    from disk.
+
+    The first process to ask for (name, version) runs build() and saves the
+    result as .npy files; every other process (e.g. pre-forked or restarted
+    workers) maps the same files read-only, so the pages are shared through
+    the OS page cache instead of being rebuilt and copied per worker.
+    A version of None (unknown data source) just returns build().
+    """
+    if version is None:
+        return build()
+
+    base = os.path.join(shared_dir(), name)
+    path = os.path.join(base, 'current')
+    arrays = tmp_dir = None
+    try:
+        os.makedirs(base, exist_ok=True)
+        with open(os.path.join(base, '.lock'), 'w') as lock:
+            # one builder at a time; the others wait and then map its output
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            manifest = _read_manifest(path)
+            if manifest and manifest['version'] == version and manifest['format'] == ARRAYS_FORMAT_VERSION:
+                return _load(path, manifest)
+
+            tmp_dir = tempfile.mkdtemp(prefix='.build_', dir=base)
+            _building.dir = tmp_dir
+            try:
+                arrays = build()
+            finally:
+                _building.dir = None
+            for array_name, array in arrays.items():
+                file = os.path.join(tmp_dir, f"{array_name}.npy")
+                if _spilled(array, file):
+                    # filled in place through allocate()
+                    array.flush()
+                else:
+                    np.save(file, np.ascontiguousarray(array))
+            manifest = {"version": version, "format": ARRAYS_FORMAT_VERSION, "arrays": list(arrays)}
+            with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+
+            # swap the new set in; processes still mapping the old files keep them until they exit
+            if os.path.exists(path):
+                old_dir = tempfile.mkdtemp(prefix='.old_', dir=base)
+                os.rename(path, os.path.join(old_dir, 'current'))
+                shutil.rmtree(old_dir, ignore_errors=True)
+            os.rename(tmp_dir, path)
+            return _load(path, manifest)
+    except OSError as e:
+        print(f"Could not use shared arrays for '{name}', keeping them in memory: {e}")
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return arrays if arrays is not None else build()
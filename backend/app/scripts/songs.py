@@ -1,43 +1,48 @@
-from flask import Blueprint, request, jsonify
-from database import load_tracks_data
-from .recommender import get_ml_recommendations, get_loaded_track_ids, get_title_for_id
-import pandas as pd
-import numpy as np
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics.pairwise import cosine_similarity
+from flask import Blueprint, Response, current_app, request, jsonify
+from . import service, ingest, responses
+from .serving import Overloaded
+from .metrics import span
+from .startup import RETRY_AFTER
 
 songs_bp = Blueprint('songs_bp', __name__, url_prefix='/songs')
 
-# load data once
-df_full = load_tracks_data()
-
-def search_in_dataframe(df, track_id=None, track_search=None, track_name=None, artists=None):
-    """
-    search for tracks in the DataFrame
-    """
-    if df is None or len(df) == 0:
-        return None
-    
-    result = df.copy()
-    
-    if track_id:
-        result = result[result['track_id'].astype(str) == str(track_id)]
-    
-    if track_search:
-        # exact match for track_search
-        result = result[result['track_search'].str.lower() == track_search.lower()]
-    
-    if track_name and artists:
-        # match for track_name and partial match for artists
-        result = result[
-            (result['track_name'].str.lower() == track_name.lower()) & 
-            (result['artists'].str.lower().str.contains(artists.lower(), na=False))
-        ]
-    elif track_name:
-        # starts-with search for track_name
-        result = result[result['track_name'].str.lower().str.startswith(track_name.lower(), na=False)]
-    
-    return result
+def respond(payload, status):
+    """
+    Body written from the payload's records (scripts/responses.py).
+    Every route takes format=json|msgpack and layout=records|columns.
+    503s (a startup stage still building) carry Retry-After and 401s
+    WWW-Authenticate; app.py's routes answer 503s through here too.
+    """
+    # JSON serialization is its own stage in /metrics
+    with span('serialize'):
+        body_format = request.args.get('format', default='json', type=str)
+        layout = request.args.get('layout', default='records', type=str)
+        if body_format == 'json' and layout == 'records' and not current_app.json.compact and \
+                (current_app.json.compact is False or current_app.debug):
+            # indented debug output stays jsonify's
+            response = jsonify(responses.plain(payload))
+            response.status_code = status
+        else:
+            try:
+                body, mimetype = responses.encode(payload, body_format, layout)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            response = Response(body, status=status, mimetype=mimetype)
+        if status == 503:
+            response.headers['Retry-After'] = str(RETRY_AFTER)
+        elif status == 401:
+            response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+
+# the routes only parse parameters; the work happens in scripts/service.py,
+# which the HTML pages (ui.py) call directly as well (scripts/ingest.py for catalog updates)
+
+@songs_bp.errorhandler(Overloaded)
+def overloaded(e):
+    # scoring queue full (batched serving mode): ask the client to back off
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
 
 @songs_bp.route('/recommend')
 def recommend_songs():
@@ -46,121 +51,48 @@ def recommend_songs():
     target_song = request.args.get('song')
     track_id = request.args.get('track_id')
 
-    # If track_id is provided and no title, try to use the in-memory sample title
-    if track_id and not target_song:
-        # First, check if this id is in the preloaded sample
-        sample_title = get_title_for_id(track_id)
-        if sample_title:
-            target_song = sample_title  # use normalized title from sample
-        else:
-            # Not in sample; we can still look up DB to confirm the id exists,
-            # but we will return a clear message that recommendation needs an in-sample track.
-            
-            result = search_in_dataframe(df_full, track_id=track_id)
-            if result is None or len(result) == 0:
-                return jsonify({"error": f"No song found for track_id={track_id}"}), 404
-            
-            row = result.iloc[0]
-            return jsonify({
-                "error": "This track is not in the currently loaded sample for recommendations.",
-                "track_id": track_id,
-                "track_name": row.get("track_name"),
-                "track_search": row.get("track_search"),
-                "hint": "Use /songs/search and pick a result where in_sample=true, then call /songs/recommend with that track_id."
-            }), 409
-
-    if not target_song:
-        return jsonify({"error": "Provide either 'song' (title) or 'track_id'"}), 400
-
-    # call the recommender by title (no changes to their logic)
-    recommendations = get_ml_recommendations(target_song)
-
-    if isinstance(recommendations, dict) and "error" in recommendations:
-        return jsonify(recommendations), 404
-
-    # attach track_id for each recommendation
-    enriched = []
-    for rec in (recommendations or []):
-        # we'll try exact match on 'track_search' 
-        track_search = (rec.get("track_search") or "").strip()
-        track_name = (rec.get("track_name") or "").strip()
-        artists = (rec.get("artists") or "").strip()
-        tid = None
-        
-        # look up track_id from full dataset
-        result = search_in_dataframe(track_search=track_search)
-        if result is not None and len(result) > 0:
-            tid = result.iloc[0]['track_id']
-
-        else:
-            # fallback: try (track_name + artists) if needed
-            result = search_in_dataframe(track_name=track_name, artists=artists)
-            tid = result.iloc[0]['track_id'] if result is not None and len(result) > 0 else None
-
-        rec = dict(rec)
-        if tid:
-            rec["track_id"] = tid
-        enriched.append(rec)
+    # optional approximate search: engine = exact | ivf | lsh, nprobe = recall/latency knob
+    engine = request.args.get('engine', default='exact', type=str)
+    nprobe = request.args.get('nprobe', type=int)
+    report_recall = request.args.get('report_recall', default='false', type=str).lower() == 'true'
+    # fields per recommendation: comma-separated catalog columns and/or 'similarity', or 'all'
+    # (default track_id, track_name, artists, track_genre, track_search)
+    fields = request.args.get('fields', type=str)
+    # diversity-aware reranking: diversity (0-1, default 0 = similarity order),
+    # max_per_artist / max_per_album caps
+    diversity = request.args.get('diversity', default=0.0, type=float)
+    max_per_artist = request.args.get('max_per_artist', type=int)
+    max_per_album = request.args.get('max_per_album', type=int)
 
-    return jsonify({
-        "input": target_song,
-        "recommendations": enriched
-    })
+    payload, status = service.recommend(song=target_song, track_id=track_id, engine=engine, nprobe=nprobe,
+                                        report_recall=report_recall, fields=fields, diversity=diversity,
+                                        max_per_artist=max_per_artist, max_per_album=max_per_album)
+    return respond(payload, status)
 
 
 
 @songs_bp.route('/search')
 def search_songs():
-
+    """
+    Ranked search over track name, artists and album.
+    Params:
+      - q (required)
+      - offset (int, default 0)
+      - limit (int, default 20, max 100)
+      - fuzzy (bool, default false) - also return close matches for typos
+    """
     search_query = request.args.get('q')
+    offset = request.args.get('offset', default=0, type=int)
+    limit = request.args.get('limit', default=20, type=int)
+    fuzzy = request.args.get('fuzzy', default='false', type=str).lower() == 'true'
 
-    if not search_query:
-        return jsonify({"error": "A search query 'q' is required."}), 400
-
-    try:
-        # search in the full dataset
-        if df_full is not None:
-
-            # partial matching
-            mask = df_full['track_name'].str.lower().str.contains(search_query.lower(), na=False)
-            results_df = df_full[mask]
-
-        else:
-            results_df = pd.DataFrame()
-        
-        # limit to 20 results
-        results_df = results_df.head(20)
-        
-        loaded_ids = set(get_loaded_track_ids())
-        results = []
-        
-        for _, row in results_df.iterrows():
-            result_item = {
-                "track_id": row.get("track_id"),
-                "track_name": row.get("track_name"),
-                "artists": row.get("artists"),
-                "album_name": row.get("album_name"),
-                "in_sample": (str(row.get("track_id")) in loaded_ids)
-            }
-            results.append(result_item)
-
-        return jsonify({
-            "message": f"Found {len(results)} results for '{search_query}'", 
-            "results": results
-        })
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    payload, status = service.search(search_query, offset=offset, limit=limit, fuzzy=fuzzy)
+    return respond(payload, status)
 
 @songs_bp.route('/details/<track_id>')
 def get_song_details(track_id):
-    try:
-        result = search_in_dataframe(df_full, track_id=track_id)
-        if result is None or len(result) == 0:
-            return jsonify({"error": f"No song found for track_id={track_id}"}), 404
-        
-        return jsonify(result.iloc[0].to_dict())
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    payload, status = service.song_details(track_id)
+    return respond(payload, status)
 
 @songs_bp.route('/recommend_full')
 def recommend_full():
@@ -168,84 +100,133 @@ def recommend_full():
     Full-dataset recommendations (no dependency on in-memory sample).
     Params:
       - track_id OR song (prefer exact 'track_search' like 'Love Song - Sara Bareilles')
-      - k (int, default 10)
+      - k (int, default 5)
       - same_genre (bool, default true)
+      - scaling ('auto' | 'global' | 'genre' | 'exact', default from the feature store)
+      - engine ('exact' | 'ivf' | 'lsh', default exact; ANN applies to same_genre=false)
+      - nprobe (int) - clusters (ivf) or hash tables (lsh) to search
+      - report_recall (bool, default false) - include recall@k against exact search
+      - fields (comma-separated catalog columns and/or 'similarity', or 'all';
+        default track_id, track_name, artists, track_genre, track_search, similarity)
+      - genres (comma-separated genre names) - candidates from these genres only
+        (instead of same_genre), scored like a cross-genre query
+      - nearby_genres (int) - candidates from the target's genre and the n genres
+        whose centroids are closest to it
+      - diversity (float 0-1, default 0) - rerank a larger candidate pool by
+        Maximal Marginal Relevance; 0 keeps the similarity order, 1 favours
+        tracks unlike the ones already picked
+      - max_per_artist, max_per_album (int) - at most this many tracks per
+        artist / album
+      (with any of these, "reranking" reports genre relevance and artist
+      diversity before and after reranking)
     """
     target_song = request.args.get('song', type=str)
     track_id = request.args.get('track_id', type=str)
     k = request.args.get('k', default=5, type=int)
     same_genre = request.args.get('same_genre', default='true', type=str).lower() == 'true'
+    scaling = request.args.get('scaling', type=str)
+    engine = request.args.get('engine', default='exact', type=str)
+    nprobe = request.args.get('nprobe', type=int)
+    report_recall = request.args.get('report_recall', default='false', type=str).lower() == 'true'
+    fields = request.args.get('fields', type=str)
+    genres = request.args.get('genres', type=str)
+    nearby_genres = request.args.get('nearby_genres', type=int)
+    diversity = request.args.get('diversity', default=0.0, type=float)
+    max_per_artist = request.args.get('max_per_artist', type=int)
+    max_per_album = request.args.get('max_per_album', type=int)
+
+    payload, status = service.recommend_full(track_id=track_id, song=target_song, k=k, same_genre=same_genre,
+                                             scaling=scaling, engine=engine, nprobe=nprobe,
+                                             report_recall=report_recall, fields=fields, genres=genres,
+                                             nearby_genres=nearby_genres, diversity=diversity,
+                                             max_per_artist=max_per_artist, max_per_album=max_per_album)
+    return respond(payload, status)
+
+@songs_bp.route('/cache_stats')
+def cache_stats():
+    """
+    Hit/miss counters and occupancy of the recommendation result cache.
+    """
+    payload, status = service.cache_stats()
+    return respond(payload, status)
 
-    if not (target_song or track_id):
-        return jsonify({"error": "Provide either 'song' or 'track_id'"}), 400
-
-    if df_full is None:
-        return jsonify({"error": "Dataset not loaded"}), 500
+@songs_bp.route('/serving_stats')
+def serving_stats():
+    """
+    Micro-batching pool counters (batches, average batch size, rejections).
+    """
+    payload, status = service.serving_stats()
+    return respond(payload, status)
 
-    # resolve target row from DB
-    try:
-        if track_id:
-            target_df = search_in_dataframe(df_full, track_id=track_id)
-        else:
-            # prefer exact match on track_search = "Title - Artist"
-            target_df = search_in_dataframe(df_full, track_search=target_song)
-            if target_df is None or len(target_df) == 0:
-                # fallback: try track_name ilike (first match)
-                target_df = search_in_dataframe(df_full, track_name=target_song)
-        
-        if target_df is None or len(target_df) == 0:
-            return jsonify({"error": "Target song not found in dataset."}), 404
-        
-        target = target_df.iloc[0]
-    except Exception as e:
-        return jsonify({"error": f"Lookup failed: {e}"}), 500
-
-    # fetch candidate rows (entire table or filtered by genre) 
-    feature_cols = [
-        'danceability', 'energy', 'loudness', 'tempo', 'valence'
-    ]
-    meta_cols = ["track_id", "track_name", "artists", "track_genre", "track_search"]
-
-    try:
-        # filter candidates
-        candidates = df_full.copy()
-        if same_genre and target.get("track_genre"):
-            candidates = candidates[candidates['track_genre'] == target["track_genre"]]
-        
-        # exclude the target itself
-        candidates = candidates[candidates['track_id'] != target['track_id']]
-        
-        if len(candidates) == 0:
-            return jsonify({"input": target.get("track_search") or target.get("track_name"), "recommendations": []})
-
-        # vectorize + similarity
-        # build DataFrame for candidates and target
-        df_candidates = candidates[meta_cols + feature_cols].copy()
-        
-        # numeric dtype, replace missing with 0
-        for col in feature_cols:
-            df_candidates[col] = pd.to_numeric(df_candidates[col], errors="coerce").fillna(0.0)
-        
-        # create target vector
-        t_vec = np.array([[pd.to_numeric(target.get(col, 0.0), errors="coerce") for col in feature_cols]], dtype=float)
-
-        X = df_candidates[feature_cols].astype(float).values
-        scaler = StandardScaler()
-        Xs = scaler.fit_transform(X)
-        ts = scaler.transform(t_vec)
-
-        sims = cosine_similarity(ts, Xs)[0]  # shape: (n_candidates,)
-        df_candidates["similarity"] = sims
-
-        # top-k similar songs
-        top = df_candidates.sort_values("similarity", ascending=False).head(k)
-        recs = top[["track_id", "track_name", "artists", "track_genre", "track_search", "similarity"]].to_dict(orient="records")
-
-        return jsonify({
-            "input": target.get("track_search") or target.get("track_name"),
-            "same_genre": same_genre,
-            "k": k,
-            "recommendations": recs
-        })
-    except Exception as e:
-        return jsonify({"error": f"Similarity calculation failed: {e}"}), 500
\ No newline at end of file
+@songs_bp.route('/recommend_batch', methods=['POST'])
+def recommend_batch():
+    """
+    Recommendations for many seeds in one request.
+    JSON body:
+      - track_ids (list) and/or songs (list of titles)
+      - k (int 0-100, default 5)
+      - same_genre (bool, default true)
+      - scaling (same options as /recommend_full)
+      - aggregate ('per_seed' | 'centroid', default per_seed)
+          per_seed - one top-k list per seed
+          centroid - one combined top-k list for the playlist centroid
+      - fields (list, or 'all') - same as /recommend_full
+    """
+    body = request.get_json(silent=True) or {}
+    payload, status = service.recommend_batch(track_ids=body.get('track_ids'), songs=body.get('songs'),
+                                              k=body.get('k', 5), same_genre=body.get('same_genre', True),
+                                              scaling=body.get('scaling'),
+                                              aggregate=body.get('aggregate', 'per_seed'),
+                                              fields=body.get('fields'))
+    return respond(payload, status)
+
+@songs_bp.route('/session', methods=['POST'])
+def session():
+    """
+    Playlist / listening session recommendations from one taste vector (the
+    decayed mean of the session's tracks, see scripts/session.py).
+    JSON body:
+      - session (object) - the "session" of the previous response; omit to start one
+      - add, remove (lists of track_ids) - tracks added to / removed from the session
+      - played (list of track_ids) - tracks never to recommend again
+      - k (int 0-100, default 10)
+      - same_genre (bool, default false) - only genres of the session's tracks
+      - genres (list) - only these genres
+      - fields (list, or 'all') - same as /recommend_full
+      - decay (float in (0, 1], default 0.9) - weight of each older track, new sessions only
+    The response carries the updated "session" to send with the next update.
+    """
+    body = request.get_json(silent=True) or {}
+    payload, status = service.session_recommend(session=body.get('session'), add=body.get('add'),
+                                                remove=body.get('remove'), played=body.get('played'),
+                                                k=body.get('k', 10), same_genre=body.get('same_genre', False),
+                                                genres=body.get('genres'), fields=body.get('fields'),
+                                                decay=body.get('decay'))
+    return respond(payload, status)
+
+@songs_bp.route('/ingest', methods=['POST'])
+def ingest_tracks():
+    """
+    Add or update tracks without a restart.
+    Body: JSON lines, one track per line, with any of the dataset's columns:
+      - track_id (required) - a track_id/track_genre pair already in the catalog
+        updates those rows, otherwise the track is appended
+      - new tracks also need track_name, artists, track_genre and the audio
+        features (danceability, energy, loudness, tempo, valence)
+      - track_search is derived from track_name and artists when not given
+    Off unless INGEST_TOKEN is set; then send "Authorization: Bearer <token>".
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    denied = ingest.authorize(token if scheme.lower() == 'bearer' else None)
+    if denied:
+        return respond(*denied)
+    payload, status = ingest.ingest(request.get_data(as_text=True))
+    return respond(payload, status)
+
+@songs_bp.route('/ingest_stats')
+def ingest_stats():
+    """
+    Ingest counters, catalog version and the current scaler drift.
+    """
+    payload, status = ingest.ingest_stats()
+    return respond(payload, status)
@@ -0,0 +1,146 @@
+"""
+Staged application startup.
+
+Importing the app builds nothing. app.py registers the startup stages here
+and start() runs them on background threads, each one as soon as the stages
+it depends on are ready (independent stages build in parallel):
+
+    catalog        tracks table and category codes (binary cache or CSV)
+    lookup         track_id / title / name indexes          after catalog
+    search_index   trigram index for /songs/search          after catalog
+                   (in_sample is null until the recommender is ready)
+    feature_store  scaled features for /songs/recommend_full,
+                   /songs/recommend_batch and /songs/session after catalog
+    recommender    recommender state for /songs/recommend
+                   and /evaluate_model                      after catalog
+    ingest         journal replay and background updater    after all of the above
+
+Routes ask unavailable() for the stages they need: until those are ready
+they answer 503 with Retry-After (500 if one failed), so each endpoint opens
+as soon as its own dependencies are built. /ready reports every stage's
+status and timings.
+
+STARTUP_MODE=blocking runs the stages before the import returns instead
+(gunicorn with preload_app, whose workers are forked from a finished master).
+"""
+import os
+import threading
+import time
+import traceback
+from .metrics import span
+
+STARTUP_MODES = ('background', 'blocking')
+STARTUP_MODE = os.environ.get('STARTUP_MODE', 'background')
+if STARTUP_MODE not in STARTUP_MODES:
+    raise ValueError(f"STARTUP_MODE must be one of {list(STARTUP_MODES)}, not {STARTUP_MODE}")
+
+# seconds clients are told to wait (Retry-After) while a stage is building
+RETRY_AFTER = int(os.environ.get('STARTUP_RETRY_AFTER', 1))
+
+
+class Startup:
+    """
+    Startup stages (name, build function, stages it runs after) and their
+    progress. A stage whose dependency failed is skipped, and fails in turn.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._done = {}
+        self._lock = threading.Lock()
+        self.started = None
+        # name -> status (pending | running | ready | failed), timings, error
+        self.status = {}
+
+    def add(self, name, build, after=()):
+        unknown = [dep for dep in after if dep not in self._stages]
+        if unknown:
+            raise ValueError(f"stage '{name}' runs after unknown stages {unknown}")
+        self._stages[name] = (build, tuple(after))
+        self._done[name] = threading.Event()
+        self.status[name] = {"status": "pending", "after": list(after)}
+
+    def start(self, wait=False):
+        """
+        Run every stage on its own thread (once). With wait, block until all
+        of them finished.
+        """
+        with self._lock:
+            if self.started is None:
+                self.started = time.time()
+                for name in self._stages:
+                    threading.Thread(target=self._run, args=(name,), name=f'startup-{name}', daemon=True).start()
+        if wait:
+            self.wait()
+
+    def _run(self, name):
+        build, after = self._stages[name]
+        for dep in after:
+            self._done[dep].wait()
+        status = self.status[name]
+        failed = [dep for dep in after if self.status[dep]["status"] != 'ready']
+        if failed:
+            status.update(status='failed', error=f"skipped: {', '.join(failed)} failed")
+            self._done[name].set()
+            return
+
+        status.update(status='running', started_s=round(time.time() - self.started, 3))
+        t0 = time.perf_counter()
+        try:
+            with span(f'init.{name}'):
+                build()
+            status["status"] = 'ready'
+        except Exception as e:
+            print(f"Startup stage '{name}' failed: {e}")
+            traceback.print_exc()
+            status.update(status='failed', error=str(e))
+        finally:
+            status["seconds"] = round(time.perf_counter() - t0, 3)
+            self._done[name].set()
+
+    def wait(self, *names, timeout=None):
+        """
+        Block until the named stages (all by default) finished; True if they
+        are all ready.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for name in names or self._stages:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not self._done[name].wait(remaining):
+                return False
+        return self.ready(*names)
+
+    def ready(self, *names):
+        return all(self.status.get(name, {}).get("status") == 'ready' for name in names or self._stages)
+
+    def failed(self):
+        return [name for name, status in self.status.items() if status["status"] == 'failed']
+
+    def unavailable(self, *names):
+        """
+        None once every named stage is ready, else the (payload, status) to
+        answer with: 503 while they are still building, 500 if one failed.
+        """
+        waiting = []
+        for name in names:
+            status = self.status.get(name, {"status": "pending"})
+            if status["status"] == 'failed':
+                return {"error": f"Startup stage '{name}' failed: {status.get('error')}"}, 500
+            if status["status"] != 'ready':
+                waiting.append(name)
+        if waiting:
+            return {"error": f"Still starting up (waiting for {', '.join(waiting)})",
+                    "retry_after": RETRY_AFTER}, 503
+        return None
+
+    def info(self):
+        return {
+            "ready": self.ready(),
+            "mode": STARTUP_MODE,
+            "elapsed_s": round(time.time() - self.started, 3) if self.started is not None else None,
+            "stages": {name: dict(status) for name, status in self.status.items()}
+        }
+
+
+# the app's startup stages (registered in app.py)
+startup = Startup()
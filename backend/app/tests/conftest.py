@@ -0,0 +1,98 @@
+"""
+Shared fixtures: a small synthetic tracks table in the CSV's columns, and
+the app started on it.
+"""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import database
+from scripts.catalog import Catalog
+
+# read when the app's modules are imported: build every startup stage before
+# `import app` returns, and keep the background ingest sync out of the tests
+os.environ.setdefault('STARTUP_MODE', 'blocking')
+os.environ.setdefault('INGEST_COMPACT_INTERVAL', '3600')
+os.environ.setdefault('INGEST_TOKEN', 'test-token')
+
+N_TRACKS = 1200
+GENRES = ['ambient', 'blues', 'disco', 'folk', 'jazz', 'metal', 'pop', 'techno']
+
+
+def make_tracks(n=N_TRACKS, seed=0):
+    """
+    Tracks in the CSV's columns. Every genre clusters around its own point
+    of the feature space.
+    """
+    rng = np.random.default_rng(seed)
+    genre = rng.integers(len(GENRES), size=n)
+    center = rng.uniform(0.15, 0.85, size=(len(GENRES), 3))
+    unit = np.clip(center[genre] + rng.normal(0, 0.08, size=(n, 3)), 0, 1).round(4)
+    artists = [f"Artist {a}" for a in rng.integers(300, size=n)]
+    # a few titles need escaping in ASCII JSON
+    names = [f"Canción {i}" if i % 50 == 0 else f"Song {i}" for i in range(n)]
+    return pd.DataFrame({
+        'track_id': [f"track{i:05d}" for i in range(n)],
+        'artists': artists,
+        'album_name': [f"Album {i // 4}" for i in range(n)],
+        'track_name': names,
+        'popularity': rng.integers(0, 101, size=n),
+        'duration_ms': rng.integers(60000, 400000, size=n),
+        'explicit': rng.random(n) < 0.2,
+        'danceability': unit[:, 0],
+        'energy': unit[:, 1],
+        'key': rng.integers(-1, 12, size=n),
+        'loudness': (rng.uniform(-20, -3, size=len(GENRES))[genre] + rng.normal(0, 1.5, size=n)).round(3),
+        'mode': rng.integers(0, 2, size=n),
+        'speechiness': rng.random(n).round(4),
+        'acousticness': rng.random(n).round(4),
+        'instrumentalness': rng.random(n).round(4),
+        'liveness': rng.random(n).round(4),
+        'valence': unit[:, 2],
+        'tempo': (rng.uniform(70, 170, size=len(GENRES))[genre] + rng.normal(0, 8, size=n)).round(3),
+        'time_signature': rng.integers(3, 6, size=n),
+        'track_genre': [GENRES[g] for g in genre],
+        'track_search': [f"{name} - {artist}" for name, artist in zip(names, artists)],
+    })
+
+
+@pytest.fixture(scope='session', autouse=True)
+def tracks_csv(tmp_path_factory):
+    """
+    Serve the synthetic CSV for the whole session.
+    """
+    path = tmp_path_factory.mktemp('tracks') / 'cleaned_tracks.csv'
+    make_tracks().to_csv(path, index=False)
+    database.use_csv(path)
+    return str(path)
+
+
+@pytest.fixture(scope='session')
+def app(tracks_csv):
+    from app import app
+    from scripts.startup import startup
+    assert startup.wait(), startup.failed()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def tracks():
+    return make_tracks()
+
+
+@pytest.fixture(scope='session')
+def catalog(tracks):
+    return Catalog(tracks)
+
+
+@pytest.fixture(scope='session')
+def seeds():
+    """
+    Row positions used as query seeds.
+    """
+    return [int(row) for row in np.random.default_rng(1).choice(N_TRACKS, 40, replace=False)]
@@ -0,0 +1,47 @@
+"""
+Approximate engines return correctly scored subsets of the exact search.
+"""
+import numpy as np
+import pytest
+from scripts.ann import AnnSearcher
+from scripts.scoring import normalize_rows
+
+K = 10
+
+
+@pytest.fixture(scope='module')
+def searcher(tracks):
+    values = tracks[['danceability', 'energy', 'loudness', 'tempo', 'valence']].to_numpy(dtype=float)
+    values = (values - values.mean(axis=0)) / values.std(axis=0)
+    return AnnSearcher(normalize_rows(values).astype(np.float32))
+
+
+@pytest.mark.parametrize('engine', ['ivf', 'lsh'])
+def test_results_are_scored_and_ranked(searcher, seeds, engine):
+    features = searcher.features
+    for row in seeds:
+        rows, scores = searcher.search(features[row], K, exclude=row, engine=engine)
+        assert row not in rows and len(set(rows.tolist())) == len(rows)
+        np.testing.assert_allclose(scores, features[rows] @ features[row], atol=1e-6)
+        assert (np.diff(scores) <= 0).all()
+
+
+def test_ivf_probing_every_list_is_exact(searcher, seeds):
+    n_lists = searcher.index('ivf').n_lists
+    for row in seeds:
+        query = searcher.features[row]
+        exact, _ = searcher.search(query, K, exclude=row)
+        rows, _ = searcher.search(query, K, exclude=row, engine='ivf', nprobe=n_lists)
+        np.testing.assert_array_equal(rows, exact)
+
+
+@pytest.mark.parametrize('engine', ['ivf', 'lsh'])
+def test_recall(searcher, seeds, engine):
+    recalls = [searcher.recall(searcher.features[row], K, exclude=row, engine=engine) for row in seeds]
+    assert np.mean(recalls) >= 0.8
+    assert searcher.recall(searcher.features[seeds[0]], K, exclude=seeds[0], engine='exact') == 1.0
+
+
+def test_unknown_engine(searcher):
+    with pytest.raises(ValueError):
+        searcher.search(searcher.features[0], K, engine='hnsw')
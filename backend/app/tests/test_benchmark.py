@@ -0,0 +1,50 @@
+"""
+Benchmark helpers: scaled catalogs and regression detection.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.benchmark import make_scaled_csv, compare, latency_summary, JITTER_COLS
+
+
+@pytest.fixture
+def csv_path(tracks, tmp_path):
+    path = tmp_path / 'tracks.csv'
+    tracks.head(100).to_csv(path, index=False)
+    return path
+
+
+def test_scale_down_keeps_the_first_rows(csv_path, tmp_path):
+    dest = tmp_path / 'half.csv'
+    assert make_scaled_csv(csv_path, dest, 0.5) == 50
+    pd.testing.assert_frame_equal(pd.read_csv(dest), pd.read_csv(csv_path).head(50))
+
+
+def test_scale_up_adds_distinct_jittered_copies(csv_path, tmp_path):
+    dest = tmp_path / 'big.csv'
+    assert make_scaled_csv(csv_path, dest, 2.5) == 250
+    src, out = pd.read_csv(csv_path), pd.read_csv(dest)
+    assert out['track_id'].is_unique
+    pd.testing.assert_frame_equal(out.head(100), src)
+    assert out['track_id'].iat[150] == f"{src['track_id'].iat[50]}-1"
+    for col in ['danceability', 'tempo']:
+        assert out[col].between(src[col].min(), src[col].max()).all()
+    assert not np.allclose(out[JITTER_COLS].iloc[100:200].to_numpy(), src[JITTER_COLS].to_numpy())
+    pd.testing.assert_series_equal(out['track_genre'].iloc[100:200].reset_index(drop=True), src['track_genre'])
+
+
+def test_compare_flags_slower_percentiles():
+    def run(p50, p95):
+        stats = {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p95}
+        return {'sizes': [{'scale': 1.0, 'endpoints': {'search_songs': stats}}]}
+
+    regressions = compare(run(1.0, 2.5), run(1.0, 2.0), tolerance=0.2)
+    assert [(r['metric'], r['change']) for r in regressions] == [('p95_ms', 0.25), ('p99_ms', 0.25)]
+    assert compare(run(1.1, 2.1), run(1.0, 2.0), tolerance=0.2) == []
+    assert compare(run(9, 9), {'sizes': [{'scale': 4.0, 'endpoints': {}}]}, tolerance=0.2) == []
+
+
+def test_latency_summary():
+    summary = latency_summary([1, 2, 3, 4], elapsed_s=0.5, errors=1)
+    assert summary['p50_ms'] == 2.5 and summary['max_ms'] == 4
+    assert summary['qps'] == 8.0 and summary['requests'] == 4 and summary['errors'] == 1
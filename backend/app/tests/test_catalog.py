@@ -0,0 +1,56 @@
+"""
+The shared Catalog's codes and indexes agree with the table they were built from.
+"""
+import numpy as np
+import pandas as pd
+from scripts.catalog import Catalog
+
+
+def test_codes_round_trip(tracks, catalog):
+    assert len(catalog) == len(tracks)
+    np.testing.assert_array_equal(catalog.genre_names[catalog.genre_codes], tracks['track_genre'].to_numpy())
+    np.testing.assert_array_equal(catalog.artist_names[catalog.artist_codes], tracks['artists'].to_numpy())
+    assert [catalog.genre_of(row) for row in range(0, len(tracks), 37)] == \
+        tracks['track_genre'].iloc[::37].tolist()
+
+
+def test_categorical_columns_reuse_their_codes(tracks):
+    df = tracks.astype({'track_genre': 'category'})
+    df.loc[3, 'track_genre'] = np.nan
+    catalog = Catalog(df)
+    np.testing.assert_array_equal(catalog.genre_codes, df['track_genre'].cat.codes.to_numpy())
+    assert catalog.genre_of(3) is None
+
+
+def test_rows_for_id(tracks, catalog):
+    for row in range(0, len(tracks), 53):
+        track_id = tracks['track_id'].iat[row]
+        assert catalog.row_for_id(track_id) == row
+        np.testing.assert_array_equal(catalog.rows_for_id(track_id), [row])
+    assert catalog.row_for_id('missing') is None
+    assert len(catalog.rows_for_id('missing')) == 0
+
+
+def test_duplicate_ids(tracks):
+    df = pd.concat([tracks.iloc[:10], tracks.iloc[[4]]], ignore_index=True)
+    catalog = Catalog(df)
+    np.testing.assert_array_equal(catalog.rows_for_id('track00004'), [4, 10])
+    assert catalog.row_for_id('track00004') == 4
+
+
+def test_title_of(tracks, catalog):
+    assert catalog.title_of(7) == tracks['track_search'].iat[7]
+    df = tracks.iloc[:5].copy()
+    df.loc[2, 'track_search'] = np.nan
+    assert Catalog(df).title_of(2) == df['track_name'].iat[2]
+
+
+def test_version_is_the_source(tracks):
+    df = tracks.copy()
+    df.attrs['sha1'] = 'abc'
+    first, second = Catalog(df), Catalog(df)
+    assert first.version == second.version == 'abc' and first.from_file
+    # the same batch from the same parent gets the same version
+    records = [{"track_id": "track00001", "popularity": 1}]
+    assert first.upsert(records, source='abc-1')[0].version == second.upsert(records, source='abc-1')[0].version
+    assert Catalog(tracks).version is None
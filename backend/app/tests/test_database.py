@@ -0,0 +1,87 @@
+"""
+The binary columnar cache loads what pd.read_csv loads, and follows the CSV.
+"""
+import os
+import pandas as pd
+import pytest
+import database
+
+
+@pytest.fixture
+def csv_path(tracks, tmp_path, monkeypatch):
+    path = tmp_path / 'cleaned_tracks.csv'
+    tracks.to_csv(path, index=False)
+    monkeypatch.setattr(database, 'CSV_PATH', str(path))
+    monkeypatch.setattr(database, 'CACHE_DIR', str(tmp_path / '.tracks_cache'))
+    return path
+
+
+def assert_same_table(df, expected):
+    assert list(df.columns) == list(expected.columns)
+    for column in expected.columns:
+        values = df[column].astype(object) if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column]
+        pd.testing.assert_series_equal(pd.Series(values.to_numpy(), name=column),
+                                       pd.Series(expected[column].to_numpy(), name=column), check_dtype=False)
+
+
+def test_cache_matches_read_csv(csv_path):
+    expected = pd.read_csv(csv_path)
+    first = database.load_tracks_data()
+    assert os.path.exists(os.path.join(database.CACHE_DIR, 'manifest.json'))
+    cached = database.load_tracks_data()
+    assert_same_table(first, expected)
+    assert_same_table(cached, expected)
+    assert isinstance(cached['track_genre'].dtype, pd.CategoricalDtype)
+
+
+def test_cache_follows_the_csv(csv_path, tracks):
+    database.load_tracks_data()
+    manifest = database._read_manifest(database.CACHE_DIR)
+
+    # same content, new mtime: still fresh
+    os.utime(csv_path, (1, 1))
+    assert database._cache_is_fresh(manifest, str(csv_path), database.CACHE_DIR)
+
+    changed = tracks.copy()
+    changed.loc[0, 'track_name'] = 'Changed'
+    changed.to_csv(csv_path, index=False)
+    assert not database._cache_is_fresh(database._read_manifest(database.CACHE_DIR), str(csv_path),
+                                        database.CACHE_DIR)
+    assert database.load_tracks_data()['track_name'].iat[0] == 'Changed'
+
+
+def test_without_cache(csv_path):
+    df = database.load_tracks_data(use_cache=False)
+    assert not os.path.exists(database.CACHE_DIR)
+    assert_same_table(df, pd.read_csv(csv_path))
+
+
+def test_loads_carry_the_csv_hash(csv_path):
+    digest = database._file_digest(str(csv_path))
+    assert database.load_tracks_data().attrs['sha1'] == digest
+    assert database.load_tracks_data().attrs['sha1'] == digest
+
+
+def test_streamed_in_small_chunks(csv_path, tmp_path):
+    manifest = database.build_tracks_cache(str(csv_path), str(tmp_path / 'chunked'), chunk_rows=7)
+    df = database.load_tracks_cache(str(tmp_path / 'chunked'), manifest)
+    assert_same_table(df, pd.read_csv(csv_path))
+    assert df['popularity'].dtype == 'int8' and df['duration_ms'].dtype == 'int32'
+    # 4-decimal values aren't exact in float32, so they stay float64
+    assert df['danceability'].dtype == 'float64'
+
+
+def test_column_types_over_the_whole_file(tmp_path):
+    path = tmp_path / 'mixed.csv'
+    # chunks of 2 rows: ints then floats, digits then words
+    pd.DataFrame({
+        'mixed': ['1', '2', '2.5', '3'],
+        'digits': ['10', '20', 'ten', 'twenty'],
+        'halves': ['0.5', '1.5', '2.5', '-1'],
+    }).to_csv(path, index=False)
+    manifest = database.build_tracks_cache(str(path), str(tmp_path / 'cache'), chunk_rows=2)
+    df = database.load_tracks_cache(str(tmp_path / 'cache'), manifest)
+    assert_same_table(df, pd.read_csv(path))
+    assert df['mixed'].dtype == 'float32' and df['halves'].dtype == 'float32'
+    assert isinstance(df['digits'].dtype, pd.CategoricalDtype)
+    assert list(df['digits']) == ['10', '20', 'ten', 'twenty']
@@ -0,0 +1,139 @@
+"""
+Diversity-aware reranking picks what a one-candidate-at-a-time MMR loop
+picks, and the caps hold end to end.
+"""
+import numpy as np
+import pytest
+from scripts.diversity import Reranking, pool_similarities
+from scripts.scoring import CompactFeatures
+
+
+def naive_mmr(relevance, similarity, k, diversity, groups=()):
+    """
+    Greedy Maximal Marginal Relevance over one pool, candidate by candidate.
+    """
+    picked, counts = [], [dict() for _ in groups]
+    for step in range(k):
+        best, best_score = -1, -np.inf
+        for i, rel in enumerate(relevance):
+            if i in picked or not np.isfinite(rel):
+                continue
+            if any(codes[i] >= 0 and count.get(codes[i], 0) >= cap
+                   for (codes, cap), count in zip(groups, counts)):
+                continue
+            if step == 0 or diversity == 0:
+                score = rel
+            else:
+                score = (1 - diversity) * rel - diversity * max(similarity[i, j] for j in picked)
+            if score > best_score:
+                best, best_score = i, score
+        if best < 0:
+            break
+        picked.append(best)
+        for (codes, _), count in zip(groups, counts):
+            count[codes[best]] = count.get(codes[best], 0) + 1
+    return picked
+
+
+@pytest.fixture(scope='module')
+def recommender(app):
+    from scripts import recommender
+    return recommender
+
+
+@pytest.fixture(scope='module')
+def service(app):
+    from scripts import service
+    return service
+
+
+@pytest.mark.parametrize('diversity, max_per_artist, max_per_album', [(0.0, None, None), (0.3, None, None),
+                                                                      (1.0, None, None), (0.5, 2, None),
+                                                                      (0.0, 1, 1), (0.7, None, 2)])
+def test_select_matches_the_naive_loop(diversity, max_per_artist, max_per_album):
+    rng = np.random.default_rng(3)
+    n, size, k = 12, 30, 8
+    vectors = rng.normal(size=(n, size, 6))
+    vectors /= np.linalg.norm(vectors, axis=2, keepdims=True)
+    similarity = vectors @ vectors.transpose(0, 2, 1)
+    relevance = np.sort(rng.random((n, size)), axis=1)[:, ::-1].copy()
+    relevance[::3, -7:] = -np.inf
+    artists, albums = rng.integers(-1, 6, (n, size)), rng.integers(-1, 9, (n, size))
+    reranking = Reranking(diversity, max_per_artist, max_per_album)
+    groups = [(codes, cap) for codes, cap in ((artists, max_per_artist), (albums, max_per_album)) if cap is not None]
+
+    picked = reranking.select(relevance, similarity, k, groups)
+    for i in range(n):
+        expected = naive_mmr(relevance[i], similarity[i], k, diversity, [(codes[i], cap) for codes, cap in groups])
+        assert picked[i][picked[i] >= 0].tolist() == expected
+
+
+def test_inactive_keeps_the_similarity_order():
+    relevance = np.array([[0.9, 0.8, 0.5, -np.inf]])
+    similarity = np.ones((1, 4, 4))
+    reranking = Reranking()
+    assert not reranking.active and reranking.pool_size(7) == 7
+    assert Reranking().select(relevance, similarity, 5).tolist() == [[0, 1, 2, -1]]
+
+
+@pytest.mark.parametrize('kwargs', [{'diversity': 1.5}, {'diversity': -0.1}, {'diversity': True},
+                                    {'diversity': '0.5'}, {'max_per_artist': 0}, {'max_per_album': 1.5},
+                                    {'max_per_album': True}])
+def test_bad_options(kwargs):
+    with pytest.raises(ValueError):
+        Reranking(**kwargs)
+
+
+def test_compact_pool_similarities_match_dense():
+    rng = np.random.default_rng(4)
+    numeric = rng.normal(size=(50, 5)).astype(np.float32)
+    codes = rng.integers(0, 4, 50)
+    weight = rng.random(50).astype(np.float32)
+    dense = np.hstack([numeric, weight[:, None] * (codes[:, None] == np.arange(4))])
+    compact = CompactFeatures(numeric, weight, codes, 4)
+    positions = rng.integers(0, 50, (3, 9))
+    np.testing.assert_allclose(pool_similarities(compact, positions), pool_similarities(dense, positions),
+                               atol=1e-6)
+
+
+def test_batch_matches_single_lists(recommender, seeds):
+    state = recommender.state
+    catalog, features = state.catalog, state.feature_matrix
+    reranking = Reranking(0.4, max_per_artist=1)
+    size, k = reranking.pool_size(5), 5
+    seed_idx = np.asarray(seeds[:10])
+    top_idx = np.stack([state.searcher.search(features[i], size, exclude=i)[0] for i in seed_idx])
+    top_idx[1, -4:] = -1
+
+    batch = reranking.apply_batch(catalog, features, state.track_rows, seed_idx, top_idx, k)
+    for i, top, chosen in zip(seed_idx, top_idx, batch):
+        top = top[top >= 0]
+        sims = pool_similarities(features, np.concatenate([[i], top])[None, :])[0, 0, 1:]
+        rows, _, _ = reranking.apply(catalog, state.track_rows[i], state.track_rows[top], sims, features, top, k)
+        assert state.track_rows[chosen[chosen >= 0]].tolist() == rows.tolist()
+
+
+def test_service_caps_hold(tracks, service, seeds):
+    artists = service.state.df['artists']
+    for row in seeds[:5]:
+        track_id = tracks['track_id'].iat[row]
+        payload, status = service.recommend_full(track_id=track_id, k=10, same_genre=False, diversity=0.3,
+                                                 max_per_artist=1)
+        assert status == 200 and len(payload['recommendations']) == 10
+        chosen = [rec['track_id'] for rec in payload['recommendations']]
+        assert artists[service.state.df['track_id'].isin(chosen)].value_counts().max() == 1
+        assert payload['reranking']['max_per_artist'] == 1
+        assert set(payload['reranking']) >= {'before', 'after', 'pool'}
+
+
+def test_service_without_reranking_is_unchanged(tracks, service, seeds):
+    track_id = tracks['track_id'].iat[seeds[7]]
+    plain, _ = service.recommend_full(track_id=track_id, k=6)
+    zero, _ = service.recommend_full(track_id=track_id, k=6, diversity=0.0)
+    assert zero == plain and 'reranking' not in zero
+
+
+@pytest.mark.parametrize('query', ['diversity=2', 'max_per_artist=0', 'max_per_album=-1'])
+def test_routes_reject_bad_options(client, query):
+    assert client.get(f'/songs/recommend_full?track_id=track00001&{query}').status_code == 400
+    assert client.get(f'/songs/recommend?track_id=track00001&{query}').status_code == 400
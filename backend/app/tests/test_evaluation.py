@@ -0,0 +1,89 @@
+"""
+Vectorized batch evaluation against a seed-by-seed loop.
+"""
+import sys
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from scripts import evaluation, recommender
+from scripts.ann import AnnSearcher
+from scripts.scoring import normalize_rows
+
+K = 5
+
+
+@pytest.fixture
+def loaded(tracks, catalog, monkeypatch):
+    values = tracks[['danceability', 'energy', 'loudness', 'tempo', 'valence']].to_numpy(dtype=float)
+    features = normalize_rows((values - values.mean(axis=0)) / values.std(axis=0))
+    state = SimpleNamespace(feature_matrix=features, searcher=AnnSearcher(features), catalog=catalog,
+                            track_rows=np.arange(len(tracks)))
+    monkeypatch.setattr(recommender, 'state', state)
+    return state
+
+
+def test_quality_metrics():
+    genres = np.array([0, 0, 1, 1, 0])
+    artists = np.array([7, 8, 7, 9, 7])
+    top = np.array([[1, 2, 3], [0, 4, -1], [-1, -1, -1]])
+    relevance, diversity, n_recs = evaluation.quality_metrics([0, 2, 4], top, genres, artists)
+    np.testing.assert_allclose(relevance, [1 / 3, 0, 0])
+    np.testing.assert_allclose(diversity, [2 / 3, 0, 0])
+    np.testing.assert_array_equal(n_recs, [3, 2, 0])
+
+
+@pytest.mark.parametrize('n_jobs, block_size', [(1, 7), (1, 1024), (2, 7)])
+def test_top_k_for_seeds_matches_single_queries(loaded, seeds, n_jobs, block_size):
+    top = evaluation.top_k_for_seeds(seeds, k=K, block_size=block_size, n_jobs=n_jobs)
+    for row, result in zip(seeds, top):
+        expected, _ = loaded.searcher.search(loaded.feature_matrix[row], K, exclude=row)
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_run_batch_evals_matches_a_loop(tracks, loaded):
+    results = evaluation.run_batch_evals(n_songs=50, seed=3, k=K)
+    seed_idx = np.random.default_rng(3).choice(len(tracks), 50, replace=False)
+    genres, artists = tracks['track_genre'].to_numpy(), tracks['artists'].to_numpy()
+    relevance, diversity = [], []
+    for row in seed_idx:
+        rows, _ = loaded.searcher.search(loaded.feature_matrix[row], K, exclude=row)
+        relevance.append(np.mean(genres[rows] == genres[row]))
+        diversity.append(np.mean(artists[rows] != artists[row]))
+
+    assert results['total_songs_tested'] == 50 and results['failed_runs'] == 0 and results['seed'] == 3
+    assert results['average_genre_relevance'] == round(float(np.mean(relevance)), 4)
+    assert results['average_artist_diversity'] == round(float(np.mean(diversity)), 4)
+    per_genre = results['per_genre']
+    assert sum(g['songs_tested'] for g in per_genre.values()) == 50
+    for genre, stats in per_genre.items():
+        mask = genres[seed_idx] == genre
+        assert stats['songs_tested'] == mask.sum()
+        assert stats['average_genre_relevance'] == round(float(np.mean(np.array(relevance)[mask])), 4)
+
+
+def test_ann_evals_report_recall(loaded):
+    results = evaluation.run_batch_evals(n_songs=20, seed=0, k=K, engine='ivf')
+    assert results['engine'] == 'ivf' and 0.5 <= results['average_recall'] <= 1
+
+
+@pytest.mark.parametrize('query', ['n=0', f'n={evaluation.MAX_EVAL_SONGS + 1}', 'n=5&k=0',
+                                   f'n=5&k={evaluation.MAX_EVAL_K + 1}'])
+def test_route_bounds(client, query):
+    assert client.get(f'/evaluate_model?{query}').status_code == 400
+
+
+def test_route_scores_in_process(client, monkeypatch):
+    calls = []
+    run_batch_evals = evaluation.run_batch_evals
+
+    def spy(*args, **kwargs):
+        calls.append(kwargs)
+        return run_batch_evals(*args, **kwargs)
+
+    monkeypatch.setattr(sys.modules['app'], 'run_batch_evals', spy)
+    assert client.get('/evaluate_model?n=5&n_jobs=4').status_code == 200
+    assert 'n_jobs' not in calls[0]
+
+    # all=true only within the cap
+    monkeypatch.setattr(sys.modules['app'], 'MAX_EVAL_SONGS', 100)
+    assert client.get('/evaluate_model?all=true').status_code == 400
@@ -0,0 +1,157 @@
+"""
+The precomputed feature store against the per-request StandardScaler it
+replaces.
+"""
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import StandardScaler
+from scripts.feature_store import FeatureStore, FEATURE_COLS
+
+K = 10
+
+
+@pytest.fixture(scope='module')
+def store(catalog):
+    return FeatureStore(catalog)
+
+
+def standard_scaler_top_k(df, row, k, same_genre, fit_on='candidates'):
+    """
+    /recommend_full as it used to be: a StandardScaler fit on the candidates
+    (the genre, or everything, minus the target) and cosine similarities.
+    fit_on='partition' fits on the whole genre (or catalog) instead.
+    """
+    target = df.iloc[row]
+    partition = np.ones(len(df), dtype=bool)
+    if same_genre:
+        partition &= df['track_genre'].to_numpy() == target['track_genre']
+    candidates = np.flatnonzero(partition & (df['track_id'].to_numpy() != target['track_id']))
+
+    values = df[FEATURE_COLS].to_numpy(dtype=float)
+    scaler = StandardScaler().fit(values[candidates] if fit_on == 'candidates' else values[partition])
+    sims = cosine_similarity(scaler.transform(values[[row]]), scaler.transform(values[candidates]))[0]
+    top = np.argsort(-sims, kind='stable')[:k]
+    return candidates[top], sims[top]
+
+
+@pytest.mark.parametrize('same_genre', [True, False])
+def test_exact_scaling_matches_standard_scaler(tracks, store, seeds, same_genre):
+    for row in seeds[:10]:
+        rows, sims = store.recommend(row, k=K, same_genre=same_genre, scaling='exact')
+        expected_rows, expected_sims = standard_scaler_top_k(tracks, row, K, same_genre)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(sims, expected_sims, atol=1e-6)
+
+
+@pytest.mark.parametrize('scaling, same_genre', [('global', False), ('genre', True), ('auto', True),
+                                                 ('auto', False)])
+def test_precomputed_scaling_matches_standard_scaler(tracks, store, seeds, scaling, same_genre):
+    for row in seeds[:10]:
+        rows, sims = store.recommend(row, k=K, same_genre=same_genre, scaling=scaling)
+        expected_rows, expected_sims = standard_scaler_top_k(tracks, row, K, same_genre, fit_on='partition')
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(sims, expected_sims, atol=1e-5)
+
+
+def test_same_genre_stays_in_genre(tracks, store, seeds):
+    genres = tracks['track_genre'].to_numpy()
+    for row in seeds:
+        rows, _ = store.recommend(row, k=K, same_genre=True)
+        assert row not in rows
+        assert (genres[rows] == genres[row]).all()
+
+
+def test_unknown_scaling(store):
+    with pytest.raises(ValueError):
+        store.recommend(0, scaling='minmax')
+
+
+@pytest.mark.parametrize('scaling, same_genre', [('auto', True), ('auto', False), ('global', True),
+                                                 ('genre', False), ('exact', True)])
+def test_batch_matches_single_seed(store, seeds, scaling, same_genre):
+    # a duplicated seed gets the same answer twice
+    rows = seeds + seeds[:3]
+    results = store.recommend_batch(rows, k=K, same_genre=same_genre, scaling=scaling)
+    assert len(results) == len(rows)
+    for row, (batch_rows, batch_sims) in zip(rows, results):
+        single_rows, single_sims = store.recommend(row, k=K, same_genre=same_genre, scaling=scaling)
+        np.testing.assert_array_equal(batch_rows, single_rows)
+        np.testing.assert_allclose(batch_sims, single_sims, atol=1e-6)
+
+
+@pytest.mark.parametrize('same_genre', [True, False])
+def test_centroid(tracks, store, seeds, same_genre):
+    rows, sims = store.recommend_centroid(seeds[:5], k=K, same_genre=same_genre, scaling='global')
+    assert len(rows) == K and not set(rows.tolist()) & set(seeds[:5])
+    assert (np.diff(sims) <= 1e-12).all()
+    if same_genre:
+        genres = set(tracks['track_genre'].iloc[seeds[:5]])
+        assert set(tracks['track_genre'].iloc[rows]) <= genres
+
+    # a single seed's centroid is the seed itself
+    single_rows, _ = store.recommend(seeds[0], k=K, same_genre=same_genre, scaling='global')
+    centroid_rows, _ = store.recommend_centroid([seeds[0]], k=K, same_genre=same_genre, scaling='global')
+    np.testing.assert_array_equal(centroid_rows, single_rows)
+
+
+def brute_force(store, row, k, genres=None):
+    """
+    Top-k catalog rows by global_features over every row (or the given genres).
+    """
+    features = store.global_features
+    sims = features @ features[store.position[row]]
+    candidates = np.ones(len(sims), dtype=bool)
+    if genres is not None:
+        candidates &= np.isin(store.catalog.df['track_genre'].to_numpy()[store.order], genres)
+    candidates[store.position[row]] = False
+    positions = np.flatnonzero(candidates)
+    best = positions[np.lexsort((positions, -sims[positions]))[:k]]
+    return store.order[best], sims[best]
+
+
+def test_pruning_skips_rows(store, seeds, monkeypatch):
+    # the synthetic genres cluster, so the partition bounds rule some out
+    scored = []
+    top_k_at = store._top_k_at
+
+    def spy(query, positions, k, excluded):
+        scored.append(len(store.order) if isinstance(positions, slice) else len(positions))
+        return top_k_at(query, positions, k, excluded)
+
+    monkeypatch.setattr(store, '_top_k_at', spy)
+    totals = []
+    for row in seeds:
+        scored.clear()
+        store.recommend(row, k=K, same_genre=False, scaling='global')
+        totals.append(sum(scored))
+    assert min(totals) < len(store.order)
+
+
+@pytest.mark.parametrize('k', [1, 10, 200])
+def test_pruned_cross_genre_matches_brute_force(store, seeds, k):
+    for row in seeds:
+        rows, sims = store.recommend(row, k=k, same_genre=False, scaling='global')
+        expected_rows, expected_sims = brute_force(store, row, k)
+        np.testing.assert_allclose(sims, expected_sims, atol=1e-6)
+        np.testing.assert_array_equal(rows, expected_rows)
+
+
+def test_genre_filter_matches_brute_force(tracks, store, seeds):
+    for row in seeds[:10]:
+        genres = ['jazz', 'metal', 'no-such-genre']
+        rows, sims = store.recommend(row, k=K, genres=genres, scaling='global')
+        expected_rows, expected_sims = brute_force(store, row, K, genres=genres)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(sims, expected_sims, atol=1e-6)
+
+        rows, _ = store.recommend(row, k=K, genres=['folk'], scaling='genre')
+        assert row not in rows and (tracks['track_genre'].iloc[rows] == 'folk').all()
+    assert len(store.recommend(seeds[0], k=K, genres=[])[0]) == 0
+
+
+def test_nearby_genres(store):
+    nearby = store.nearby_genres('jazz', 3)
+    assert nearby[0] == 'jazz' and len(set(nearby)) == 4
+    assert store.nearby_genres('jazz', 100)[1:4] == nearby[1:]
+    assert store.nearby_genres('no-such-genre', 3) == ['no-such-genre']
@@ -0,0 +1,194 @@
+"""
+Catalog upserts, the incrementally updated indexes, and POST /songs/ingest.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.feature_store import FeatureStore
+from scripts.lookup import TrackLookup
+from scripts.search_index import SearchIndex
+
+# only the required columns
+NEW_TRACK = {"track_id": "ingested1", "track_name": "Ingested", "artists": "Artist 1", "track_genre": "jazz",
+             "danceability": 0.5, "energy": 0.5, "loudness": -6.0, "tempo": 120.0, "valence": 0.5}
+INTEGER_COLS = ['popularity', 'duration_ms', 'key', 'mode', 'time_signature']
+
+
+def post(client, *records):
+    return client.post('/songs/ingest', data='\n'.join(json.dumps(record) for record in records),
+                       headers={"Authorization": f"Bearer {os.environ['INGEST_TOKEN']}"})
+
+
+@pytest.fixture(scope='module')
+def upserted(catalog):
+    records = [{"track_id": "track00001", "popularity": 42, "track_name": "Renamed"},
+               NEW_TRACK,
+               # same id in another genre: a second row for it
+               dict(NEW_TRACK, track_genre="newgenre", danceability=0.9)]
+    return catalog.upsert(records, source='batch1')
+
+
+def test_upsert_updates_and_appends(tracks, catalog, upserted):
+    new, updated, appended = upserted
+    n = len(tracks)
+    assert updated == [1] and appended == [n, n + 1] and len(new) == n + 2
+    df = new.df
+    assert df['popularity'].iat[1] == 42 and df['track_search'].iat[1] == f"Renamed - {tracks['artists'].iat[1]}"
+    assert df['track_search'].iat[n] == "Ingested - Artist 1"
+    np.testing.assert_array_equal(new.rows_for_id('ingested1'), [n, n + 1])
+    assert [new.genre_of(n), new.genre_of(n + 1)] == ['jazz', 'newgenre']
+    assert new.version != catalog.version and new.source == 'batch1'
+
+    # the old catalog is untouched
+    assert len(catalog) == n and catalog.df['track_name'].iat[1] == tracks['track_name'].iat[1]
+    assert catalog.row_for_id('ingested1') is None
+
+
+def test_patched_indexes_match_fresh_builds(tracks, catalog, upserted):
+    new, updated, appended = upserted
+    fresh = TrackLookup(new.df)
+    for query in [{"track_id": "ingested1"}, {"track_id": "track00001"}, {"track_name": "renamed"},
+                  {"track_name": "song 1"}, {"track_search": "Ingested - Artist 1"}, {"track_name": "ingested"}]:
+        np.testing.assert_array_equal(new.lookup.find(**query), fresh.find(**query))
+
+    patched = SearchIndex(tracks).updated(new.df, updated + appended)
+    fresh = SearchIndex(new.df)
+    for query in ['ingested', 'renamed', 'song 1', 'artist 1', 'ing']:
+        for got, expected in zip(patched.search(query, limit=50), fresh.search(query, limit=50)):
+            np.testing.assert_array_equal(got, expected)
+
+
+def test_feature_store_update_keeps_unchanged_vectors(tracks, catalog, upserted):
+    new, updated, appended = upserted
+    store = FeatureStore(catalog)
+    patched = store.updated(new, updated + appended)
+    unchanged = np.setdiff1d(np.arange(len(tracks)), updated)
+    for features in ['global_features', 'genre_features']:
+        np.testing.assert_array_equal(getattr(patched, features)[patched.position[unchanged]],
+                                      getattr(store, features)[store.position[unchanged]])
+
+    genres = new.df['track_genre'].to_numpy()
+    jazz, only_one = appended
+    rows, _ = patched.recommend(jazz, k=5)
+    assert len(rows) == 5 and jazz not in rows and (genres[rows] == 'jazz').all()
+    # alone in its genre: nothing within it, but the whole catalog still works
+    assert len(patched.recommend(only_one, k=5)[0]) == 0
+    rows, _ = patched.recommend(only_one, k=5, same_genre=False)
+    assert len(rows) == 5 and not set(rows.tolist()) & set(appended)
+
+
+def test_ingest_endpoint(client):
+    from scripts import service
+    version = service.state.catalog.version
+    response = post(client, dict(NEW_TRACK, track_id="posted1", track_name="Posted Track"))
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["appended"] == 1 and response.get_json()["version"] != version
+
+    assert client.get('/songs/details/posted1').status_code == 200
+    results = client.get('/songs/search?q=posted+track').get_json()['results']
+    assert [r['track_id'] for r in results] == ['posted1']
+    recs = client.get('/songs/recommend_full?track_id=posted1').get_json()['recommendations']
+    assert len(recs) == 5 and 'posted1' not in [r['track_id'] for r in recs]
+    assert client.get('/songs/ingest_stats').status_code == 200
+
+
+@pytest.mark.parametrize('body', ['', 'not json', '[1]', json.dumps({"track_name": "no id"}),
+                                  json.dumps({"track_id": "x", "bogus": 1}),
+                                  json.dumps({"track_id": "x", "energy": "high"}),
+                                  json.dumps({"track_id": "brand-new", "track_name": "Missing features"})])
+def test_bad_batches_are_rejected(client, body):
+    from scripts import service
+    version = service.state.catalog.version
+    response = client.post('/songs/ingest', data=body,
+                           headers={"Authorization": f"Bearer {os.environ['INGEST_TOKEN']}"})
+    assert response.status_code == 400 and 'error' in response.get_json()
+    assert service.state.catalog.version == version
+
+
+def test_integer_columns_stay_integer(client):
+    from scripts import service
+    response = post(client, dict(NEW_TRACK, track_id="no-ints", energy=0.3), {"track_id": "track00002", "popularity": 42})
+    assert response.status_code == 200
+    assert response.get_json()["appended"] == 1 and response.get_json()["updated"] == 1
+
+    df = service.state.df
+    for column in INTEGER_COLS:
+        assert pd.api.types.is_integer_dtype(df[column].dtype), column
+
+    details = client.get('/songs/details/no-ints').get_json()
+    assert all(details[column] is None for column in INTEGER_COLS)
+    details = client.get('/songs/details/track00002').get_json()
+    assert details["popularity"] == 42 and isinstance(details["popularity"], int)
+    assert isinstance(details["duration_ms"], int)
+
+
+@pytest.mark.parametrize('values, error', [
+    ({"popularity": 101}, "'popularity' must be between 0 and 100"),
+    ({"popularity": 1.5}, "invalid value for 'popularity'"),
+    ({"popularity": 10 ** 12}, "'popularity' must be between 0 and 100"),
+    ({"key": 12}, "'key' must be between -1 and 11"),
+    ({"loudness": -61.0}, "'loudness' must be between -60 and 10"),
+    ({"tempo": -1.0}, "'tempo' must be between 0 and any"),
+    ({"energy": float('inf')}, "invalid value for 'energy'"),
+    ({"explicit": 1}, "invalid value for 'explicit'"),
+])
+def test_invalid_values_are_rejected(client, values, error):
+    from scripts import service
+    version = service.state.catalog.version
+    response = post(client, dict(NEW_TRACK, track_id="rejected", **values))
+    assert response.status_code == 400
+    assert error in response.get_json()["error"]
+    assert service.state.catalog.version == version
+    assert client.get('/songs/details/rejected').status_code == 404
+
+
+def test_bad_journal_lines_are_skipped(client):
+    from scripts import ingest
+    updater = ingest.updater
+    skipped = updater.stats["skipped"]
+    good = dict(NEW_TRACK, track_id="journaled", track_name="Journaled", energy=0.7)
+    with open(ingest.journal_path(), 'a') as f:
+        f.write('not json\n[1, 2]\n{"a": 1}\n' + json.dumps([good]) + '\n')
+
+    updater.sync()
+    # every bad line is counted and replay carries on past it
+    assert updater.stats["skipped"] == skipped + 3
+    assert client.get('/songs/details/journaled').status_code == 200
+    assert updater.info()["journal_bytes"] == os.path.getsize(ingest.journal_path())
+
+
+def test_compaction_changes_the_version(client):
+    from scripts import ingest, service
+    before = service.state.catalog
+    assert ingest.updater.compact(force=True)
+    after = service.state.catalog
+    assert after.version == hashlib.sha1(f"{before.source}\ncompact".encode('utf-8')).hexdigest()
+    assert after.df is before.df
+
+
+@pytest.mark.parametrize('headers', [{}, {"Authorization": "Bearer wrong"}, {"Authorization": "test-token"},
+                                     {"Authorization": "Basic test-token"}])
+def test_ingest_needs_the_token(client, headers):
+    response = client.post('/songs/ingest', data=json.dumps(dict(NEW_TRACK, track_id="unauthorized")),
+                           headers=headers)
+    assert response.status_code == 401 and response.headers['WWW-Authenticate'] == 'Bearer'
+    assert client.get('/songs/details/unauthorized').status_code == 404
+
+
+def test_ingest_is_off_without_a_token(client, monkeypatch):
+    from scripts import ingest
+    monkeypatch.setattr(ingest, 'INGEST_TOKEN', None)
+    assert post(client, dict(NEW_TRACK, track_id="disabled")).status_code == 403
+    assert client.get('/songs/details/disabled').status_code == 404
+
+
+def test_ingest_is_not_cross_origin(client):
+    origin = {"Origin": "https://example.com"}
+    for path in ('/songs/search?q=song', '/songs/ingest_stats'):
+        assert client.get(path, headers=origin).headers['Access-Control-Allow-Origin'] == origin["Origin"]
+    preflight = client.options('/songs/ingest', headers={**origin, "Access-Control-Request-Method": "POST"})
+    assert 'Access-Control-Allow-Origin' not in preflight.headers
+    assert 'Access-Control-Allow-Origin' not in post(client, {"track_id": "track00003"}).headers
@@ -0,0 +1,57 @@
+"""
+TrackLookup answers like the DataFrame scan it replaces.
+"""
+import numpy as np
+import pytest
+from scripts.lookup import TrackLookup
+
+
+def scan(df, track_id=None, track_search=None, track_name=None, artists=None):
+    """
+    The original search_in_dataframe filters, as row positions.
+    """
+    match = np.ones(len(df), dtype=bool)
+    if track_id:
+        match &= df['track_id'].astype(str).to_numpy() == str(track_id)
+    if track_search:
+        match &= (df['track_search'].str.lower() == track_search.lower()).to_numpy()
+    if track_name and artists:
+        match &= ((df['track_name'].str.lower() == track_name.lower()) &
+                  df['artists'].str.lower().str.contains(artists.lower(), na=False, regex=False)).to_numpy()
+    elif track_name:
+        match &= df['track_name'].str.lower().str.startswith(track_name.lower(), na=False).to_numpy()
+    return np.flatnonzero(match)
+
+
+@pytest.fixture(scope='module')
+def lookup(tracks):
+    return TrackLookup(tracks)
+
+
+@pytest.mark.parametrize('query', [
+    {"track_id": "track00007"},
+    {"track_id": "missing"},
+    {"track_search": "SONG 12 - artist 65"},
+    {"track_name": "song 1"},
+    {"track_name": "Canción"},
+    {"track_name": "song 12", "artists": "artist"},
+    {"track_name": "song 12", "artists": "nobody"},
+    {"track_id": "track00012", "track_name": "song"},
+    {},
+])
+def test_find_matches_the_scan(tracks, lookup, query):
+    np.testing.assert_array_equal(lookup.find(**query), scan(tracks, **query))
+
+
+def test_find_matches_every_title(tracks, lookup):
+    for row in range(0, len(tracks), 97):
+        title = tracks['track_search'].iat[row]
+        np.testing.assert_array_equal(lookup.find(track_search=title), scan(tracks, track_search=title))
+
+
+def test_categorical_columns(tracks):
+    df = tracks.astype({col: 'category' for col in ['track_id', 'track_name', 'artists', 'track_search']})
+    lookup = TrackLookup(df)
+    for query in [{"track_id": "track00007"}, {"track_name": "song 1"}, {"track_search": "SONG 12 - artist 65"},
+                  {"track_name": "song 12", "artists": "artist"}]:
+        np.testing.assert_array_equal(lookup.find(**query), scan(tracks, **query))
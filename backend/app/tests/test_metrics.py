@@ -0,0 +1,58 @@
+"""
+Stage histograms, the Prometheus export and per-request profiles.
+"""
+import pytest
+from scripts import metrics
+from scripts.metrics import Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_seconds', 'Test.', 'stage', buckets=(0.1, 1.0))
+    for seconds in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe('a"b', seconds)
+    assert histogram.render() == [
+        '# HELP test_seconds Test.', '# TYPE test_seconds histogram',
+        'test_seconds_bucket{stage="a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{stage="a\\"b",le="1.0"} 3',
+        'test_seconds_bucket{stage="a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{stage="a\\"b"} 2.65',
+        'test_seconds_count{stage="a\\"b"} 4',
+    ]
+
+
+def test_disabled_spans_are_shared_no_ops(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    assert metrics.span('a') is metrics.span('b')
+    monkeypatch.setattr(metrics, 'enabled', True)
+    with metrics.span('test.stage'):
+        pass
+    assert 'song_recommender_stage_seconds_count{stage="test.stage"} 1' in metrics.render()
+
+
+def test_metrics_endpoint(client):
+    client.get('/songs/search?q=song')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'song_recommender_request_seconds_count{route="/songs/search"}' in text
+    assert 'song_recommender_stage_seconds_count{stage="search.index"}' in text
+
+
+def test_profiled_request(client):
+    response = client.get('/songs/recommend_full?track_id=track00005&k=3&profile=1')
+    profile = response.get_json()['profile']
+    stages = [stage['stage'] for stage in profile['stages']]
+    assert 'service.resolve' in stages and 'serialize' in stages and profile['total_ms'] > 0
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('service.resolve;dur=') and 'total;dur=' in timing
+    assert 'profile' not in client.get('/songs/recommend_full?track_id=track00005&k=3').get_json()
+
+
+def test_sampling_profiler(client):
+    try:
+        assert client.post('/metrics/profiler', json={"rate": 1, "reset": True}).get_json()['rate'] == 1
+        client.get('/songs/search?q=song')
+        report = client.get('/metrics/profiler').get_data(as_text=True)
+        assert 'sampled requests' in report
+        assert client.get('/metrics/profiler?sort=bogus').status_code == 400
+    finally:
+        client.post('/metrics/profiler', json={"rate": 0, "reset": True})
+    assert client.post('/metrics/profiler', json={"rate": 2}).status_code == 400
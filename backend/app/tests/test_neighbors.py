@@ -0,0 +1,108 @@
+"""
+Precomputed neighbour tables answer like live scoring, before and after an
+ingest, and --csv keeps everything it builds next to its own CSV.
+"""
+import copy
+import os
+import numpy as np
+import pytest
+import database
+from scripts import neighbors, recommender
+from scripts.catalog import get_catalog
+from scripts.feature_store import FeatureStore
+from scripts.shared_arrays import shared_dir
+
+TABLE_K = 20
+# stored rows are re-scored at full precision
+SCORE_TOLERANCE = 1e-6
+
+
+@pytest.fixture(scope='module')
+def tables():
+    built = neighbors.build_tables(k=TABLE_K, n_jobs=1)
+    yield built
+    for path, _ in built.values():
+        os.remove(path)
+
+
+def test_use_csv_moves_the_caches(tmp_path, monkeypatch):
+    # restored after the test
+    monkeypatch.setattr(database, 'CSV_PATH', database.CSV_PATH)
+    monkeypatch.setattr(database, 'CACHE_DIR', database.CACHE_DIR)
+    database.use_csv(tmp_path / 'other.csv')
+    assert database.CSV_PATH == str(tmp_path / 'other.csv')
+    assert database.CACHE_DIR == str(tmp_path / '.tracks_cache')
+    assert shared_dir() == str(tmp_path / '.derived_cache')
+    assert neighbors.table_path('recommend') == str(tmp_path / 'other.recommend.neighbors')
+
+
+def live_copy(store):
+    live = copy.copy(store)
+    live.neighbors = {}
+    return live
+
+
+def assert_same_answers(store, live, rows, same_genre):
+    for row in rows:
+        for k in (1, 5, TABLE_K):
+            assert store.precomputed(row, k, same_genre) is not None
+            got_rows, sims = store.recommend(row, k=k, same_genre=same_genre)
+            live_rows, live_sims = live.recommend(row, k=k, same_genre=same_genre)
+            np.testing.assert_array_equal(got_rows, live_rows)
+            np.testing.assert_allclose(sims, live_sims, atol=SCORE_TOLERANCE)
+
+
+@pytest.mark.parametrize('same_genre', [True, False])
+def test_feature_store_table_matches_live(tables, seeds, same_genre):
+    store = FeatureStore(get_catalog())
+    assert same_genre in store.neighbors
+    assert_same_answers(store, live_copy(store), seeds, same_genre)
+    # more neighbours than stored are scored live
+    assert store.precomputed(seeds[0], TABLE_K + 1, same_genre) is None
+    assert store.precomputed(seeds[0], 5, same_genre, engine='ivf') is None
+
+    batch = store.recommend_batch(seeds, k=5, same_genre=same_genre)
+    for row, (rows, _) in zip(seeds, batch):
+        np.testing.assert_array_equal(rows, live_copy(store).recommend(row, k=5, same_genre=same_genre)[0])
+
+
+def test_recommender_table_matches_live(tables, seeds, monkeypatch):
+    catalog = get_catalog()
+    state = recommender.build_state(catalog)
+    assert state.neighbors is not None
+    live = copy.copy(state)
+    live.neighbors = None
+    for row in seeds:
+        title = catalog.title_of(row)
+        monkeypatch.setattr(recommender, 'state', state)
+        _, rows, sims = recommender.get_recommendation_rows(title, k=10)
+        monkeypatch.setattr(recommender, 'state', live)
+        _, live_rows, live_sims = recommender.get_recommendation_rows(title, k=10)
+        np.testing.assert_array_equal(rows, live_rows)
+        np.testing.assert_allclose(sims, live_sims, atol=SCORE_TOLERANCE)
+
+
+def test_pool_writes_the_same_records(tables):
+    path, _ = tables['recommend_full_all']
+    before = np.array(neighbors.NeighborTable.open('recommend_full_all', get_catalog()).records)
+    neighbors.build_tables(tables=('recommend_full_all',), k=TABLE_K, n_jobs=3)
+    after = neighbors.NeighborTable.open('recommend_full_all', get_catalog()).records
+    np.testing.assert_array_equal(after, before)
+
+
+def test_ingest_marks_affected_seeds_stale(tables, seeds):
+    catalog = get_catalog()
+    store = FeatureStore(catalog)
+    changed = seeds[0]
+    new_catalog, updated, _ = catalog.upsert([{"track_id": catalog.track_ids[changed], "energy": 0.99}],
+                                             source='stale-test')
+    new_store = store.updated(new_catalog, updated)
+    for same_genre in (True, False):
+        table = new_store.neighbors[same_genre]
+        assert table.stale[changed] and not table.stale.all()
+        # seeds listing the changed row are stale too
+        listed = (table.records['rows'] == changed).any(axis=1)
+        assert table.stale[listed].all()
+        fresh = [row for row in range(0, len(catalog), 7) if not table.stale[row]]
+        assert_same_answers(new_store, live_copy(new_store), fresh, same_genre)
+        assert new_store.precomputed(changed, 5, same_genre) is None
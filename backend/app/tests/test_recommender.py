@@ -0,0 +1,55 @@
+"""
+The /recommend engine against the dense MinMax + one-hot cosine matrix it
+was built on.
+"""
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import MinMaxScaler
+from scripts import recommender
+from scripts.scoring import top_k_similar
+
+K = 5
+
+
+@pytest.fixture(scope='module')
+def state(catalog):
+    return recommender.build_state(catalog)
+
+
+def dense_features(tracks):
+    numeric = MinMaxScaler().fit_transform(tracks[recommender.NUMERICAL_FEATURES].to_numpy(dtype=float))
+    return np.hstack([numeric, one_hot(tracks['track_genre'])])
+
+
+def one_hot(column):
+    names, codes = np.unique(column.to_numpy(), return_inverse=True)
+    return np.eye(len(names))[codes]
+
+
+def test_matches_dense_cosine(tracks, state, seeds, monkeypatch):
+    monkeypatch.setattr(recommender, 'state', state)
+    sims = cosine_similarity(dense_features(tracks)[seeds], dense_features(tracks))
+    for row, row_sims in zip(seeds, sims):
+        catalog, rows, scores = recommender.get_recommendation_rows(tracks['track_search'].iat[row], k=K)
+        row_sims[row] = -np.inf
+        expected = np.argsort(-row_sims, kind='stable')[:K]
+        np.testing.assert_allclose(scores, row_sims[expected], atol=1e-6)
+        np.testing.assert_array_equal(rows, expected)
+
+
+def test_compact_rows(state):
+    assert state.feature_matrix.nbytes / len(state.feature_matrix) < 40
+    dense = np.asarray(state.feature_matrix)
+    np.testing.assert_allclose(np.linalg.norm(dense, axis=1), 1, atol=1e-6)
+
+
+def test_batch_matches_single_queries(state, seeds):
+    features = state.feature_matrix
+    top, top_scores = top_k_similar(features, features[seeds], K, exclude=seeds)
+    for row, expected, expected_scores in zip(seeds, top, top_scores):
+        rows, scores = state.searcher.search(features[row], K, exclude=row)
+        np.testing.assert_array_equal(rows, expected)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+        rows, scores = state.searcher.search(features[row], K, exclude=row, engine='ivf')
+        np.testing.assert_allclose(scores, features[rows] @ features[row], atol=1e-6)
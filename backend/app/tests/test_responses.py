@@ -0,0 +1,64 @@
+"""
+responses.dumps writes what jsonify writes for the same payload.
+"""
+import json
+import numpy as np
+import pytest
+from flask import jsonify
+from scripts import responses
+
+
+def jsonify_text(app, payload):
+    with app.app_context():
+        return jsonify(responses.plain(payload)).get_data(as_text=True)
+
+
+@pytest.fixture(scope='module')
+def service(app):
+    from scripts import service
+    return service
+
+
+@pytest.fixture
+def payloads(service, seeds):
+    catalog = service.state.catalog
+    track_ids = [str(catalog.track_ids[row]) for row in seeds[:5]]
+    payloads = {
+        "recommend": service.recommend(track_id=track_ids[0]),
+        "recommend_full": service.recommend_full(track_id=track_ids[0], k=10),
+        "recommend_full_fields": service.recommend_full(track_id=track_ids[1], fields='all'),
+        "recommend_batch": service.recommend_batch(track_ids=track_ids + ['missing'], k=5),
+        "search": service.search('cancion', limit=10, fuzzy=True),
+        "details": service.song_details(track_ids[2]),
+    }
+    for name, (payload, status) in payloads.items():
+        assert status == 200, (name, payload)
+    assert len(payloads["search"][0]["results"]) > 0
+    return {name: payload for name, (payload, _) in payloads.items()}
+
+
+def test_dumps_matches_jsonify(app, payloads):
+    for name, payload in payloads.items():
+        assert responses.dumps(payload) + '\n' == jsonify_text(app, payload), name
+
+
+def test_dumps_numpy_values(app):
+    payload = {"b": np.float32(0.5), "a": [np.int64(3), None, np.bool_(True), "é"], "c": np.arange(3)}
+    assert responses.dumps(payload) + '\n' == jsonify_text(app, payload)
+
+
+def test_dumps_writes_nan_as_null():
+    assert json.loads(responses.dumps({"x": float('nan'), "y": [np.float32('inf')]})) == {"x": None, "y": [None]}
+
+
+def test_columns_layout(payloads):
+    payload = payloads["recommend_full"]
+    records = responses.plain(payload)["recommendations"]
+    columns = json.loads(responses.dumps(payload, layout='columns'))["recommendations"]
+    assert columns == {field: [record[field] for record in records] for field in records[0]}
+
+
+def test_route_body_matches_jsonify(app, client, payloads):
+    track_id = payloads["details"]["track_id"]
+    body = client.get(f'/songs/details/{track_id}').get_data(as_text=True)
+    assert body == jsonify_text(app, payloads["details"])
@@ -0,0 +1,86 @@
+"""
+ResultCache eviction, expiry and versioning, in memory and on disk.
+"""
+import pytest
+from scripts import result_cache
+from scripts.result_cache import ResultCache, _ENTRY_OVERHEAD
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, 'time', clock)
+    return clock
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResultCache(max_bytes=3 * (12 + _ENTRY_OVERHEAD), disk_dir=None)
+    for key in 'abc':
+        cache.put(key, key * 10)
+    assert cache.get('a') == 'a' * 10   # a is now the most recent
+    cache.put('d', 'd' * 10)
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in 'acd'] == [True, True, True]
+    assert cache.stats['evictions'] == 1
+
+    # payloads larger than the whole budget are not cached
+    cache.put('huge', 'x' * cache.max_bytes)
+    assert cache.get('huge') is None and cache.info()['entries'] == 3
+
+
+def test_ttl_expiry(clock):
+    cache = ResultCache(ttl=60, disk_dir=None)
+    cache.put('k', {'body': [1, 2]})
+    clock.now += 59
+    assert cache.get('k') == {'body': [1, 2]}
+    clock.now += 2
+    assert cache.get('k') is None
+    assert cache.stats['expirations'] == 1 and cache.info()['entries'] == 0
+
+
+def test_version_change_drops_entries():
+    version = ['v1']
+    cache = ResultCache(version=lambda: version[0], disk_dir=None)
+    cache.put('k', {'old': True})
+    assert cache.get('k') == {'old': True}
+    version[0] = 'v2'
+    assert cache.get('k') is None
+    assert cache.stats['invalidations'] == 1 and cache.info()['version'] == 'v2'
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    version = ['v1']
+    writer = ResultCache(version=lambda: version[0], disk_dir=str(tmp_path))
+    reader = ResultCache(version=lambda: version[0], disk_dir=str(tmp_path))
+    writer.put('k', {'body': [1, 2]})
+    assert reader.get('k') == {'body': [1, 2]} and reader.stats['disk_hits'] == 1
+    # promoted into the reader's memory tier
+    assert reader.get('k') == {'body': [1, 2]} and reader.stats['disk_hits'] == 1
+
+    version[0] = 'v2'
+    assert reader.get('k') is None
+    assert not list(tmp_path.rglob('*.tmp'))
+
+
+def test_disk_ttl(tmp_path, clock):
+    writer = ResultCache(disk_dir=str(tmp_path), ttl=60)
+    writer.put('k', {'body': [1, 2]})
+    path = next(tmp_path.rglob('*.json'))
+    clock.now = path.stat().st_mtime + 61
+    assert ResultCache(disk_dir=str(tmp_path), ttl=60).get('k') is None
+
+
+def test_disk_prune(tmp_path):
+    cache = ResultCache(disk_dir=str(tmp_path), disk_max_bytes=50)
+    for i in range(10):
+        cache.put(i, 'x' * 10)
+    cache._disk_prune()
+    assert sum(p.stat().st_size for p in tmp_path.rglob('*.json')) <= 50
@@ -0,0 +1,82 @@
+"""
+The streaming top-k search against a dense similarity matrix.
+"""
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from scripts.scoring import normalize_rows, top_k_indices, top_k_similar, CompactFeatures
+
+K = 10
+
+
+def features(tracks):
+    return normalize_rows(tracks[['danceability', 'energy', 'loudness', 'tempo', 'valence']].to_numpy(dtype=float))
+
+
+def dense_top_k(scores, k, exclude=None):
+    scores = np.array(scores, dtype=float)
+    if exclude is not None:
+        scores[exclude] = -np.inf
+    top = np.argsort(-scores, kind='stable')[:k]
+    return top[np.isfinite(scores[top])]
+
+
+def test_top_k_indices_matches_a_full_sort():
+    scores = np.random.default_rng(0).random(500)
+    np.testing.assert_array_equal(top_k_indices(scores, K), dense_top_k(scores, K))
+    np.testing.assert_array_equal(top_k_indices(scores, K, exclude=[3, 7]), dense_top_k(scores, K, [3, 7]))
+
+
+def test_top_k_indices_edge_cases():
+    # ties go to the lower index
+    np.testing.assert_array_equal(top_k_indices([0.5, 0.9, 0.5, 0.9], 3), [1, 3, 0])
+    np.testing.assert_array_equal(top_k_indices([0.1, 0.2], 5), [1, 0])
+    assert len(top_k_indices([0.1, 0.2], 5, exclude=[0, 1])) == 0
+    assert len(top_k_indices([0.1, 0.2], 0)) == 0
+
+
+@pytest.mark.parametrize('block_size', [7, 1024])
+def test_top_k_similar_matches_the_dense_matrix(tracks, seeds, block_size):
+    matrix = features(tracks)
+    dense = cosine_similarity(matrix[seeds], matrix)
+    top, scores = top_k_similar(matrix, matrix[seeds], K, exclude=seeds, block_size=block_size)
+    for i, seed in enumerate(seeds):
+        expected = dense_top_k(dense[i], K, seed)
+        np.testing.assert_array_equal(top[i], expected)
+        np.testing.assert_allclose(scores[i], dense[i][expected], atol=1e-9)
+
+
+def compact_and_dense(n=300, n_categories=6, seed=0):
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(n_categories, size=n).astype(np.int32)
+    dense = np.hstack([rng.random((n, 4)), np.eye(n_categories)[codes]])
+    dense = normalize_rows(dense)
+    compact = CompactFeatures.grouped(dense[:, :4].copy(), dense[np.arange(n), 4 + codes].copy(), codes,
+                                      n_categories)
+    return compact, dense
+
+
+def test_compact_features_behave_like_the_dense_matrix():
+    compact, dense = compact_and_dense()
+    assert compact.shape == dense.shape
+    np.testing.assert_allclose(np.asarray(compact), dense)
+    np.testing.assert_allclose(compact[17], dense[17])
+    for query in [dense[17], dense[40:45].T]:
+        np.testing.assert_allclose(compact @ query, dense @ query)
+
+    rows = np.array([5, 3, 250, 3])
+    subset = compact[rows]
+    np.testing.assert_allclose(np.asarray(subset), dense[rows])
+    np.testing.assert_allclose(subset @ dense[9], dense[rows] @ dense[9])
+    np.testing.assert_allclose(compact.similarities(subset), dense[rows] @ dense.T)
+    np.testing.assert_allclose(subset.similarities(compact[:50]), dense[:50] @ dense[rows].T)
+
+
+@pytest.mark.parametrize('block_size', [7, 1024])
+def test_top_k_similar_on_compact_features(block_size):
+    compact, dense = compact_and_dense()
+    seeds = np.arange(0, 300, 11)
+    top, scores = top_k_similar(compact, compact[seeds], K, exclude=seeds, block_size=block_size)
+    expected, expected_scores = top_k_similar(dense, dense[seeds], K, exclude=seeds)
+    np.testing.assert_array_equal(top, expected)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-12)
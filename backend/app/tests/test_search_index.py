@@ -0,0 +1,92 @@
+"""
+The trigram search index ranks like a scan of every row by tier, then
+popularity.
+"""
+import numpy as np
+import pytest
+from scripts.search_index import SearchIndex
+
+
+def ranked_scan(df, query):
+    """
+    Every matching row, ordered by SearchIndex's tiers (exact title, title
+    prefix, word prefix, title substring, artist, album), then popularity.
+    """
+    query = query.strip().lower()
+    ranked = []
+    for row, (name, artists, album) in enumerate(zip(df['track_name'].str.lower(), df['artists'].str.lower(),
+                                                     df['album_name'].str.lower())):
+        if name == query:
+            tier = 0
+        elif name.startswith(query):
+            tier = 1
+        elif f" {query}" in name:
+            tier = 2
+        elif query in name:
+            tier = 3
+        elif query in artists:
+            tier = 4
+        elif query in album:
+            tier = 5
+        else:
+            continue
+        ranked.append((tier, -df['popularity'].iat[row], row))
+    return [row for _, _, row in sorted(ranked)]
+
+
+@pytest.fixture(scope='module')
+def index(tracks):
+    return SearchIndex(tracks)
+
+
+@pytest.mark.parametrize('query', ['song 12', 'SONG 1', '12', '7', 'ón', 'artist 2', 'album 10', 'canción 100',
+                                   'nothing like this'])
+def test_search_matches_the_scan(tracks, index, query):
+    expected = ranked_scan(tracks, query)
+    for offset, limit in [(0, 20), (0, 1), (15, 30), (len(expected) - 1, 5)]:
+        offset = max(offset, 0)
+        rows, has_more = index.search(query, offset=offset, limit=limit)
+        assert rows.tolist() == expected[offset:offset + limit]
+        assert has_more == (len(expected) > offset + limit)
+
+
+def test_pages_cover_every_match(tracks, index):
+    expected = ranked_scan(tracks, 'son')
+    pages, offset, has_more = [], 0, True
+    while has_more:
+        rows, has_more = index.search('son', offset=offset, limit=100)
+        pages.extend(rows.tolist())
+        offset += 100
+    assert pages == expected
+
+
+def test_fuzzy_finds_typos(tracks, index):
+    assert len(index.search('cancoin 100')[0]) == 0
+    rows, _ = index.search('cancoin 100', fuzzy=True)
+    assert 100 in rows.tolist()
+
+
+SHORT_QUERIES = ['s', 'o', '1', '7', 'ó', 'so', 'g ', ' 1', '12', 'ón', '0 ', 'zz']
+
+
+@pytest.mark.parametrize('query', SHORT_QUERIES)
+def test_short_queries_match_the_scan(tracks, index, query):
+    expected = ranked_scan(tracks, query)
+    for offset, limit in [(0, 20), (30, 100), (max(len(expected) - 3, 0), 10)]:
+        rows, has_more = index.search(query, offset=offset, limit=limit)
+        assert rows.tolist() == expected[offset:offset + limit]
+        assert has_more == (len(expected) > offset + limit)
+
+
+def test_short_queries_find_every_value(tracks, index):
+    new = tracks.copy()
+    new.loc[len(new)] = new.iloc[0]
+    new.loc[len(new) - 1, ['track_name', 'artists']] = ['Qx Ünïcode', 'Ωmega']
+    updated = index.updated(new, [len(new) - 1])
+    for search_index in (index, updated):
+        for field in search_index.fields.values():
+            for query in SHORT_QUERIES + ['q', 'qx', 'ω', 'ï']:
+                expected = [vid for vid, value in enumerate(field.values) if query in value]
+                assert sorted(field.contains(query).tolist()) == expected
+    assert updated.search('qx')[0].tolist() == [len(new) - 1]
+    assert updated.search('ω')[0].tolist() == [len(new) - 1]
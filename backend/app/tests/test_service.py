@@ -0,0 +1,113 @@
+"""
+The service layer behind the JSON routes and the HTML pages.
+"""
+import pytest
+
+
+@pytest.fixture(scope='module')
+def service(app):
+    from scripts import service
+    return service
+
+
+def ids(records):
+    return [rec['track_id'] for rec in records]
+
+
+def test_recommend_full_matches_the_feature_store(tracks, service, seeds):
+    for row in seeds[:5]:
+        payload, status = service.recommend_full(track_id=tracks['track_id'].iat[row], k=7)
+        rows, sims = service.state.feature_store.recommend(row, k=7)
+        assert status == 200 and payload['input'] == tracks['track_search'].iat[row]
+        assert ids(payload['recommendations']) == tracks['track_id'].iloc[rows].tolist()
+        assert [rec['similarity'] for rec in payload['recommendations']] == pytest.approx(sims.tolist())
+
+
+def test_recommend_full_is_cached_per_track(tracks, service, seeds):
+    row = seeds[5]
+    first, _ = service.recommend_full(track_id=tracks['track_id'].iat[row], k=4, same_genre=False)
+    hits = service.result_cache.stats['hits']
+    by_title, _ = service.recommend_full(song=tracks['track_search'].iat[row], k=4, same_genre=False)
+    assert by_title == first and service.result_cache.stats['hits'] == hits + 1
+
+
+@pytest.mark.parametrize('kwargs, status', [({}, 400), ({'track_id': 'missing'}, 404),
+                                            ({'track_id': 'track00001', 'scaling': 'minmax'}, 400),
+                                            ({'track_id': 'track00001', 'engine': 'hnsw'}, 400)])
+def test_recommend_full_errors(service, kwargs, status):
+    payload, code = service.recommend_full(**kwargs)
+    assert code == status and 'error' in payload
+
+
+def test_batch_matches_recommend_full(tracks, service, seeds):
+    track_ids = tracks['track_id'].iloc[seeds[:6]].tolist()
+    payload, status = service.recommend_batch(track_ids=track_ids + ['missing'],
+                                              songs=[tracks['track_search'].iat[seeds[6]]], k=5)
+    assert status == 200 and payload['not_found'] == ['missing']
+    assert [result['seed'] for result in payload['results']] == track_ids + [tracks['track_search'].iat[seeds[6]]]
+    for row, result in zip(seeds, payload['results']):
+        single, _ = service.recommend_full(track_id=tracks['track_id'].iat[row], k=5)
+        assert ids(result['recommendations']) == ids(single['recommendations'])
+
+
+@pytest.mark.parametrize('kwargs', [{'track_ids': 'track00001'}, {}, {'track_ids': ['track00001'], 'k': -1},
+                                    {'track_ids': ['track00001'], 'k': True}, {'track_ids': ['track00001'], 'k': 101},
+                                    {'track_ids': ['track00001'], 'k': 5.0},
+                                    {'track_ids': ['track00001'], 'aggregate': 'sum'}])
+def test_batch_rejects_bad_input(service, kwargs):
+    assert service.recommend_batch(**kwargs)[1] == 400
+
+
+def test_batch_k_limit(service):
+    payload, status = service.recommend_batch(track_ids=['track00001'], k=service.MAX_EVAL_K)
+    assert status == 200 and len(payload['results'][0]['recommendations']) == service.MAX_EVAL_K
+
+
+def test_routes_and_pages_share_the_service(tracks, client, service):
+    track_id = tracks['track_id'].iat[10]
+    response = client.get(f'/songs/recommend_full?track_id={track_id}&k=3')
+    payload, _ = service.recommend_full(track_id=track_id, k=3)
+    assert response.status_code == 200 and ids(response.get_json()['recommendations']) == ids(payload['recommendations'])
+
+    page = client.get(f'/recommend?track_id={track_id}&k=3')
+    assert page.status_code == 200
+    for rec in payload['recommendations']:
+        assert rec['track_name'] in page.get_data(as_text=True)
+
+    search = client.get('/search?q=song+12')
+    assert search.status_code == 200 and 'Song 12' in search.get_data(as_text=True)
+
+
+def test_recommend_ids_come_from_the_scored_rows(tracks, service, seeds):
+    from scripts.recommender import get_recommendation_rows
+    for row in seeds[:5]:
+        title = tracks['track_search'].iat[row]
+        payload, status = service.recommend(song=title)
+        _, rows, _ = get_recommendation_rows(title)
+        assert status == 200 and ids(payload['recommendations']) == tracks['track_id'].iloc[rows].tolist()
+        assert list(payload['recommendations'][0]) == service.RECOMMENDATION_COLS
+
+
+def test_fields(tracks, service):
+    payload, _ = service.recommend_full(track_id='track00002', k=3, fields='track_id, similarity,track_id')
+    assert [list(rec) for rec in payload['recommendations']] == [['track_id', 'similarity']] * 3
+    payload, _ = service.recommend_full(track_id='track00002', k=3, fields='all')
+    assert list(payload['recommendations'][0]) == list(tracks.columns) + ['similarity']
+    payload, _ = service.recommend_batch(track_ids=['track00002'], k=3, fields=['popularity'])
+    assert list(payload['results'][0]['recommendations'][0]) == ['popularity']
+
+    for fields in ['bogus', [], [1], 'similarity,bogus']:
+        assert service.recommend_full(track_id='track00002', fields=fields)[1] == 400
+    assert service.recommend(song=tracks['track_search'].iat[2], fields='bogus')[1] == 400
+
+
+def test_genre_options(tracks, service):
+    payload, status = service.recommend_full(track_id='track00004', k=5, genres='jazz,folk')
+    assert status == 200 and payload['genres'] == ['jazz', 'folk']
+    assert set(tracks.set_index('track_id').loc[ids(payload['recommendations']), 'track_genre']) <= {'jazz', 'folk'}
+
+    payload, _ = service.recommend_full(track_id='track00004', k=5, nearby_genres=2)
+    assert payload['genres'][0] == tracks['track_genre'].iat[4] and len(payload['genres']) == 3
+
+    for kwargs in [{'genres': 'jazz', 'nearby_genres': 1}, {'nearby_genres': -1}, {'nearby_genres': '2'}]:
+        assert service.recommend_full(track_id='track00004', **kwargs)[1] == 400
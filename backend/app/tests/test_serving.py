@@ -0,0 +1,80 @@
+"""
+MicroBatcher batching and backpressure, and batched scoring in the service.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from scripts.serving import MicroBatcher, Overloaded
+
+
+def test_requests_in_one_window_share_a_batch():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(workers=2, window_ms=200, max_batch=4)
+    with ThreadPoolExecutor(10) as pool:
+        results = list(pool.map(lambda i: batcher.submit('key', i, run_batch), range(10)))
+    assert results == [i * 2 for i in range(10)]
+    assert sorted(sum(batches, [])) == list(range(10))
+    assert max(len(batch) for batch in batches) == 4 and len(batches) < 10
+    assert batcher.info()['outstanding'] == 0
+
+
+def test_full_queue_is_rejected():
+    release = threading.Event()
+    batcher = MicroBatcher(workers=1, window_ms=0, max_queue=2, retry_after=7)
+    with ThreadPoolExecutor(2) as pool:
+        blocked = [pool.submit(batcher.run, release.wait) for _ in range(2)]
+        while batcher.info()['outstanding'] < 2:
+            time.sleep(0.01)
+        with pytest.raises(Overloaded) as error:
+            batcher.run(len, [])
+        assert error.value.retry_after == 7 and batcher.stats['rejected'] == 1
+
+        release.set()
+        assert [future.result() for future in blocked] == [True, True]
+    # room again once the work drains
+    assert batcher.run(len, [1, 2]) == 2
+
+
+def test_errors_reach_every_caller():
+    def run_batch(items):
+        raise RuntimeError('boom')
+
+    batcher = MicroBatcher(workers=1, window_ms=50)
+    with ThreadPoolExecutor(3) as pool:
+        futures = [pool.submit(batcher.submit, 'key', i, run_batch) for i in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert batcher.info()['outstanding'] == 0
+
+
+def test_batched_scoring_matches_inline(app, tracks, seeds, monkeypatch):
+    from scripts import service
+    monkeypatch.setattr(service, 'batcher', MicroBatcher(workers=2, window_ms=50))
+    requests = [(row, k) for row, k in zip(seeds[:12], [1, 5, 10] * 4)]
+    with ThreadPoolExecutor(len(requests)) as pool:
+        results = list(pool.map(lambda r: service._score_full(service.state.feature_store, r[0], r[1], True, 'auto', 'exact', None), requests))
+    for (row, k), (rows, sims) in zip(requests, results):
+        expected_rows, expected_sims = service.state.feature_store.recommend(row, k=k)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(sims, expected_sims, atol=1e-6)
+    assert service.batcher.stats['max_batch_seen'] > 1
+
+
+def test_overload_is_a_503(client, monkeypatch):
+    from scripts import service
+
+    class Busy:
+        def submit(self, *args, **kwargs):
+            raise Overloaded(3)
+
+    monkeypatch.setattr(service, 'batcher', Busy())
+    response = client.get('/songs/recommend_full?track_id=track00003&k=9&same_genre=false')
+    assert response.status_code == 503 and response.headers['Retry-After'] == '3'
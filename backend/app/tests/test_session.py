@@ -0,0 +1,102 @@
+"""
+Taste sessions: incremental updates of the decayed mean, and POST /songs/session.
+"""
+import numpy as np
+import pytest
+from scripts.session import TasteSession
+
+VECTORS = {f"t{i}": np.random.default_rng(i).normal(size=5) for i in range(4)}
+
+
+def decayed_mean(track_ids, decay):
+    """
+    Mean of the vectors, newest (last) weighted 1, the one before decay, ...
+    """
+    weights = decay ** np.arange(len(track_ids))[::-1]
+    return sum(w * VECTORS[t] for w, t in zip(weights, track_ids)) / weights.sum()
+
+
+def test_updates_match_the_decayed_mean():
+    session = TasteSession(decay=0.8, vector=np.zeros(5))
+    for track_id in ['t0', 't1', 't2', 't3']:
+        session.add(track_id, VECTORS[track_id], 'jazz')
+    np.testing.assert_allclose(session.taste(), decayed_mean(['t0', 't1', 't2', 't3'], 0.8))
+
+    # removing keeps the others' weights; adding again makes it the newest
+    session.remove('t1', VECTORS['t1'], 'jazz')
+    weights = 0.8 ** np.array([3, 1, 0])
+    expected = (weights[:, None] * np.array([VECTORS['t0'], VECTORS['t2'], VECTORS['t3']])).sum(0) / weights.sum()
+    np.testing.assert_allclose(session.taste(), expected)
+    session.add('t0', VECTORS['t0'], 'jazz')
+    assert list(session.tracks) == ['t2', 't3', 't0'] and session.genres == {'jazz': 3}
+
+    for track_id in ['t2', 't3', 't0']:
+        session.remove(track_id, VECTORS[track_id], 'jazz')
+    assert len(session) == 0 and session.genres == {} and not session.taste().any()
+
+
+def test_round_trip():
+    session = TasteSession(decay=0.5, vector=np.zeros(5))
+    session.add('t0', VECTORS['t0'], 'jazz')
+    session.mark_played('t3')
+    restored = TasteSession.from_dict(session.to_dict(), 5)
+    assert restored.to_dict() == session.to_dict()
+    np.testing.assert_allclose(restored.taste(), session.taste())
+
+
+@pytest.mark.parametrize('data', ['session', {}, {'decay': 0.9, 'vector': [0] * 4, 'weight': 0, 'step': 0,
+                                                   'tracks': {}},
+                                  {'decay': 2, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {}},
+                                  {'decay': 0.9, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {'a': 'x'}},
+                                  {'decay': 0.9, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {'a': True}},
+                                  {'decay': 0.9, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {},
+                                   'genres': {'jazz': 'x'}},
+                                  {'decay': 0.9, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {},
+                                   'genres': {'jazz': 1.5}},
+                                  {'decay': 0.9, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {},
+                                   'genres': {'jazz': 0}},
+                                  {'decay': 0.9, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {},
+                                   'genres': {'jazz': True}},
+                                  {'decay': 0.9, 'vector': [0] * 5, 'weight': 0, 'step': 0, 'tracks': {},
+                                   'genres': ['jazz']}])
+def test_foreign_state_is_rejected(data):
+    with pytest.raises(ValueError):
+        TasteSession.from_dict(data, 5)
+
+
+def test_session_endpoint(tracks, client):
+    from scripts import service
+    store, df = service.state.feature_store, service.state.df
+    first = tracks['track_id'].iloc[[10, 11]].tolist()
+    response = client.post('/songs/session', json={"add": first, "played": ["track00012"], "k": 8})
+    payload = response.get_json()
+    assert response.status_code == 200 and payload['size'] == 2
+    recommended = [rec['track_id'] for rec in payload['recommendations']]
+    assert len(recommended) == 8 and not set(recommended) & set(first + ["track00012"])
+
+    taste = TasteSession.from_dict(payload['session'], 5).taste()
+    rows, _ = store.recommend_vector(taste, k=8, exclude_rows=[10, 11, 12])
+    assert recommended == df['track_id'].iloc[rows].tolist()
+
+    # the returned session continues where it left off
+    response = client.post('/songs/session', json={"session": payload['session'], "remove": [first[0]],
+                                                   "add": ["missing"], "k": 5, "same_genre": True})
+    payload = response.get_json()
+    assert payload['size'] == 1 and payload['not_found'] == ['missing']
+    rows = [service.state.catalog.row_for_id(rec['track_id']) for rec in payload['recommendations']]
+    genres = set(df['track_genre'].iloc[rows])
+    assert genres == {tracks['track_genre'].iat[11]}
+
+
+@pytest.mark.parametrize('body', [{"add": "track00001"}, {"add": [True]}, {"k": -1}, {"k": True}, {"k": 101},
+                                  {"decay": 0}, {"session": {"vector": []}}, {"genres": "jazz", "same_genre": True}])
+def test_session_endpoint_rejects_bad_input(client, body):
+    assert client.post('/songs/session', json=body).status_code == 400
+
+
+@pytest.mark.parametrize('genres', [{"jazz": "x"}, {"jazz": None}, {"jazz": [1]}])
+def test_tampered_genre_counts_are_a_400(client, genres):
+    session = client.post('/songs/session', json={"add": ["track00010"]}).get_json()['session']
+    session['genres'] = genres
+    response = client.post('/songs/session', json={"session": session, "add": ["track00011"], "same_genre": True})
+    assert response.status_code == 400
@@ -0,0 +1,114 @@
+"""
+Derived arrays are built once per version and memory-mapped by every process.
+"""
+import multiprocessing
+import os
+import numpy as np
+import pytest
+import database
+from scripts import shared_arrays
+from scripts.serving import MicroBatcher
+
+fork = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'CACHE_DIR', str(tmp_path / '.tracks_cache'))
+    return tmp_path / '.derived_cache'
+
+
+class Builder:
+    def __init__(self, scale=1):
+        self.calls = 0
+        self.scale = scale
+
+    def __call__(self):
+        self.calls += 1
+        return {'values': np.arange(10.0) * self.scale, 'order': np.arange(5)[::-1]}
+
+
+def test_built_once_per_version(cache_dir):
+    build = Builder()
+    first = shared_arrays.load_or_build('test', 'v1', build)
+    again = shared_arrays.load_or_build('test', 'v1', build)
+    assert build.calls == 1 and isinstance(again['values'], np.memmap)
+    np.testing.assert_array_equal(again['values'], np.arange(10.0))
+    np.testing.assert_array_equal(first['order'], [4, 3, 2, 1, 0])
+    assert not again['values'].flags.writeable
+
+    changed = shared_arrays.load_or_build('test', 'v2', Builder(scale=2))
+    np.testing.assert_array_equal(changed['values'], np.arange(10.0) * 2)
+    assert sorted(os.listdir(cache_dir / 'test')) == ['.lock', 'current']
+
+
+def test_unknown_version_is_not_saved(cache_dir):
+    arrays = shared_arrays.load_or_build('test', None, Builder())
+    assert not isinstance(arrays['values'], np.memmap) and not cache_dir.exists()
+
+
+def _child(queue):
+    build = Builder()
+    arrays = shared_arrays.load_or_build('test', 'v1', build)
+    queue.put((build.calls, float(arrays['values'].sum())))
+
+
+@fork
+def test_forked_workers_reuse_the_files(cache_dir):
+    shared_arrays.load_or_build('test', 'v1', Builder())
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    children = [context.Process(target=_child, args=(queue,)) for _ in range(3)]
+    for child in children:
+        child.start()
+    results = [queue.get(timeout=30) for _ in children]
+    for child in children:
+        child.join()
+    assert results == [(0, 45.0)] * 3
+
+
+def _use_batcher(batcher, queue):
+    queue.put(batcher.run(sum, [1, 2, 3]))
+
+
+@fork
+def test_batcher_restarts_after_fork():
+    batcher = MicroBatcher(workers=1, window_ms=0)
+    assert batcher.run(len, 'ab') == 2
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    child = context.Process(target=_use_batcher, args=(batcher, queue))
+    child.start()
+    assert queue.get(timeout=30) == 6
+    child.join()
+
+
+def test_allocated_arrays_are_written_in_place(cache_dir):
+    def build():
+        values = shared_arrays.allocate('values', (6, 2), np.float32)
+        for start in range(0, 6, 4):
+            values[start:start + 4] = start
+        return {'values': values}
+
+    arrays = shared_arrays.load_or_build('blocks', 'v1', build)
+    np.testing.assert_array_equal(arrays['values'][:, 0], [0, 0, 0, 0, 4, 4])
+    # outside load_or_build it is an ordinary array
+    assert type(shared_arrays.allocate('values', (2,), np.int8)) is np.ndarray
+
+
+def test_reloaded_catalogs_reuse_the_arrays(cache_dir, monkeypatch):
+    # every load of the same CSV (e.g. in another worker) has the same version
+    from scripts import feature_store, recommender
+    from scripts.catalog import Catalog
+    builds = []
+    for module, name in ((feature_store, '_build_arrays'), (recommender, '_build_features')):
+        build = getattr(module, name)
+        monkeypatch.setattr(module, name, lambda catalog, build=build, name=name: builds.append(name) or
+                            build(catalog))
+
+    first, second = Catalog(database.load_tracks_data()), Catalog(database.load_tracks_data())
+    assert first.version == second.version == database.load_tracks_data().attrs['sha1']
+    for catalog in (first, second):
+        feature_store.FeatureStore(catalog)
+        recommender.build_state(catalog)
+    assert sorted(builds) == ['_build_arrays', '_build_features']
@@ -0,0 +1,82 @@
+"""
+Staged startup: stage ordering, and routes answering 503 with Retry-After
+until the stages they need are ready.
+"""
+import pytest
+from scripts import recommender
+from scripts.startup import Startup, startup, RETRY_AFTER
+
+
+@pytest.fixture
+def building(monkeypatch):
+    """
+    Put startup stages back to running for one test.
+    """
+    def mark(*names):
+        for name in names:
+            monkeypatch.setitem(startup.status[name], 'status', 'running')
+    return mark
+
+
+def test_stages_run_after_their_dependencies():
+    stages = Startup()
+    ran = []
+    stages.add('a', lambda: ran.append('a'))
+    stages.add('b', lambda: ran.append('b'), after=['a'])
+    stages.add('c', lambda: 1 / 0, after=['a'])
+    stages.add('d', lambda: ran.append('d'), after=['b', 'c'])
+    stages.start()
+    assert not stages.wait()
+
+    assert ran == ['a', 'b']
+    assert stages.failed() == ['c', 'd']
+    assert stages.status['d']['error'] == 'skipped: c failed'
+    assert stages.unavailable('a', 'b') is None
+    assert stages.unavailable('d')[1] == 500
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        Startup().add('a', lambda: None, after=['b'])
+
+
+def assert_retry_later(response):
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(RETRY_AFTER)
+    assert response.get_json()["retry_after"] == RETRY_AFTER
+
+
+def test_routes_wait_for_the_recommender(client, building):
+    building('recommender')
+    assert_retry_later(client.get('/songs/recommend?track_id=track00002'))
+    assert_retry_later(client.get('/evaluate_model?n=5'))
+    # /recommend_full only needs the feature store
+    assert client.get('/songs/recommend_full?track_id=track00002').status_code == 200
+
+
+def test_search_opens_before_the_recommender(client, building, monkeypatch):
+    building('recommender')
+    monkeypatch.setattr(recommender, 'state', None)
+    response = client.get('/songs/search?q=song')
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert results and all(result["in_sample"] is None for result in results)
+
+
+def test_search_waits_for_its_index(client, building):
+    building('search_index')
+    assert_retry_later(client.get('/songs/search?q=song'))
+
+
+def test_catalog_routes_wait_for_the_catalog(client, building):
+    building('catalog')
+    assert_retry_later(client.get('/test_connection'))
+
+
+def test_ready(client, building):
+    assert client.get('/ready').status_code == 200
+    building('feature_store')
+    assert client.get('/ready').status_code == 503
+    assert client.get('/ready?stages=search_index,lookup').status_code == 200
+    assert client.get('/ready?stages=nope').status_code == 400
+    assert client.get('/health').get_json()["status"] == 'starting'
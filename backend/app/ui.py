@@ -1,9 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for
-import requests
+from scripts import service
 
 ui = Blueprint("ui", __name__)
 
-API_BASE = "http://127.0.0.1:5000"  # same server during local dev
+# pages call the service layer directly (same functions as the /songs JSON routes)
 
 @ui.route("/")
 def home():
@@ -16,10 +16,9 @@ def search_page():
     message = None
     if q:
         try:
-            r = requests.get(f"{API_BASE}/songs/search", params={"q": q})
-            data = r.json()
+            data, _ = service.search(q)
             results = data.get("results", [])
-            message = data.get("message")
+            message = data.get("message", data.get("error"))
         except Exception as e:
             message = f"Error: {e}"
     return render_template("search.html", q=q, results=results, message=message)
@@ -28,8 +27,7 @@ def search_page():
 def details_page(track_id):
     data = {}
     try:
-        r = requests.get(f"{API_BASE}/songs/details/{track_id}")
-        data = r.json()
+        data, _ = service.song_details(track_id)
     except Exception as e:
         data = {"error": str(e)}
     return render_template("details.html", song=data)
@@ -43,7 +41,7 @@ def recommend_page():
         params = {"k": 5}  # tweak if we want a different default
         if request.args.get("k"): params["k"] = int(request.args.get("k"))
         if request.args.get("same_genre") is not None:
-            params["same_genre"] = request.args.get("same_genre")
+            params["same_genre"] = request.args.get("same_genre").lower() == "true"
 
         if track_id:
             params["track_id"] = track_id
@@ -53,8 +51,7 @@ def recommend_page():
             return redirect(url_for("ui.search_page"))
 
         # Use the full-dataset recommender
-        r = requests.get(f"{API_BASE}/songs/recommend_full", params=params)
-        payload = r.json()
+        payload, _ = service.recommend_full(**params)
     except Exception as e:
         payload = {"error": str(e)}
     return render_template("recommend.html", data=payload)
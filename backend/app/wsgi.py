@@ -0,0 +1,18 @@
+"""
+Production entry point: the app with batched scoring turned on.
+
+From backend/app:
+    gunicorn -c gunicorn.conf.py    (pre-forked workers sharing one copy of the data)
+    python wsgi.py                  (threaded development server)
+
+Pool size, batching window and queue limit come from the SCORING_WORKERS,
+BATCH_WINDOW_MS, BATCH_MAX_SIZE, SCORING_MAX_QUEUE and SCORING_RETRY_AFTER
+environment variables (see scripts/serving.py).
+"""
+from app import app
+from scripts import service
+
+service.enable_batching()
+
+if __name__ == '__main__':
+    app.run(threaded=True)